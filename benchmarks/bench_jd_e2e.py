@@ -0,0 +1,197 @@
+"""
+不依赖 odoo 和外网, 按物流方法里的调用方式压测本地模拟京东接口, 模拟服务器会校验每个请求的签名
+两种京东物流共用同一个 api 包和进程内客户端, 这里只直接调用 JDApi, 不经过物流方法, 只跑一遍
+括号里是按同样方式调用接口的物流方法, 这些方法本身(订单读取, 产品选择, 缓存和回写)用 bench_jd_odoo.py 在 odoo shell 里测
+
+    运费预检: 每张订单一个 precheck, 用 jd_executor.fan_out 并发 (jd_rate_shipment_multi / 基於規則的可達性檢查)
+    下单:     每张订单一个 create, 用 jd_executor.fan_out 并发 (jd_send_shipping_batch / jd_mix_rule_send_shipping_batch)
+    取消:     按批量大小分组并发 cancel (jd_cancel_shipment_batch)
+    运费对账: 按批量大小分组并发 actualfee/query (_jd_reconcile_actual_fees)
+    面单:     按批量大小分组并发 print (jd_fetch_labels)
+
+    python benchmarks/bench_jd_e2e.py [--orders 2000] [--latency 0.02] [--workers 8] [--batch-size 1]
+
+签名校验失败或者出现非注入的失败时退出码不为 0, 可以直接放进 CI
+"""
+import argparse
+import base64
+import sys
+import time
+
+from common import load_jd_api, report
+from jd_mock_server import JDMockServer
+
+APP_KEY, APP_SECRET, ACCESS_TOKEN = 'bench-key', 'bench-secret', 'bench-token'
+
+
+def chunks(items, size):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def timed_fan_out(api_pkg, jobs, workers):
+    """
+    :return: (结果列表, 每个请求的耗时, 总耗时)
+    """
+    samples = []
+    timed_jobs = []
+    for api, method, data in jobs:
+        timed_jobs.append((TimedApi(api, samples), method, data))
+    started = time.perf_counter()
+    results = api_pkg.jd_executor.fan_out(timed_jobs, workers)
+    return results, samples, time.perf_counter() - started
+
+
+class TimedApi:
+    """ 记录每次接口调用耗时, 其余属性转给原来的 JDApi """
+
+    def __init__(self, api, samples):
+        self._api = api
+        self._samples = samples
+
+    def __getattr__(self, name):
+        attr = getattr(self._api, name)
+        if not name.startswith(('orders_', 'ecap_')):
+            return attr
+
+        def call(data):
+            begin = time.perf_counter()
+            try:
+                return attr(data)
+            finally:
+                self._samples.append(time.perf_counter() - begin)
+        return call
+
+    def with_debug_logger(self, debug_logger):
+        return TimedApi(self._api.with_debug_logger(debug_logger), self._samples)
+
+
+def precheck_payload(index):
+    return [{
+        "senderContact": {"fullAddress": "北京市大兴区亦庄经济开发区科创十一街18号"},
+        "receiverContact": {"fullAddress": "上海市浦东新区张江路%d号" % index},
+        "orderOrigin": "1",
+        "customerCode": "010K0000000",
+        "productsReq": {"productCode": "ed-m-0001"},
+        "cargoes": [{"name": "商品", "quantity": 1, "weight": 1.5, "volume": 1000}],
+    }]
+
+
+def create_payload(index):
+    return {
+        "orderId": "S%06d" % index,
+        "senderContact": {"name": "公司", "mobile": "13800000000", "fullAddress": "北京市大兴区亦庄经济开发区"},
+        "receiverContact": {"name": "客户%d" % index, "mobile": "13900000000",
+                            "fullAddress": "上海市浦东新区张江路%d号" % index},
+        "orderOrigin": "1",
+        "customerCode": "010K0000000",
+        "productsReq": {"productCode": "ed-m-0001"},
+        "settleType": "3",
+        "cargoes": [{"name": "PACK%06d" % index, "quantity": 1, "weight": 1.5, "volume": 1000}],
+        "CommonChannelInfo": {"channelCode": "0030001"},
+    }
+
+
+def count_failures(api, results, keys_list):
+    failed = 0
+    for (result, exc), keys in zip(results, keys_list):
+        if exc is not None:
+            failed += len(keys)
+            continue
+        failed += sum(1 for item in api.split_batch_result(result, keys) if not item['success'])
+    return failed
+
+
+def count_bad_labels(api, results, keys_list):
+    """
+    面单按 jd_fetch_labels 读取的 pdfContent 字段解码, 不是 PDF 的算作失败
+    """
+    bad = 0
+    for (result, exc), keys in zip(results, keys_list):
+        if exc is None:
+            bad += sum(1 for item in api.split_batch_result(result, keys) if item['success'] and not base64.b64decode(
+                item['data'].get('pdfContent') or '').startswith(b'%PDF-'))
+    return bad
+
+
+def run(server, args):
+    """
+    与 new_jd_client 一样取进程内共享的客户端再绑定日志
+    """
+    api_pkg = load_jd_api()
+    session = api_pkg.jd_session.get_session(pool_maxsize=max(args.workers, 1))
+    api = api_pkg.jd_api.get_client(APP_KEY, APP_SECRET, ACCESS_TOKEN, base_uri=server.base_uri,
+                                    session=session).bind(lambda *a: None, debug_logging=False)
+    failures = 0
+    orders = list(range(args.orders))
+
+    # 运费预检, 每张订单一个请求
+    jobs = [(api, 'ecap_v1_orders_precheck', precheck_payload(index)) for index in orders]
+    results, samples, elapsed = timed_fan_out(api_pkg, jobs, args.workers)
+    failures += count_failures(api, results, [[None]] * len(jobs))
+    report('precheck', samples, elapsed)
+    print("%-32s %10.1f orders/s" % ('', len(orders) / elapsed))
+
+    # 下单接口每次只处理一个订单, 与 send_shipping_batch 一样并发请求
+    batches = [[create_payload(index)] for index in orders]
+    jobs = [(api, 'orders_create', batch) for batch in batches]
+    results, samples, elapsed = timed_fan_out(api_pkg, jobs, args.workers)
+    failures += count_failures(api, results, [[val['orderId'] for val in batch] for batch in batches])
+    report('create', samples, elapsed)
+    print("%-32s %10.1f orders/s" % ('', len(orders) / elapsed))
+    waybills = []
+    for (result, exc), batch in zip(results, batches):
+        if exc is None:
+            waybills += [item['data'].get('waybillCode') for item in api.split_batch_result(
+                result, [val['orderId'] for val in batch]) if item['success']]
+
+    for title, method, build in [
+        ('cancel', 'orders_cancel', lambda code: {"waybillCode": code, "orderOrigin": "1",
+                                                  "customerCode": "010K0000000", "cancelReason": "用户发起取消",
+                                                  "cancelReasonCode": "1", "cancelType": 1}),
+        ('actualfee', 'orders_actualfee_query', lambda code: {"waybillCode": code, "orderOrigin": "1",
+                                                              "customerCode": "010K0000000"}),
+        ('print', 'orders_print', lambda code: {"waybillCode": code, "orderOrigin": "1",
+                                                "customerCode": "010K0000000"}),
+    ]:
+        batches = list(chunks(waybills, args.batch_size))
+        jobs = [(api, method, [build(code) for code in batch]) for batch in batches]
+        results, samples, elapsed = timed_fan_out(api_pkg, jobs, args.workers)
+        failures += count_failures(api, results, batches)
+        if method == 'orders_print':
+            failures += count_bad_labels(api, results, batches)
+        report('%s x%d' % (title, args.batch_size), samples, elapsed)
+        print("%-32s %10.1f waybills/s" % ('', len(waybills) / elapsed if elapsed else 0.0))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--http-error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    injected = args.error_rate or args.http_error_rate
+    with JDMockServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      http_error_rate=args.http_error_rate, verify_sign=True, app_secret=APP_SECRET,
+                      access_token=ACCESS_TOKEN, seed=args.seed) as server:
+        failures = run(server, args)
+        print("requests: %s" % ", ".join("%s=%s" % item for item in sorted(server.counters.items())))
+    sign_errors = server.counters.get('sign_error', 0)
+    if sign_errors:
+        print("FAILED: %d requests with invalid signature" % sign_errors)
+        return 1
+    if failures and not injected:
+        print("FAILED: %d unexpected failures" % failures)
+        return 1
+    print("failures: %d (injected)" % failures if injected else "ok")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+在 odoo shell 里对真实数据跑物流方法, 京东接口指向本地模拟服务器, bench_jd_e2e.py 只测接口调用这一层
+
+    BENCH_ORDERS=500 BENCH_LATENCY=0.02 odoo-bin shell -d 数据库 --no-http < benchmarks/bench_jd_odoo.py
+
+    jd_rate_shipment_multi / jd_send_shipping_batch / jd_cancel_shipment_batch / jd_fetch_labels
+    _jd_reconcile_actual_fees
+    jd_mix_rule_rate_shipment_multi / jd_mix_rule_send_shipping_batch / jd_mix_rule_cancel_shipment_batch
+
+指标, 熔断状态, 可达性和报价缓存平时用单独的游标提交, 这里让注册表进入测试模式,
+这些游标都落在 shell 的事务里, 结束后与面单缓存目录一起回滚清理, 不会留下任何数据
+需要数据库里已经有对应的物流和已确认的销售订单, 没有的部分会跳过
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.environ.get('BENCH_DIR') or os.path.join(os.getcwd(), 'benchmarks'))
+
+from jd_mock_server import JDMockServer  # noqa: E402
+
+
+def measure(title, func, count):
+    queries = env.cr.sql_log_count  # noqa: F821
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    print("%-40s n=%-6d %8.2fs %10.1f/s %8d queries" % (
+        title, count, elapsed, count / elapsed if elapsed else 0.0, env.cr.sql_log_count - queries))  # noqa: F821
+    return result
+
+
+def write_tracking_refs(pickings, results):
+    """
+    把下单结果的运单号写到调拨上, 后面的取消, 面单和对账按运单号请求
+    """
+    shipped = pickings.filtered(lambda p: 'tracking_number' in results.get(p.id, {}))
+    for picking in shipped:
+        picking.carrier_tracking_ref = results[picking.id]['tracking_number']
+    return shipped
+
+
+def bench(env, count, latency, workers, label_dir):
+    icp = env['ir.config_parameter'].sudo()
+    icp.set_param('delivery_jd.label_cache_dir', label_dir)
+    orders = env['sale.order'].search([('state', '=', 'sale'), ('partner_shipping_id', '!=', False)], limit=count)
+    pickings = env['stock.picking'].search([('sale_id', 'in', orders.ids), ('picking_type_code', '=', 'outgoing')])
+    print("orders=%d pickings=%d latency=%.3fs workers=%d" % (len(orders), len(pickings), latency, workers))
+
+    carrier = env['delivery.carrier'].search([('delivery_type', '=', 'jd')], limit=1)
+    if carrier:
+        _key, secret, token, _expire = carrier._jd_credentials()
+        with JDMockServer(latency=latency, verify_sign=True, app_secret=secret, access_token=token or '') as server:
+            icp.set_param('delivery_jd.api_base_uri', server.base_uri)
+            icp.set_param('delivery_jd.max_workers', workers)
+            icp.set_param('delivery_jd.quote_cache_ttl', 0)
+            measure('jd_rate_shipment_multi', lambda: carrier.jd_rate_shipment_multi(orders), len(orders))
+            results = measure('jd_send_shipping_batch', lambda: carrier.jd_send_shipping_batch(pickings),
+                              len(pickings))
+            shipped = write_tracking_refs(pickings, results)
+            measure('jd_fetch_labels', lambda: carrier.jd_fetch_labels(shipped), len(shipped))
+            measure('_jd_reconcile_actual_fees', lambda: shipped._jd_reconcile_actual_fees(carrier), len(shipped))
+            measure('jd_cancel_shipment_batch', lambda: carrier.jd_cancel_shipment_batch(shipped), len(shipped))
+            print("  %s" % server.counters)
+
+    carrier = env['delivery.carrier'].search([('delivery_type', '=', 'jd_mix_rule')], limit=1)
+    if carrier:
+        _key, secret, token, _customer_code = carrier.jd_mix_rule_config_params()
+        with JDMockServer(latency=latency, verify_sign=True, app_secret=secret, access_token=token) as server:
+            icp.set_param('delivery_jd_mix_rule.api_base_uri', server.base_uri)
+            icp.set_param('delivery_jd_mix_rule.max_workers', workers)
+            carrier.jd_mix_rule_invalidate_serviceability()
+            measure('jd_mix_rule_rate_shipment_multi (cold)',
+                    lambda: carrier.jd_mix_rule_rate_shipment_multi(orders), len(orders))
+            measure('jd_mix_rule_rate_shipment_multi (warm)',
+                    lambda: carrier.jd_mix_rule_rate_shipment_multi(orders), len(orders))
+            results = measure('jd_mix_rule_send_shipping_batch',
+                              lambda: carrier.jd_mix_rule_send_shipping_batch(pickings), len(pickings))
+            shipped = write_tracking_refs(pickings, results)
+            measure('jd_mix_rule_cancel_shipment_batch',
+                    lambda: carrier.jd_mix_rule_cancel_shipment_batch(shipped), len(shipped))
+            print("  %s" % server.counters)
+
+
+label_dir = tempfile.mkdtemp(prefix='bench_jd_labels_')
+env.registry.enter_test_mode(env.cr)  # noqa: F821
+try:
+    bench(env,  # noqa: F821
+          int(os.environ.get('BENCH_ORDERS', 500)),
+          float(os.environ.get('BENCH_LATENCY', 0.02)),
+          int(os.environ.get('BENCH_WORKERS', 8)),
+          label_dir)
+finally:
+    env.registry.leave_test_mode()  # noqa: F821
+    env.cr.rollback()  # noqa: F821
+    env.registry.clear_caches()  # noqa: F821
+    shutil.rmtree(label_dir, ignore_errors=True)
@@ -0,0 +1,48 @@
+"""
+对比每次新建连接与共享长连接会话调用本地模拟京东接口的耗时
+
+    python benchmarks/bench_jd_session.py [调用次数] [模拟延迟秒数]
+"""
+import sys
+import time
+
+import requests
+
+from common import load_jd_api, report
+from jd_mock_server import JDMockServer
+
+
+class OneShotSession:
+    """ 旧的行为: 每次调用模块级 requests.request """
+
+    def request(self, method, url, idempotent=False, **kwargs):
+        return requests.request(method, url, **kwargs)
+
+
+def run(jd_api, session, base_uri, calls):
+    api = jd_api.JDApi('key', 'secret', 'token', lambda *args: None, session=session, base_uri=base_uri)
+    payload = [{"receiverContact": {"fullAddress": "北京市大兴区亦庄经济开发区"}, "orderOrigin": "1"}]
+    samples = []
+    started = time.perf_counter()
+    for _ in range(calls):
+        begin = time.perf_counter()
+        api.ecap_v1_orders_precheck(payload).json()
+        samples.append(time.perf_counter() - begin)
+    return samples, time.perf_counter() - started
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    api_pkg = load_jd_api()
+    with JDMockServer(latency=latency) as server:
+        for title, session in [
+            ('requests.request (new conn)', OneShotSession()),
+            ('JDSession (keep-alive pool)', api_pkg.jd_session.JDSession()),
+        ]:
+            run(api_pkg.jd_api, session, server.base_uri, 10)
+            report(title, *run(api_pkg.jd_api, session, server.base_uri, calls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+对比原来每次拼接字符串计算签名与 JDSigner 预编码前缀的签名速度
+
+    python benchmarks/bench_jd_signer.py [签名次数]
+"""
+import base64
+import hashlib
+import hmac
+import json
+import sys
+import time
+from datetime import datetime
+
+from common import load_jd_api
+
+
+def legacy_sign(algorithm, data, secret):
+    if algorithm == "md5-salt":
+        h = hashlib.md5()
+        h.update(data)
+        return h.digest().hex()
+    elif algorithm == "HMacSHA256":
+        return base64.b64encode(hmac.new(secret, data, hashlib.sha256).digest()).decode("UTF-8")
+    raise NotImplementedError(algorithm)
+
+
+def legacy_compute_params(app_key, app_secret, access_token, algorithm, body, path, timestamp=None):
+    timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    content = "".join([
+        app_secret,
+        "access_token", access_token,
+        "app_key", app_key,
+        "method", path,
+        "param_json", body,
+        "timestamp", timestamp,
+        "v", "2.0",
+        app_secret,
+    ])
+    sign_ = legacy_sign(algorithm, content.encode("UTF-8"), app_secret.encode("UTF-8"))
+    return {
+        "LOP-DN": "ECAP",
+        "app_key": app_key,
+        "access_token": access_token,
+        "timestamp": timestamp,
+        "v": "2.0",
+        "sign": sign_,
+        "algorithm": algorithm
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    jd_signer = load_jd_api().jd_signer
+    path = "/ecap/v1/orders/precheck"
+    body = json.dumps([{"receiverContact": {"fullAddress": "北京市大兴区亦庄经济开发区科创十一街18号"},
+                        "orderOrigin": "1", "customerCode": "010K0000000"}], ensure_ascii=False)
+    for algorithm in ("md5-salt", "HMacSHA256"):
+        signer = jd_signer.JDSigner("app-key", "app-secret", "access-token", algorithm=algorithm)
+        timestamp = "2024-01-01 00:00:00"
+        expected = legacy_compute_params("app-key", "app-secret", "access-token", algorithm, body, path, timestamp)
+        assert signer.sign(path, body.encode("UTF-8"), timestamp) == expected["sign"], algorithm
+
+        started = time.perf_counter()
+        for _ in range(count):
+            legacy_compute_params("app-key", "app-secret", "access-token", algorithm, body, path)
+        legacy = count / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for _ in range(count):
+            signer.params(path, body.encode("UTF-8"))
+        current = count / (time.perf_counter() - started)
+        print("%-12s legacy=%10.0f sign/s  signer=%10.0f sign/s  x%.2f" % (algorithm, legacy, current, current / legacy))
+
+
+if __name__ == '__main__':
+    main()
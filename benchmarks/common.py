@@ -0,0 +1,37 @@
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_jd_api():
+    """
+    不依赖 odoo 直接加载 delivery_jd_hooks 的 api 包, 两种京东物流共用, api 包本身只依赖 requests
+    """
+    name = 'bench_jd_hooks_api'
+    if name in sys.modules:
+        return sys.modules[name]
+    path = os.path.join(ROOT, 'delivery_jd_hooks', 'api')
+    spec = importlib.util.spec_from_file_location(name, os.path.join(path, '__init__.py'),
+                                                  submodule_search_locations=[path])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def report(title, samples, elapsed=None):
+    line = "%-32s n=%-6d p50=%8.2fms p99=%8.2fms" % (
+        title, len(samples), percentile(samples, 50) * 1000, percentile(samples, 99) * 1000)
+    if elapsed:
+        line += " %10.1f req/s" % (len(samples) / elapsed)
+    print(line)
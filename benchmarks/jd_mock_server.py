@@ -0,0 +1,239 @@
+"""
+本地模拟的京东 ECAP 接口, 不需要网络就能压测和验证签名
+
+支持 预检(precheck), 下单(create), 取消(cancel), 实际运费查询(actualfee/query), 面单(print)
+可以设置固定延迟, 随机抖动, 业务失败比例和 HTTP 503 比例, 随机数种子固定时结果可复现
+
+    python benchmarks/jd_mock_server.py [--port 8800] [--latency 0.05] [--error-rate 0.01]
+
+在 odoo 里把 delivery_jd.api_base_uri / delivery_jd_mix_rule.api_base_uri 设为 http://127.0.0.1:8800 即可使用
+"""
+import argparse
+import base64
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from common import load_jd_api
+
+PRECHECK_PATH = '/ecap/v1/orders/precheck'
+CREATE_PATH = '/ecap/v1/orders/create'
+CANCEL_PATH = '/ecap/v1/orders/cancel'
+ACTUALFEE_PATH = '/ecap/v1/orders/actualfee/query'
+PRINT_PATH = '/ecap/v1/orders/print'
+
+
+def _label_pdf():
+    """
+    只有一页空白页的 PDF, 用来模拟面单, 带有交叉引用表, 能被 odoo 的 PDF 读取器解析
+    """
+    objects = [
+        b"<</Type/Catalog/Pages 2 0 R>>",
+        b"<</Type/Pages/Kids[3 0 R]/Count 1>>",
+        b"<</Type/Page/Parent 2 0 R/MediaBox[0 0 283 425]>>",
+    ]
+    pdf, offsets = b"%PDF-1.4\n", []
+    for idnum, obj in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (idnum, obj)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    return pdf + b"trailer\n<</Size %d/Root 1 0 R>>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+
+LABEL_PDF = _label_pdf()
+
+
+def expected_sign(params, path, body, app_secret, access_token):
+    """
+    按京东文档拼接签名内容, 使用 JDApi.sign 计算, 不经过 JDSigner, 用来校验客户端的签名
+    """
+    jd_api = load_jd_api().jd_api
+    return jd_api.JDApi.sign_request(params.get("app_key", ""), app_secret, access_token, path, body,
+                                     params.get("timestamp", ""), algorithm=params.get("algorithm", "md5-salt"),
+                                     v=params.get("v", ""))
+
+
+class JDMockHandler(BaseHTTPRequestHandler):
+    # 使用 HTTP/1.1 才能保持长连接
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体合并发送, 避免 Nagle 与延迟确认叠加造成的 40ms 停顿
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        server = self.server
+        server.count(url.path)
+        delay = server.latency + (server.rng_uniform(0, server.jitter) if server.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+        if server.http_error_rate and server.rng_random() < server.http_error_rate:
+            return self._send(503, {'success': False, 'code': 503, 'msg': 'Service Unavailable'})
+        handler = server.handlers.get(url.path)
+        if handler is None:
+            return self._send(404, {'success': False, 'code': 404, 'msg': 'Not Found'})
+        if server.verify_sign:
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            sign = expected_sign(params, url.path, body, server.app_secret, server.access_token)
+            if params.get('sign') != sign:
+                server.count('sign_error')
+                return self._send(200, {'success': False, 'code': 1000, 'msg': 'sign error', 'subMsg': '签名错误'})
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return self._send(200, {'success': False, 'code': 1001, 'msg': 'param_json error'})
+        self._send(200, handler(server, data))
+
+    def _send(self, status, result):
+        body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _batch(server, data, build):
+    """
+    批量接口逐条返回结果, 按 error_rate 随机让单条失败
+    """
+    items = data if isinstance(data, list) else [data]
+    res = []
+    for item in items:
+        if server.error_rate and server.rng_random() < server.error_rate:
+            res.append({'success': False, 'code': 2000, 'subMsg': '模拟业务失败',
+                        'orderId': item.get('orderId'), 'waybillCode': item.get('waybillCode')})
+        else:
+            res.append(build(item))
+    if len(res) == 1 and not res[0].get('success', True):
+        return {'success': False, 'code': 2000, 'msg': 'failed', 'subMsg': res[0]['subMsg']}
+    return {'success': True, 'code': 0, 'msg': 'ok', 'data': res if isinstance(data, list) else res[0]}
+
+
+def handle_precheck(server, data):
+    return _batch(server, data[0] if isinstance(data, list) and len(data) == 1 else data,
+                  lambda item: {'totalFreightStandard': server.price})
+
+
+def handle_create(server, data):
+    # 与京东一致, 下单接口每次只处理参数列表里的一个订单, 返回单条结果
+    return _batch(server, data[0] if isinstance(data, list) else data, lambda item: {
+        'orderId': item.get('orderId'),
+        'waybillCode': 'JDV%012d' % next(server.waybill_seq),
+        'freightPre': server.price,
+    })
+
+
+def handle_cancel(server, data):
+    return _batch(server, data, lambda item: {'waybillCode': item.get('waybillCode')})
+
+
+def handle_actualfee(server, data):
+    return _batch(server, data, lambda item: {
+        'waybillCode': item.get('waybillCode'),
+        'totalFreightActual': server.price,
+    })
+
+
+def handle_print(server, data):
+    content = base64.b64encode(LABEL_PDF).decode('ascii')
+    return _batch(server, data, lambda item: {'waybillCode': item.get('waybillCode'), 'pdfContent': content})
+
+
+class JDMockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    handlers = {
+        PRECHECK_PATH: handle_precheck,
+        CREATE_PATH: handle_create,
+        CANCEL_PATH: handle_cancel,
+        ACTUALFEE_PATH: handle_actualfee,
+        PRINT_PATH: handle_print,
+    }
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, jitter=0.0, error_rate=0.0, http_error_rate=0.0,
+                 verify_sign=False, app_secret='secret', access_token='token', price=12.0, seed=None):
+        """
+        :param latency: 每个请求固定的延迟秒数
+        :param jitter: 在固定延迟上再随机增加 0 ~ jitter 秒
+        :param error_rate: 单条数据返回业务失败的比例
+        :param http_error_rate: 整个请求返回 503 的比例
+        :param verify_sign: 按 app_secret 和 access_token 校验签名
+        """
+        super().__init__(address, JDMockHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.verify_sign = verify_sign
+        self.app_secret = app_secret
+        self.access_token = access_token
+        self.price = price
+        self.waybill_seq = itertools.count(1)
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.thread = None
+
+    def rng_random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def rng_uniform(self, low, high):
+        with self._lock:
+            return self._rng.uniform(low, high)
+
+    def count(self, key):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    @property
+    def base_uri(self):
+        return 'http://%s:%s' % self.server_address[:2]
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--http-error-rate', type=float, default=0.0)
+    parser.add_argument('--verify-sign', action='store_true')
+    parser.add_argument('--app-secret', default='secret')
+    parser.add_argument('--access-token', default='token')
+    args = parser.parse_args()
+    server = JDMockServer((args.host, args.port), latency=args.latency, jitter=args.jitter,
+                          error_rate=args.error_rate, http_error_rate=args.http_error_rate,
+                          verify_sign=args.verify_sign, app_secret=args.app_secret, access_token=args.access_token)
+    print("JD mock server listening on %s" % server.base_uri)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
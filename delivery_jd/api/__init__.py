@@ -1 +0,0 @@
-from . import jd_api
@@ -2,8 +2,9 @@ import json
 import logging
 import pprint
 import hmac
+from datetime import datetime, timedelta
 
-from werkzeug.exceptions import Forbidden
+from werkzeug.exceptions import BadRequest, Forbidden
 from werkzeug.urls import url_encode, url_join
 from werkzeug.utils import redirect
 
@@ -11,6 +12,8 @@ from odoo import http
 from odoo.exceptions import ValidationError
 from odoo.http import request
 from odoo.tools import hmac as hmac_tool
+from odoo.addons.delivery_jd_hooks.api.jd_api import JDApi
+from odoo.addons.delivery_jd.models.delivery_carrier_inherit import JD_TRACK_MAX_SKEW, JD_TRACK_SIGN_ALGORITHM
 
 _logger = logging.getLogger(__name__)
 
@@ -43,6 +46,58 @@ class JDDeliveryController(http.Controller):
         url = self._compute_delivery_carrier_url(delivery_carrier_id)
         return redirect(url)
 
+    @http.route('/jd_delivery/track', type='http', methods=['POST'], auth='public', csrf=False)
+    def jd_delivery_track_push(self, **params):
+        """
+        接收京东物流轨迹推送, 签名方式与调用京东接口相同, 验签后整批写入暂存表, 由定时任务更新调拨
+        """
+        body = request.httprequest.get_data()
+        if not self._verify_track_signature(params, body):
+            _logger.warning("京东物流轨迹推送验签失败: %s", params.get('app_key'))
+            raise Forbidden()
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise BadRequest()
+        if isinstance(data, dict):
+            data = data.get('data') if isinstance(data.get('data'), list) else [data]
+        count = request.env['delivery.jd.track.event'].sudo().ingest(data if isinstance(data, list) else [])
+        return request.make_json_response({'code': 0, 'success': True, 'msg': 'success', 'count': count})
+
+    @staticmethod
+    def _verify_track_signature(params, body):
+        """
+        accessToken 和签名算法使用物流上的配置, 不使用请求里传过来的值
+        时间戳超出允许的偏差时直接拒绝, 重复的推送由暂存表按 运单号+操作时间+状态 去重
+        """
+        carrier_model = request.env['delivery.carrier'].sudo()
+        try:
+            app_key, app_secret = carrier_model.get_jd_access_info()
+        except ValidationError:
+            return False
+        sign = params.get('sign')
+        timestamp = params.get('timestamp')
+        if not sign or not timestamp or params.get('app_key') != app_key:
+            return False
+        try:
+            # 京东的时间戳是东八区时间
+            sent_at = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S") - timedelta(hours=8)
+        except ValueError:
+            return False
+        if abs((datetime.utcnow() - sent_at).total_seconds()) > JD_TRACK_MAX_SKEW:
+            _logger.warning("京东物流轨迹推送时间戳超出允许范围: %s", timestamp)
+            return False
+        method = params.get('method') or request.httprequest.path
+        for access_token in carrier_model.jd_track_access_tokens():
+            try:
+                expected = JDApi.sign_request(app_key, app_secret, access_token, method, body, timestamp,
+                                              algorithm=JD_TRACK_SIGN_ALGORITHM)
+            except NotImplementedError:
+                return False
+            if hmac.compare_digest(expected, sign):
+                return True
+        return False
+
     @staticmethod
     def _compute_delivery_carrier_url(delivery_carrier_id):
         action = request.env.ref('delivery.action_delivery_carrier_form', raise_if_not_found=False)
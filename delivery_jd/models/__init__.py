@@ -2,3 +2,10 @@
 
 from . import delivery_carrier_inherit
 from . import stock_package_type
+from . import stock_picking
+from . import jd_quote_cache
+from . import jd_shipment_job
+from . import sale_order
+from . import jd_track_event
+from . import jd_product_rule
+from . import res_config_settings
@@ -1,16 +1,45 @@
 # -*- coding: utf-8 -*-
 
-from odoo import api, fields, models, registry, SUPERUSER_ID, _
+from odoo import api, fields, models, registry, tools, SUPERUSER_ID, _
 from odoo.exceptions import ValidationError, UserError
 from odoo.tools.misc import hmac as hmac_tool
 from odoo.tools import float_compare, float_round
-from odoo.addons.delivery_jd.api.jd_api import JDApi
+from odoo.addons.delivery_jd_hooks.api import jd_executor, jd_session
+from odoo.addons.delivery_jd_hooks.tools.jd_client import new_jd_client
+from odoo.addons.delivery_jd_hooks.tools.jd_config import get_param
+from odoo.addons.delivery_jd_hooks.tools.jd_dispatch import JD_EXPRESS_MAX_WEIGHT, EXPRESS_ORDER_ORIGIN, \
+    FREIGHT_ORDER_ORIGIN, FREIGHT_PRODUCT_CODE, JDProduct, apply_product, call_in_batches, choose_product, \
+    eligible_products, fastest_product
+from odoo.addons.delivery_jd_hooks.tools.jd_package import pickings_package_cargoes
+from odoo.addons.delivery_jd_hooks.tools.jd_sale_order import pickings_sale_orders, shipping_order_id
+from odoo.addons.delivery_jd_hooks.tools.jd_sender import order_sender_partner, pickings_sender_partners, \
+    sender_contact
+from .jd_label import JDLabelCache, label_content
 from werkzeug import urls
 from dateutil.relativedelta import relativedelta
+from concurrent.futures import ThreadPoolExecutor
 
+import logging
 import requests
 import json
 
+_logger = logging.getLogger(__name__)
+
+# 这些字段变化时需要清空进程内缓存的密钥
+JD_CREDENTIAL_FIELDS = {'delivery_type', 'prod_environment', 'jd_access_token', 'jd_access_expire'}
+# 这些字段变化时需要重新编译产品表
+JD_PRODUCT_FIELDS = {'jd_order_origin', 'jd_main_product_code', 'jd_business_unit_code', 'jd_product_rule_ids'}
+JD_TOKEN_EXPIRE_WARNING_DAYS = 7
+# 轨迹推送的时间戳与服务器时间相差超过这个秒数时拒绝, 防止重放
+JD_TRACK_MAX_SKEW = 300
+JD_TRACK_SIGN_ALGORITHM = 'md5-salt'
+JD_METRICS_INTERVAL = 300
+# 预检结果在调拨上保留的时间, 请求数据没有变化时不再重复预检
+JD_PRECHECK_TTL = 12 * 3600
+# 下单数据里预检接口需要的字段
+JD_PRECHECK_KEYS = ('senderContact', 'receiverContact', 'orderOrigin', 'customerCode', 'businessUnitCode',
+                    'productsReq', 'cargoes')
+
 
 class DeliveryCarrier(models.Model):
     _inherit = 'delivery.carrier'
@@ -30,10 +59,122 @@ class DeliveryCarrier(models.Model):
     jd_main_product_code = fields.Selection(selection=[('ed-m-0001', '京东标快'), ('ed-m-0002', '京东特快')],
                                             string="主产品编码")
     jd_default_package_type_id = fields.Many2one('stock.package.type', string='京东默认包裹类型')
+    jd_shipping_mode = fields.Selection(selection=[('sync', '验证时下单'), ('queued', '后台排队下单')],
+                                        string="下单方式", default='sync',
+                                        help="后台排队下单时, 验证调拨只记录下单任务, 由定时任务批量调用京东下单接口")
+    jd_multi_parcel = fields.Boolean(string="按包裹下单",
+                                     help="按调拨里装箱的包裹逐个申报重量和体积, 没有装箱的部分合并为一个包裹")
+    jd_split_shipment = fields.Boolean(string="多仓拆单发货",
+                                       help="同一订单分多张调拨从不同仓库发货时, 每张调拨单独生成运单, "
+                                            "京东订单号使用 订单号-调拨ID 区分")
+    jd_product_rule_ids = fields.One2many('delivery.jd.product.rule', 'carrier_id', string="产品选择规则",
+                                          help="按重量找出所有适用的产品一起询价, 没有规则时使用主产品, "
+                                               "填写了事业部编码时超过 30kg 的货物自动走快运")
+    jd_product_strategy = fields.Selection(selection=[('cheapest', '运费最低'), ('fastest', '时效最快')],
+                                           string="产品选择方式", default='cheapest')
+    jd_access_state = fields.Selection(selection=[
+        ('missing', '未授权'),
+        ('expired', '已过期'),
+        ('expiring', '即将过期'),
+        ('valid', '有效'),
+    ], string="授权状态", compute='_compute_jd_access_state')
+
+    @api.depends('delivery_type', 'jd_access_token', 'jd_access_expire')
+    def _compute_jd_access_state(self):
+        for carrier in self:
+            if carrier.delivery_type == 'jd' and carrier._origin.id:
+                carrier.jd_access_state = carrier._origin.jd_token_state()
+            else:
+                carrier.jd_access_state = False
+
+    def write(self, vals):
+        res = super().write(vals)
+        if JD_CREDENTIAL_FIELDS.intersection(vals) or JD_PRODUCT_FIELDS.intersection(vals):
+            self.clear_caches()
+        return res
+
+    @api.model
+    @tools.ormcache()
+    def _jd_config(self):
+        """
+        进程内缓存的系统参数, 可调的在 库存-配置-设置 里修改
+        """
+        icp_get = self.env['ir.config_parameter'].sudo().get_param
+        app_key, app_secret = self.env['res.config.settings'].get_jd_access_info()
+        return tools.frozendict({
+            'app_key': app_key,
+            'app_secret': app_secret,
+            # 指向本地模拟接口(benchmarks/jd_mock_server.py)时使用, 为空时按正式/测试环境选择
+            'base_uri': icp_get('delivery_jd.api_base_uri') or False,
+            'log_sample_rate': get_param(icp_get, 'delivery_jd.log_sample_rate', 1.0),
+            'max_workers': max(1, get_param(icp_get, 'delivery_jd.max_workers', jd_executor.DEFAULT_MAX_WORKERS)),
+            'precheck_before_create': get_param(icp_get, 'delivery_jd.precheck_before_create', False),
+        })
+
+    @tools.ormcache('self.id')
+    def _jd_credentials(self):
+        """
+        :return: (appKey, appSecret, accessToken, accessToken过期时间)
+        """
+        config = self._jd_config()
+        carrier = self.sudo()
+        return config['app_key'], config['app_secret'], carrier.jd_access_token, carrier.jd_access_expire
+
+    @tools.ormcache('self.id')
+    def _jd_product_table(self):
+        """
+        物流上的产品选择规则, 按优先顺序排列
+        :return: (JDProduct, ...)
+        """
+        carrier = self.sudo()
+        products = [JDProduct(rule.order_origin, rule.product_code, rule.min_weight, rule.max_weight, rule.speed)
+                    for rule in carrier.jd_product_rule_ids]
+        if not products:
+            products.append(JDProduct(carrier.jd_order_origin, carrier.jd_main_product_code, 0.0, 0.0, 0))
+            if carrier.jd_order_origin == EXPRESS_ORDER_ORIGIN and carrier.jd_business_unit_code:
+                # 超过快递上限的重货走快运
+                products.append(JDProduct(FREIGHT_ORDER_ORIGIN, FREIGHT_PRODUCT_CODE, JD_EXPRESS_MAX_WEIGHT, 0.0, 1))
+        return tuple(products)
+
+    @api.model
+    def jd_track_access_tokens(self):
+        """
+        :return: 所有已授权的京东物流的 accessToken, 轨迹推送只用这些 accessToken 验签
+        """
+        carriers = self.sudo().search([('delivery_type', '=', 'jd'), ('jd_access_token', '!=', False)])
+        return {carrier._jd_credentials()[2] for carrier in carriers}
+
+    def jd_token_state(self):
+        """
+        :return: missing / expired / expiring / valid, 没有记录过期时间的授权当作有效
+        """
+        self.ensure_one()
+        app_key, app_secret, access_token, access_expire = self._jd_credentials()
+        if not (app_key and app_secret and access_token):
+            return 'missing'
+        if not access_expire:
+            return 'valid'
+        now = fields.Datetime.now()
+        if access_expire <= now:
+            return 'expired'
+        if access_expire <= now + relativedelta(days=JD_TOKEN_EXPIRE_WARNING_DAYS):
+            return 'expiring'
+        return 'valid'
+
+    @api.model
+    def _cron_check_jd_access_expire(self):
+        for carrier in self.sudo().search([('delivery_type', '=', 'jd')]):
+            state = carrier.jd_token_state()
+            if state == 'expired':
+                _logger.warning("京东物流 %s 的 accessToken 已于 %s 过期, 请重新授权", carrier.name, carrier.jd_access_expire)
+            elif state == 'expiring':
+                _logger.warning("京东物流 %s 的 accessToken 将于 %s 过期, 请尽快重新授权",
+                                carrier.name, carrier.jd_access_expire)
 
     @api.model
     def get_jd_access_info(self):
-        result = self.env['res.config.settings'].get_jd_access_info()
+        config = self._jd_config()
+        result = config['app_key'], config['app_secret']
         if not all(result):
             raise ValidationError(_("请在库存-配置-设置-物流对接-京东物流连接器里填写密钥"))
         return result
@@ -83,17 +224,79 @@ class DeliveryCarrier(models.Model):
     def _is_available_for_order(self, order):
         res = super()._is_available_for_order(order)
         if res and self.delivery_type == 'jd':
-            if not all([*self.get_jd_access_info(), self.jd_access_token]):
+            # 未授权或授权已过期时直接隐藏, 不让结账时才请求失败
+            if self.jd_token_state() in ('missing', 'expired'):
                 return False
         return res
 
+    def jd_log_request(self, record, func):
+        """
+        :param record: JDRequestRecord, 只有开启调试日志并被采样到的请求才会格式化写入
+        """
+        self.log_xml(str(record), func)
+
     def jd_new_api(self):
-        return JDApi(
-            *self.get_jd_access_info(), self.jd_access_token, self.log_xml, prod_environment=self.prod_environment,
+        config = self._jd_config()
+        app_key, app_secret, access_token, _access_expire = self._jd_credentials()
+        if not (app_key and app_secret):
+            raise ValidationError(_("请在库存-配置-设置-物流对接-京东物流连接器里填写密钥"))
+        if self.jd_token_state() == 'expired':
+            raise ValidationError(_("京东物流 %s 的授权已过期, 请重新授权", self.name))
+        return new_jd_client(
+            self.env, 'delivery_jd', app_key, app_secret, access_token, self.jd_log_request,
+            prod_environment=self.prod_environment, base_uri=config['base_uri'],
+            session_options=(('pool_maxsize', max(config['max_workers'], jd_session.DEFAULT_POOL_MAXSIZE)),),
+            debug_logging=self.debug_logging, log_sample_rate=config['log_sample_rate'],
+            metrics_interval=JD_METRICS_INTERVAL,
         )
 
     @api.model
     def jd_compute_order_weight_volume(self, order):
+        return self.jd_compute_orders_weight_volume(order).get(order.id, (0.0, 0.0))
+
+    @api.model
+    def jd_compute_orders_weight_volume(self, orders):
+        """
+        一次查询取出所有订单行的数量, 产品重量体积和单位换算系数, 再按订单汇总
+        :return: {order.id: (重量kg, 体积cm3)}
+        """
+        if not orders:
+            return {}
+        if not all(isinstance(order_id, int) for order_id in orders.ids):
+            # 还没有保存的订单(onchange)只能逐行计算
+            return {order.id: self._jd_compute_order_weight_volume_lines(order) for order in orders}
+        self.env['sale.order.line'].flush_model(
+            ['order_id', 'product_id', 'product_uom', 'product_uom_qty', 'is_delivery', 'display_type'])
+        self.env['product.product'].flush_model(['product_tmpl_id', 'weight', 'volume'])
+        self.env['product.template'].flush_model(['type', 'uom_id'])
+        self.env['uom.uom'].flush_model(['factor', 'rounding'])
+        self.env.cr.execute("""
+            SELECT sol.order_id, sol.product_uom_qty, pp.weight, pp.volume,
+                   line_uom.id, line_uom.factor, product_uom.id, product_uom.factor, product_uom.rounding
+              FROM sale_order_line sol
+              JOIN product_product pp ON pp.id = sol.product_id
+              JOIN product_template pt ON pt.id = pp.product_tmpl_id
+              JOIN uom_uom line_uom ON line_uom.id = sol.product_uom
+              JOIN uom_uom product_uom ON product_uom.id = pt.uom_id
+             WHERE sol.order_id IN %s
+               AND pt.type IN ('product', 'consu')
+               AND NOT coalesce(sol.is_delivery, false)
+               AND sol.display_type IS NULL
+               AND sol.product_uom_qty > 0
+        """, [tuple(orders.ids)])
+        res = dict.fromkeys(orders.ids, (0.0, 0.0))
+        for order_id, qty, weight, volume, line_uom, line_factor, product_uom, product_factor, rounding \
+                in self.env.cr.fetchall():
+            if line_uom != product_uom:
+                # 与 uom.uom._compute_quantity 的换算和向上取整保持一致
+                qty = float_round(qty / line_factor * product_factor, precision_rounding=rounding,
+                                  rounding_method='UP')
+            weight_in_kg, volume_in_cm3 = res[order_id]
+            res[order_id] = (weight_in_kg + (weight or 0.0) * qty, volume_in_cm3 + (volume or 0.0) * qty * 10 ** 6)
+        return res
+
+    @api.model
+    def _jd_compute_order_weight_volume_lines(self, order):
         weight_in_kg, volume_in_cm3 = 0.0, 0.0
         for line in order.order_line.filtered(lambda l: l.product_id.type in ['product',
                                                                               'consu'] and not l.is_delivery and not l.display_type and l.product_uom_qty > 0):
@@ -117,43 +320,44 @@ class DeliveryCarrier(models.Model):
                 error_lines.product_id.mapped('name'))
         return False
 
-    def jd_rate_shipment(self, order):
-        self = self.sudo()
-        api = self.jd_new_api()
+    def _jd_prepare_rate_shipment(self, api, order, weight_volume=None):
+        """
+        在主线程里完成所有 ORM 读取
+        :param weight_volume: 批量计算好的 (重量, 体积), 为空时单独计算
+        :return: (错误信息, 预检请求数据)
+        """
         msg = self.jd_common_check_pre_create_order(api, order)
         if msg:
+            return msg, None
+        weight_in_kg, volume_in_cm3 = weight_volume or self.jd_compute_order_weight_volume(order)
+        return False, [{
+            "senderContact": {
+                "fullAddress": order_sender_partner(order)._display_address()
+            },
+            "receiverContact": {
+                "fullAddress": order.partner_shipping_id._display_address()
+            },
+            "orderOrigin": self.jd_order_origin,
+            "customerCode": self.jd_customer_code,
+            "businessUnitCode": self.jd_business_unit_code,
+            "cargoes": [{
+                "weight": float_round(weight_in_kg, precision_digits=2, rounding_method='UP'),
+                "volume": float_round(volume_in_cm3, precision_digits=2, rounding_method='UP')
+            }],
+            "productsReq": {
+                "productCode": self.jd_main_product_code,
+            }
+        }]
+
+    def _jd_rate_shipment_result(self, order, precheck_result=None, error=False):
+        if not error and not precheck_result.get('success'):
+            error = precheck_result.get('msg') or '失败'
+        if error:
             return {'success': False,
                     'price': 0.0,
-                    'error_message': msg,
-                    'warning_message': False}
-        try:
-            weight_in_kg, volume_in_cm3 = self.jd_compute_order_weight_volume(order)
-            precheck_result = api.ecap_v1_orders_precheck([{
-                "senderContact": {
-                    "fullAddress": order.company_id.partner_id._display_address()
-                },
-                "receiverContact": {
-                    "fullAddress": order.partner_shipping_id._display_address()
-                },
-                "orderOrigin": self.jd_order_origin,
-                "customerCode": self.jd_customer_code,
-                "businessUnitCode": self.jd_business_unit_code,
-                "cargoes": [{
-                    "weight": float_round(weight_in_kg, precision_digits=2, rounding_method='UP'),
-                    "volume": float_round(volume_in_cm3, precision_digits=2, rounding_method='UP')
-                }],
-                "productsReq": {
-                    "productCode": self.jd_main_product_code,
-                }
-            }]).json()
-            if not precheck_result.get('success'):
-                return precheck_result.get('msg') or '失败'
-            price = precheck_result['data']['totalFreightStandard']
-        except UserError as e:
-            return {'success': False,
-                    'price': 0.0,
-                    'error_message': e.args[0],
+                    'error_message': error,
                     'warning_message': False}
+        price = precheck_result['data']['totalFreightStandard']
         if order.currency_id.name != 'CNY':
             quote_currency = self.env['res.currency'].search([('name', '=', 'CNY')], limit=1)
             price = quote_currency._convert(price, order.currency_id, order.company_id,
@@ -163,29 +367,129 @@ class DeliveryCarrier(models.Model):
                 'error_message': False,
                 'warning_message': False}
 
-    def jd_send_shipping(self, picking):
+    @api.model
+    def _jd_quote(self, jobs):
         """
-        :param picking: 这里源码传递的是pickings 但是只取了返回的第一个值说明这个变量只有一条记录
-        :return:
+        预检报价, 京东接口不可用时使用最近一次的报价
+        :param jobs: [(key, api, 预检请求数据)]
+        :return: {key: (运费, 失败原因, 是否为最近一次的报价)}, 失败时运费为 None
         """
-        self = self.sudo()
-        api = self.jd_new_api()
-        order = self.env['sale.order'].search([('name', '=', picking.origin)], limit=1)
-        if not order:
-            raise ValidationError(_('请核对源单据订单是否存在'))
-        partner = order.partner_shipping_id or order.partner_id
-        weight_in_kg, volume_in_cm3 = self.jd_compute_order_weight_volume(order)
+        quote_cache = self.env['delivery.jd.quote.cache'].sudo()
+        cache_keys = {key: quote_cache.make_key(data, api.base_uri) for key, api, data in jobs}
+        cached = quote_cache.get_prices(list(set(cache_keys.values())))
+        res, pending = {}, []
+        for key, api, data in jobs:
+            if cache_keys[key] in cached:
+                res[key] = (cached[cache_keys[key]], False, False)
+            else:
+                pending.append((key, api, data))
+        max_workers = self._jd_config()['max_workers']
+        to_cache, unreachable = {}, []
+        jd_results = jd_executor.fan_out([(api, 'ecap_v1_orders_precheck', data) for _key, api, data in pending],
+                                         max_workers)
+        for (key, _api, _data), (precheck_result, exc) in zip(pending, jd_results):
+            if isinstance(exc, requests.RequestException):
+                unreachable.append(key)
+            elif exc is not None:
+                res[key] = (None, str(exc) or exc.__class__.__name__, False)
+            elif precheck_result.get('success'):
+                price = to_cache[cache_keys[key]] = precheck_result['data']['totalFreightStandard']
+                res[key] = (price, False, False)
+            else:
+                res[key] = (None, precheck_result.get('msg') or '失败', False)
+        quote_cache.set_prices(to_cache)
+        if unreachable:
+            # 京东接口不可用或熔断中, 有最近的报价时降级使用, 否则直接返回不可用
+            stale = quote_cache.get_prices([cache_keys[key] for key in unreachable], stale=True)
+            for key in unreachable:
+                res[key] = (stale[cache_keys[key]], False, True) if cache_keys[key] in stale \
+                    else (None, _("京东物流暂时无法连接, 请稍后再试"), False)
+        return res
+
+    def jd_rate_shipment_multi(self, orders):
+        """
+        对多个京东物流和多个订单同时询价, 按物流的选择方式取运费最低或者时效最快的产品
+        :return: {(carrier.id, order.id): {'success', 'price', 'error_message', 'warning_message'}}
+        """
+        weight_volumes = self.jd_compute_orders_weight_volume(orders)
+        results, candidates, jobs = {}, {}, []
+        for carrier in self.sudo():
+            api = carrier.jd_new_api()
+            product_table = carrier._jd_product_table()
+            for order in orders:
+                try:
+                    msg, data = carrier._jd_prepare_rate_shipment(api, order, weight_volumes.get(order.id))
+                except UserError as e:
+                    msg, data = e.args[0], None
+                products = []
+                if not msg:
+                    weight = data[0]['cargoes'][0]['weight']
+                    products = eligible_products(product_table, weight)
+                    if not products:
+                        msg = _("没有适用于 %s kg 货物的京东产品", weight)
+                if msg:
+                    results[(carrier.id, order.id)] = carrier._jd_rate_shipment_result(order, error=msg)
+                    continue
+                candidates[(carrier, order)] = products
+                jobs += [((carrier.id, order.id, product), api, [apply_product(data[0], product)])
+                         for product in products]
+        quotes = self._jd_quote(jobs)
+        for (carrier, order), products in candidates.items():
+            product_quotes = [quotes[(carrier.id, order.id, product)] for product in products]
+            product, price = choose_product(
+                products, {product: quote[0] for product, quote in zip(products, product_quotes)},
+                carrier.jd_product_strategy)
+            if product is None:
+                result = carrier._jd_rate_shipment_result(order, error=product_quotes[0][1])
+            else:
+                result = carrier._jd_rate_shipment_result(order, {'success': True,
+                                                                  'data': {'totalFreightStandard': price}})
+                if quotes[(carrier.id, order.id, product)][2]:
+                    result['warning_message'] = _("京东物流暂时无法连接, 运费为最近一次的报价")
+            results[(carrier.id, order.id)] = result
+        return results
+
+    def jd_rate_shipment(self, order):
+        self.ensure_one()
+        return self.jd_rate_shipment_multi(order)[(self.id, order.id)]
+
+    def _jd_order_cargoes(self, order, weight_volumes=None):
+        # 整单作为一个包裹, 重量体积按订单行汇总
+        if weight_volumes is None or order.id not in weight_volumes:
+            weight_volumes = self.jd_compute_orders_weight_volume(order)
+        weight_in_kg, volume_in_cm3 = weight_volumes[order.id]
         product_line = order.order_line.filtered(
             lambda line: line.product_id.type != 'service' and line.product_uom_qty
         )[0]
-        val = {
-            "orderId": picking.origin,
-            "senderContact": {
-                "name": order.company_id.name,
-                "mobile": order.company_id.mobile,
-                "phone": order.company_id.phone,
-                "fullAddress": order.company_id.partner_id._display_address()
-            },
+        return [
+            {
+                "name": product_line.product_id.name,
+                "quantity": product_line.product_uom_qty,
+                "weight": float_round(weight_in_kg, precision_digits=2, rounding_method='UP'),
+                "volume": float_round(volume_in_cm3, precision_digits=2, rounding_method='UP')
+            }
+        ]
+
+    def _jd_shipping_order_id(self, picking, order):
+        return shipping_order_id(picking, order, self.jd_split_shipment)
+
+    def _jd_prepare_shipping_vals(self, picking, order=None, weight_volumes=None, cargoes=None, sender=None):
+        """
+        :param cargoes: 按包裹下单时 pickings_package_cargoes 的结果, 为空时整单作为一个包裹
+        :param sender: 寄件地址, 为空时按调拨所在仓库确定
+        """
+        if order is None:
+            order = pickings_sale_orders(picking)[picking.id]
+        if not order:
+            raise ValidationError(_('请核对源单据订单是否存在'))
+        partner = order.partner_shipping_id or order.partner_id
+        if cargoes is None and self.jd_multi_parcel:
+            cargoes = pickings_package_cargoes(picking, self.jd_default_package_type_id)[picking.id]
+        if sender is None:
+            sender = pickings_sender_partners(picking, {picking.id: order})[picking.id]
+        return {
+            "orderId": self._jd_shipping_order_id(picking, order),
+            "senderContact": sender_contact(sender, order.company_id),
             "receiverContact": {
                 "name": partner.name,
                 "mobile": partner.mobile,
@@ -199,44 +503,291 @@ class DeliveryCarrier(models.Model):
                 "productCode": self.jd_main_product_code,
             },
             "settleType": "3",
-            "cargoes": [
-                {
-                    "name": product_line.product_id.name,
-                    "quantity": product_line.product_uom_qty,
-                    "weight": float_round(weight_in_kg, precision_digits=2, rounding_method='UP'),
-                    "volume": float_round(volume_in_cm3, precision_digits=2, rounding_method='UP')
-                }
-            ],
+            "cargoes": cargoes or self._jd_order_cargoes(order, weight_volumes),
             "CommonChannelInfo": {
                 "channelCode": "0030001"
             }
         }
-        data = [val]
-        result = api.orders_create(data).json()
-        if not result['success']:
-            raise ValidationError(result['msg'])
-        else:
-            return [{
-                'exact_price': result['data'].get('freightPre') or 0,
-                'tracking_number': result['data']['waybillCode'],
-            }]
 
-    def jd_cancel_shipment(self, pickings):
+    def _jd_dispatch_prepared(self, api, prepared):
+        """
+        按每张调拨的货物重量选择京东产品
+        :return: ([(picking, 下单数据)], {picking.id: 失败原因})
+        """
+        product_table = self._jd_product_table()
+        dispatched, errors, candidates, jobs = [], {}, {}, []
+        for picking, vals in prepared:
+            weights = [cargo.get('weight') or 0.0 for cargo in vals['cargoes']]
+            products = eligible_products(product_table, sum(weights), max(weights, default=0.0))
+            if not products:
+                errors[picking.id] = _("没有适用于 %s kg 货物的京东产品", sum(weights))
+                continue
+            if len(products) > 1 and self.jd_product_strategy == 'cheapest':
+                candidates[picking.id] = products
+                precheck_vals = {key: vals[key] for key in JD_PRECHECK_KEYS if key in vals}
+                jobs += [((picking.id, product), api, [apply_product(precheck_vals, product)])
+                         for product in products]
+            dispatched.append((picking, vals, products))
+        quotes = self._jd_quote(jobs) if jobs else {}
+        res = []
+        for picking, vals, products in dispatched:
+            if picking.id in candidates:
+                product, _price = choose_product(
+                    products, {product: quotes[(picking.id, product)][0] for product in products}, 'cheapest')
+                # 都没有报价时按产品表顺序下单, 由预检报告失败原因
+                product = product or products[0]
+            else:
+                product = fastest_product(products)
+            res.append((picking, apply_product(vals, product)))
+        return res, errors
+
+    def _jd_prepare_shipping_batch(self, pickings, api=None):
+        """
+        一次性读取订单, 重量体积, 包裹和寄件地址, 逐张组装下单数据
+        :param api: 传入时按货物重量选择京东产品
+        :return: ([(picking, 下单数据)], {picking.id: 失败原因}, {picking.id: sale.order})
+        """
+        prepared, errors = [], {}
+        orders = pickings_sale_orders(pickings)
+        all_orders = self.env['sale.order'].union(*orders.values())
+        if self.jd_split_shipment:
+            all_orders.picking_ids.read(['picking_type_code', 'state'])
+            pickings = pickings.sorted(lambda p: (orders[p.id].id or 0, p.id))
+        weight_volumes = self.jd_compute_orders_weight_volume(all_orders)
+        cargoes = pickings_package_cargoes(pickings, self.jd_default_package_type_id) if self.jd_multi_parcel else {}
+        senders = pickings_sender_partners(pickings, orders)
+        for picking in pickings:
+            try:
+                prepared.append((picking, self._jd_prepare_shipping_vals(
+                    picking, orders[picking.id], weight_volumes, cargoes.get(picking.id), senders[picking.id])))
+            except (ValidationError, UserError) as e:
+                errors[picking.id] = e.args[0]
+        if api is not None:
+            prepared, dispatch_errors = self._jd_dispatch_prepared(api, prepared)
+            errors.update(dispatch_errors)
+        return prepared, errors, orders
+
+    def _jd_precheck_prepared(self, api, prepared, orders, force=False, cached_only=False, local_check=False):
+        """
+        用预检接口校验下单数据, 结果按请求数据的摘要记在调拨上, 摘要相同并且未过期的直接使用
+        :param prepared: _jd_prepare_shipping_batch 的结果
+        :param force: 忽略调拨上已有的预检结果和报价缓存
+        :param cached_only: 只使用已有的结果, 没有结果的调拨返回 (None, False), 不请求京东
+        :param local_check: 先检查产品重量, 按包裹下单时不检查
+        :return: {picking.id: (是否通过, 失败原因)}, 京东接口不可用时为 (None, 异常信息)
+        """
+        max_workers = self._jd_config()['max_workers']
+        quote_cache = self.env['delivery.jd.quote.cache'].sudo()
+        fresh_after = fields.Datetime.subtract(fields.Datetime.now(), seconds=JD_PRECHECK_TTL)
+        results, keys, unchecked, local_rows = {}, {}, [], []
+        local_check = local_check and not self.jd_multi_parcel
+        for picking, vals in prepared:
+            data = [{key: vals[key] for key in JD_PRECHECK_KEYS if key in vals}]
+            key = keys[picking.id] = quote_cache.make_key(data, api.base_uri)
+            msg = local_check and self.jd_common_check_pre_create_order(api, orders[picking.id])
+            if msg:
+                # 本地检查的结果不记摘要, 下单时不会当作京东的预检结果使用
+                results[picking.id] = (False, msg)
+                local_rows.append((picking.id, 'failed', msg, None))
+                keys.pop(picking.id)
+            elif not force and picking.jd_precheck_state and picking.jd_precheck_key == key \
+                    and picking.jd_precheck_date and picking.jd_precheck_date >= fresh_after:
+                results[picking.id] = (picking.jd_precheck_state == 'passed', picking.jd_precheck_message)
+                keys.pop(picking.id)
+            else:
+                unchecked.append((picking, data))
+        # 报价和下单前预检使用同样的请求数据, 按运费最低选择产品时刚询过价的调拨不会再预检一次
+        quoted = quote_cache.get_prices([keys[picking.id] for picking, _data in unchecked]) \
+            if unchecked and not force else {}
+        jobs, pending = [], []
+        for picking, data in unchecked:
+            if keys[picking.id] in quoted:
+                results[picking.id] = (True, False)
+            elif cached_only:
+                results[picking.id] = (None, False)
+                keys.pop(picking.id)
+            else:
+                pending.append(picking)
+                jobs.append((api, 'ecap_v1_orders_precheck', data))
+        for picking, (result, exc) in zip(pending, jd_executor.fan_out(jobs, max_workers)):
+            if exc is not None:
+                # 京东接口不可用时不记录结果, 也不拦截下单
+                results[picking.id] = (None, str(exc) or exc.__class__.__name__)
+                keys.pop(picking.id)
+            elif result.get('success'):
+                results[picking.id] = (True, False)
+            else:
+                results[picking.id] = (False, result.get('subMsg') or result.get('msg') or '失败')
+        rows = [(picking_id, 'passed' if results[picking_id][0] else 'failed', results[picking_id][1] or None, key)
+                for picking_id, key in keys.items()] + local_rows
+        if rows:
+            self.env['stock.picking']._jd_write_precheck_results(rows)
+        return results
+
+    def jd_precheck_pickings(self, pickings, force=False):
+        """
+        发货前批量预检, 提前发现地址不支持或者货物信息不对的调拨
+        :return: {picking.id: (是否通过, 失败原因)}
+        """
+        self.ensure_one()
+        self = self.sudo()
+        api = self.jd_new_api()
+        prepared, errors, orders = self._jd_prepare_shipping_batch(pickings, api)
+        results = self._jd_precheck_prepared(api, prepared, orders, force=force, local_check=True)
+        if errors:
+            self.env['stock.picking']._jd_write_precheck_results(
+                [(picking_id, 'failed', msg, None) for picking_id, msg in errors.items()])
+            results.update({picking_id: (False, msg) for picking_id, msg in errors.items()})
+        return results
+
+    def jd_send_shipping_batch(self, pickings):
+        """
+        并发下单, 预检未通过的调拨不再调用下单接口
+        :return: {picking.id: {'exact_price', 'tracking_number'} 或 {'error': 失败原因, 'transient': 是否可以重试}}
+        """
+        self.ensure_one()
+        self = self.sudo()
+        api = self.jd_new_api()
+        prepared, errors, orders = self._jd_prepare_shipping_batch(pickings, api)
+        results = {picking_id: {'error': msg, 'transient': False} for picking_id, msg in errors.items()}
+        config = self._jd_config()
+        prechecks = self._jd_precheck_prepared(api, prepared, orders, cached_only=not config['precheck_before_create'])
+        for picking, _val in prepared:
+            passed, msg = prechecks[picking.id]
+            if passed is False:
+                results[picking.id] = {'error': _("京东预检未通过: %s", msg), 'transient': False}
+        prepared = [(picking, val) for picking, val in prepared if picking.id not in results]
+        for (picking, _val), val, item in call_in_batches(api, 'orders_create', prepared, lambda rec: rec[1],
+                                                          lambda val: val['orderId'], api.ORDERS_BATCH_SIZE,
+                                                          config['max_workers']):
+            if item['success']:
+                results[picking.id] = {
+                    'exact_price': item['data'].get('freightPre') or 0,
+                    'tracking_number': item['data']['waybillCode'],
+                    'order_id': val['orderId'],
+                    'order_origin': val['orderOrigin'],
+                    'product_code': val['productsReq']['productCode'],
+                }
+            else:
+                results[picking.id] = {'error': item['msg'], 'transient': item['transient']}
+        return results
+
+    def jd_send_shipping(self, pickings):
+        """
+        :param pickings: 源码只传一条记录, 批量验证时由 stock.picking 先调用 jd_send_shipping_batch 把结果放进上下文
+        :return:
+        """
+        results = dict(self.env.context.get('jd_shipping_results') or {})
+        missing = pickings.filtered(lambda p: p.id not in results)
+        if missing:
+            results.update(self.jd_send_shipping_batch(missing))
+        res = []
+        for picking in pickings:
+            if 'error' in results[picking.id]:
+                raise ValidationError(results[picking.id]['error'])
+            # 记下下单时的运费和产品, 由定时任务查询实际运费后对账
+            picking.write(dict(picking._jd_fee_pending_vals(results[picking.id]['exact_price']),
+                               jd_order_code=results[picking.id].get('order_id'),
+                               jd_order_origin=results[picking.id].get('order_origin'),
+                               jd_product_code=results[picking.id].get('product_code')))
+            res.append(results[picking.id])
+        return res
+
+    def _jd_cancel_vals(self, picking):
+        return {
+            "waybillCode": picking.carrier_tracking_ref,
+            "orderOrigin": picking.jd_order_origin or self.jd_order_origin,
+            "customerCode": self.jd_customer_code,
+            "businessUnitCode": self.jd_business_unit_code,
+            "cancelReason": "用户发起取消",
+            "cancelReasonCode": "1",
+            "cancelType": 1
+        }
+
+    def jd_cancel_shipment_batch(self, pickings):
+        """
+        运单按批量大小分组, 每组调用一次取消接口, 多组之间并发请求, 某条失败不影响其他运单
+        :return: {picking.id: {'success': bool, 'msg': 失败原因}}
+        """
+        self.ensure_one()
         self = self.sudo()
         api = self.jd_new_api()
+        batches = call_in_batches(api, 'orders_cancel', pickings, self._jd_cancel_vals, lambda val: val['waybillCode'],
+                                  api.ORDERS_BATCH_SIZE, self._jd_config()['max_workers'])
+        results = {picking.id: {'success': item['success'], 'msg': item['msg']} for picking, _val, item in batches}
+        # 已取消的运单不再参与运费对账
+        cancelled = pickings.filtered(lambda p: results[p.id]['success'] and p.jd_fee_state)
+        cancelled.write({'jd_fee_state': False, 'jd_fee_next_date': False})
+        return results
+
+    def jd_cancel_shipment(self, pickings):
+        """
+        取消成功的调拨清空运单号, 失败的保留运单号并记录原因, 只有全部失败时才报错
+        """
+        results = self.jd_cancel_shipment_batch(pickings)
+        cancelled, failed = pickings._jd_apply_cancel_results(results)
+        if failed and not cancelled:
+            raise ValidationError("\n".join("%s: %s" % (picking.carrier_tracking_ref, results[picking.id]['msg'])
+                                            for picking in failed))
+
+    def _jd_label_vals(self, picking):
+        return {
+            "waybillCode": picking.carrier_tracking_ref,
+            "orderOrigin": picking.jd_order_origin or self.jd_order_origin,
+            "customerCode": self.jd_customer_code,
+            "businessUnitCode": self.jd_business_unit_code,
+        }
+
+    @api.model
+    def jd_label_cache(self):
+        # delivery_jd.label_cache_dir 为空时保存在 odoo 数据目录的 jd_labels 下
+        return JDLabelCache.for_database(
+            self.env.cr.dbname, self.env['ir.config_parameter'].sudo().get_param('delivery_jd.label_cache_dir'))
+
+    def jd_fetch_labels(self, pickings):
+        """
+        先查磁盘缓存, 没有缓存的运单并发获取面单
+        :return: {picking.id: (面单文件路径, 失败原因)}
+        """
+        self.ensure_one()
+        self = self.sudo()
+        cache = self.jd_label_cache()
+        results, missing = {}, []
         for picking in pickings:
-            data = [{
-                "waybillCode": picking.carrier_tracking_ref,
-                "orderOrigin": self.jd_order_origin,
-                "customerCode": self.jd_customer_code,
-                "businessUnitCode": self.jd_business_unit_code,
-                "cancelReason": "用户发起取消",
-                "cancelReasonCode": "1",
-                "cancelType": 1
-            }]
-            result = api.orders_cancel(data).json()
-            if not result['success']:
-                raise ValidationError(result['subMsg'])
+            path = cache.get(picking.carrier_tracking_ref)
+            if path:
+                results[picking.id] = (path, False)
+            else:
+                missing.append(picking)
+        if not missing:
+            return results
+        api = self.jd_new_api()
+        max_workers = self._jd_config()['max_workers']
+        downloads = []
+        for picking, _val, item in call_in_batches(api, 'orders_print', missing, self._jd_label_vals,
+                                                   lambda val: val['waybillCode'], api.ORDERS_BATCH_SIZE, max_workers):
+            content, url = label_content(item['data']) if item['success'] else (None, None)
+            if content:
+                results[picking.id] = (cache.put(picking.carrier_tracking_ref, content), False)
+            elif url:
+                downloads.append((picking, url))
+            else:
+                results[picking.id] = (False, item['msg'] or _("京东没有返回面单"))
+        if downloads:
+            def download(waybill_code, url):
+                try:
+                    response = api.download(url)
+                    response.raise_for_status()
+                    return cache.put(waybill_code, response.content), False
+                except (requests.RequestException, OSError) as e:
+                    return False, str(e) or e.__class__.__name__
+
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(downloads)))) as executor:
+                futures = [(picking, executor.submit(download, picking.carrier_tracking_ref, url))
+                           for picking, url in downloads]
+                for picking, future in futures:
+                    results[picking.id] = future.result()
+        return results
 
     def jd_get_tracking_link(self, picking):
         return 'https://www.jdl.com/orderSearch/?waybillCodes=%s' % picking.carrier_tracking_ref
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+import base64
+import contextlib
+import os
+import re
+import tempfile
+import time
+
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+from odoo.tools import config
+from odoo.tools.pdf import PdfFileReader
+
+LABEL_CACHE_DAYS = 30
+# 面单内容可能使用的字段名, 按顺序取第一个有值的
+LABEL_CONTENT_KEYS = ('pdfContent', 'fileContent', 'content')
+LABEL_URL_KEYS = ('pdfUrl', 'fileUrl', 'url')
+
+
+class JDLabelCache:
+    """
+    面单按运单号保存在磁盘上, 同一个运单重复打印不再请求京东
+    写入时先写临时文件再改名, 多个 worker 同时写同一个运单也不会读到半个文件
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    @classmethod
+    def for_database(cls, dbname, root=None):
+        return cls(os.path.join(root or os.path.join(config['data_dir'], 'jd_labels'), dbname))
+
+    def path(self, waybill_code):
+        name = re.sub(r'[^0-9A-Za-z_-]', '_', waybill_code)
+        return os.path.join(self.root, name[-2:], '%s.pdf' % name)
+
+    def get(self, waybill_code):
+        path = self.path(waybill_code)
+        return path if os.path.isfile(path) else None
+
+    def put(self, waybill_code, content):
+        """
+        :param content: PDF 内容
+        :return: 缓存文件路径
+        """
+        path = self.path(waybill_code)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+        return path
+
+    def gc(self, days=LABEL_CACHE_DAYS):
+        """
+        :return: 删除的文件数
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        expire = time.time() - days * 24 * 3600
+        removed = 0
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                with contextlib.suppress(OSError):
+                    if os.path.getmtime(path) < expire:
+                        os.unlink(path)
+                        removed += 1
+        return removed
+
+
+def label_content(item):
+    """
+    :return: (PDF 内容, 下载地址), 京东只会返回其中一个
+    """
+    content = next((item[key] for key in LABEL_CONTENT_KEYS if item.get(key)), None)
+    if content:
+        return base64.b64decode(content), None
+    return None, next((item[key] for key in LABEL_URL_KEYS if item.get(key)), None)
+
+
+class PdfStreamWriter:
+    """
+    逐个文件把页面对象重新编号后立即写出, 内存里只保留已写对象的位置和页面编号
+    页面树和目录在 close 时最后写出, 固定使用 1, 2 号对象
+    """
+    PAGES, CATALOG = 1, 2
+
+    def __init__(self, output):
+        """
+        :param output: 可写的二进制文件对象
+        """
+        self.output = output
+        self.start = output.tell()
+        self.offsets = {}
+        self.next_id = 3
+        self.kids = []
+        output.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _reserve(self):
+        idnum = self.next_id
+        self.next_id += 1
+        return idnum
+
+    def _write(self, idnum, obj):
+        self.offsets[idnum] = self.output.tell() - self.start
+        self.output.write(b'%d 0 obj\n' % idnum)
+        obj.writeToStream(self.output, None)
+        self.output.write(b'\nendobj\n')
+
+    def _sweep(self, obj, mapping):
+        """
+        把对象里引用的源文件对象逐个写出并换成新编号, 读取器在文件合并完后丢弃, 直接修改源对象
+        :param mapping: {(源对象编号, 版本): 新编号}
+        """
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key not in mapping:
+                target = obj.getObject()
+                if isinstance(target, DictionaryObject) and target.get('/Type') == '/Pages':
+                    return IndirectObject(self.PAGES, 0, None)
+                mapping[key] = self._reserve()
+                self._write(mapping[key], self._sweep(target, mapping))
+            return IndirectObject(mapping[key], 0, None)
+        if isinstance(obj, DictionaryObject):
+            for key, value in list(obj.items()):
+                obj[key] = self._sweep(value, mapping)
+        elif isinstance(obj, ArrayObject):
+            for index, value in enumerate(obj):
+                obj[index] = self._sweep(value, mapping)
+        return obj
+
+    def add_pages(self, reader):
+        mapping = {}
+        for index in range(reader.getNumPages()):
+            page = reader.getPage(index)
+            idnum = self._reserve()
+            mapping[(page.indirectRef.idnum, page.indirectRef.generation)] = idnum
+            page.pop('/Parent', None)
+            self._sweep(page, mapping)
+            page[NameObject('/Parent')] = IndirectObject(self.PAGES, 0, None)
+            self._write(idnum, page)
+            self.kids.append(idnum)
+
+    def close(self):
+        self._write(self.PAGES, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject([IndirectObject(idnum, 0, None) for idnum in self.kids]),
+            NameObject('/Count'): NumberObject(len(self.kids)),
+        }))
+        self._write(self.CATALOG, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(self.PAGES, 0, None),
+        }))
+        xref = self.output.tell() - self.start
+        self.output.write(b'xref\n0 %d\n0000000000 65535 f \n' % self.next_id)
+        for idnum in range(1, self.next_id):
+            self.output.write(b'%010d 00000 n \n' % self.offsets[idnum])
+        self.output.write(b'trailer\n')
+        DictionaryObject({
+            NameObject('/Size'): NumberObject(self.next_id),
+            NameObject('/Root'): IndirectObject(self.CATALOG, 0, None),
+        }).writeToStream(self.output, None)
+        self.output.write(b'\nstartxref\n%d\n%%%%EOF\n' % xref)
+
+
+def merge_pdf_files(paths, output):
+    """
+    按顺序把缓存里的面单合并写入输出文件, 每次只打开一个面单, 内存占用不随面单数量增长
+    :param output: 可写的二进制文件对象
+    """
+    writer = PdfStreamWriter(output)
+    for path in paths:
+        with open(path, 'rb') as f:
+            writer.add_pages(PdfFileReader(f, strict=False))
+    writer.close()
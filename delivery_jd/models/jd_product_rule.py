@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, fields, models
+
+# https://cloud.jdl.com/#/open-business-document/access-guide/267/54153
+JD_PRODUCT_CODES = [
+    ('ed-m-0001', '京东标快'),
+    ('ed-m-0002', '京东特快'),
+    ('fr-m-0004', '特快重货'),
+]
+
+
+class JDProductRule(models.Model):
+    _name = 'delivery.jd.product.rule'
+    _description = '京东物流产品选择规则'
+    _order = 'sequence, id'
+
+    carrier_id = fields.Many2one('delivery.carrier', string="物流", required=True, ondelete='cascade', index=True)
+    sequence = fields.Integer(string="序号", default=10)
+    order_origin = fields.Selection(selection=[('1', '快递B2C'), ('4', '快运B2C')], string="下单来源",
+                                    required=True, default='1')
+    product_code = fields.Selection(selection=JD_PRODUCT_CODES, string="产品编码", required=True)
+    min_weight = fields.Float(string="最小重量(kg)")
+    max_weight = fields.Float(string="最大重量(kg)", help="为 0 时不限, 快递B2C 单个包裹超过 30kg 时不会使用")
+    speed = fields.Integer(string="时效等级", default=10, help="数字越小时效越快, 按时效最快选择产品时使用")
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        self.env['delivery.carrier'].clear_caches()
+        return res
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.env['delivery.carrier'].clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env['delivery.carrier'].clear_caches()
+        return res
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+from odoo import api, fields, models, registry
+from odoo.addons.delivery_jd_hooks.tools.jd_config import get_param
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 3600
+DEFAULT_SIZE = 50000
+# 京东接口不可用时, 过期不超过这个时间的报价仍可作为降级结果使用
+DEFAULT_STALE_TTL = 86400
+HIT_FLUSH_INTERVAL = 60
+# 每写入数量上限的这个比例的报价后按数量上限淘汰一次, 不必等定时任务
+TRIM_RATIO = 0.1
+
+# 命中和未命中次数先按数据库累计在进程内, 定期写回, 避免每次查询都更新同一行造成并发冲突
+# {dbname: {key: [命中次数, 未命中次数]}}
+_pending_hits = {}
+_pending_lock = threading.Lock()
+_last_flush = {}
+# 按数据库记录上次淘汰后写入的报价数
+_inserted = {}
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        return re.sub(r'\s+', ' ', value).strip()
+    if isinstance(value, dict):
+        return {key: _normalize(val) for key, val in value.items()
+                if val is not None and val is not False and val != ''}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(val) for val in value]
+    return value
+
+
+class JDQuoteCache(models.Model):
+    _name = 'delivery.jd.quote.cache'
+    _description = '京东运费报价缓存'
+    _log_access = False
+
+    key = fields.Char(string="缓存键", required=True)
+    price = fields.Float(string="运费(CNY)")
+    expire_date = fields.Datetime(string="过期时间", required=True)
+    last_hit_date = fields.Datetime(string="最后使用时间", index=True)
+    hit_count = fields.Integer(string="命中次数")
+    miss_count = fields.Integer(string="未命中次数")
+
+    _sql_constraints = [
+        ('key_uniq', 'unique(key)', '缓存键必须唯一'),
+    ]
+
+    @api.model
+    def make_key(self, data, *extra):
+        """
+        报价只和寄件地址, 收件地址, 重量, 体积, 产品编码, 客户编码有关, 预检请求里正好是这些字段
+        """
+        content = json.dumps([_normalize(data), *extra], sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(content.encode('UTF-8')).hexdigest()
+
+    @api.model
+    def _get_cache_ttl(self):
+        # 为 0 时不使用报价缓存
+        return get_param(self.env['ir.config_parameter'].sudo().get_param, 'delivery_jd.quote_cache_ttl', DEFAULT_TTL)
+
+    @api.model
+    def get_prices(self, keys, stale=False):
+        """
+        :param stale: 京东接口不可用时传 True, 同时返回过期不久的报价
+        :return: {key: price} 默认只包含未过期的缓存
+        """
+        if not keys or not self._get_cache_ttl():
+            return {}
+        stale_ttl = DEFAULT_STALE_TTL if stale else 0
+        self.env.cr.execute("""
+            SELECT key, price FROM delivery_jd_quote_cache
+             WHERE key IN %s AND expire_date > (now() at time zone 'UTC') - interval '1 second' * %s
+        """, [tuple(set(keys)), stale_ttl])
+        res = dict(self.env.cr.fetchall())
+        dbname = self.env.cr.dbname
+        with _pending_lock:
+            counts = _pending_hits.setdefault(dbname, {})
+            for key in set(keys):
+                if key in res:
+                    counts.setdefault(key, [0, 0])[0] += 1
+                elif not stale:
+                    # 降级查询之前已经按未命中记过一次
+                    counts.setdefault(key, [0, 0])[1] += 1
+            last_flush = _last_flush.setdefault(dbname, time.time())
+        if time.time() - last_flush > HIT_FLUSH_INTERVAL:
+            self._flush_hits()
+        return res
+
+    @api.model
+    def set_prices(self, prices):
+        """
+        使用单独的游标写入, 不占用业务事务的行锁, 写入失败只记录日志
+        累计写入一定数量后顺便按数量上限淘汰, 定时任务之间缓存也不会无限增长
+        """
+        ttl = self._get_cache_ttl()
+        if not prices or not ttl:
+            return
+        query = """
+            INSERT INTO delivery_jd_quote_cache (key, price, expire_date, last_hit_date, hit_count, miss_count)
+            VALUES {values}
+            ON CONFLICT (key) DO UPDATE SET price = EXCLUDED.price,
+                                            expire_date = EXCLUDED.expire_date,
+                                            last_hit_date = EXCLUDED.last_hit_date
+        """.format(values=", ".join([
+            "(%s, %s, (now() at time zone 'UTC') + interval '1 second' * %s, (now() at time zone 'UTC'), 0, 0)"
+        ] * len(prices)))
+        params = [param for key, price in sorted(prices.items()) for param in (key, price, ttl)]
+        self._execute_in_new_cursor(query, params)
+        dbname = self.env.cr.dbname
+        with _pending_lock:
+            inserted = _inserted[dbname] = _inserted.get(dbname, 0) + len(prices)
+            trim = inserted >= int(DEFAULT_SIZE * TRIM_RATIO)
+            if trim:
+                _inserted[dbname] = 0
+        if trim:
+            self._execute_in_new_cursor(self._trim_query(), [DEFAULT_SIZE])
+
+    @api.model
+    def _trim_query(self):
+        return """
+            DELETE FROM delivery_jd_quote_cache
+             WHERE id IN (SELECT id FROM delivery_jd_quote_cache
+                           ORDER BY last_hit_date DESC NULLS LAST, id DESC
+                          OFFSET %s)
+        """
+
+    @api.model
+    def _flush_hits(self):
+        dbname = self.env.cr.dbname
+        with _pending_lock:
+            counts = _pending_hits.pop(dbname, {})
+            _last_flush[dbname] = time.time()
+        if not counts:
+            return
+        # 未命中的报价通常在询价后由 set_prices 写入, 询价失败没有写入的不再记录
+        query = """
+            UPDATE delivery_jd_quote_cache c
+               SET hit_count = c.hit_count + v.hits,
+                   miss_count = c.miss_count + v.misses,
+                   last_hit_date = CASE WHEN v.hits > 0 THEN (now() at time zone 'UTC') ELSE c.last_hit_date END
+              FROM (VALUES {values}) AS v(key, hits, misses)
+             WHERE c.key = v.key
+        """.format(values=", ".join(["(%s, %s, %s)"] * len(counts)))
+        self._execute_in_new_cursor(query, [param for key, (hits, misses) in sorted(counts.items())
+                                            for param in (key, hits, misses)])
+
+    @api.model
+    def _execute_in_new_cursor(self, query, params):
+        try:
+            with registry(self.env.cr.dbname).cursor() as cr:
+                cr.execute(query, params)
+        except Exception:
+            _logger.warning("写入京东报价缓存失败", exc_info=True)
+
+    @api.model
+    def get_stats(self):
+        self.env.cr.execute("""
+            SELECT count(*), coalesce(sum(hit_count), 0), coalesce(sum(miss_count), 0)
+              FROM delivery_jd_quote_cache
+        """)
+        size, hits, misses = self.env.cr.fetchone()
+        return {'size': size, 'hits': hits, 'misses': misses}
+
+    @api.model
+    def _cron_gc_quote_cache(self):
+        """
+        清理过期超过降级保留时间的缓存, 超出数量上限时按最后使用时间淘汰
+        """
+        self._flush_hits()
+        self.env.cr.execute("""
+            DELETE FROM delivery_jd_quote_cache
+             WHERE expire_date <= (now() at time zone 'UTC') - interval '1 second' * %s
+        """, [DEFAULT_STALE_TTL])
+        self.env.cr.execute(self._trim_query(), [DEFAULT_SIZE])
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+
+from odoo import api, fields, models, _
+
+_logger = logging.getLogger(__name__)
+
+JOB_BATCH_LIMIT = 500
+JOB_MAX_ATTEMPTS = 8
+JOB_BACKOFF_BASE = 60
+JOB_BACKOFF_MAX = 3600
+
+
+class JDShipmentJob(models.Model):
+    _name = 'delivery.jd.shipment.job'
+    _description = '京东物流下单任务'
+    _order = 'id desc'
+    _rec_name = 'picking_id'
+
+    picking_id = fields.Many2one('stock.picking', string="调拨", required=True, index=True, ondelete='cascade')
+    carrier_id = fields.Many2one('delivery.carrier', string="物流", required=True, ondelete='cascade')
+    state = fields.Selection(selection=[
+        ('pending', '等待下单'),
+        ('done', '已下单'),
+        ('failed', '失败待处理'),
+        ('cancel', '已取消'),
+    ], string="状态", default='pending', required=True, index=True)
+    attempt_count = fields.Integer(string="尝试次数")
+    next_attempt_date = fields.Datetime(string="下次尝试时间", default=fields.Datetime.now, index=True)
+    last_error = fields.Text(string="失败原因")
+    tracking_ref = fields.Char(string="运单号", related='picking_id.carrier_tracking_ref')
+
+    @api.model
+    def enqueue(self, pickings):
+        return self.create([{'picking_id': picking.id, 'carrier_id': picking.carrier_id.id} for picking in pickings])
+
+    @api.model
+    def enqueue_failed(self, picking, res):
+        """
+        批量验证时下单失败的调拨, 可以重试的错误按退避时间自动重试, 其余等待人工重试
+        :param res: jd_send_shipping_batch 返回的失败结果
+        """
+        vals = {'picking_id': picking.id, 'carrier_id': picking.carrier_id.id,
+                'attempt_count': 1, 'last_error': res['error']}
+        if res.get('transient'):
+            vals['next_attempt_date'] = fields.Datetime.add(fields.Datetime.now(), seconds=JOB_BACKOFF_BASE)
+        else:
+            vals['state'] = 'failed'
+        return self.create(vals)
+
+    def action_retry(self):
+        self.write({'state': 'pending', 'attempt_count': 0, 'next_attempt_date': fields.Datetime.now()})
+
+    def action_cancel(self):
+        self.filtered(lambda job: job.state != 'done').write({'state': 'cancel'})
+
+    @api.model
+    def _cron_process_jd_shipment_jobs(self, limit=JOB_BATCH_LIMIT):
+        """
+        按物流分组批量下单, 每组处理完立即提交, 已经在京东创建的运单不会因为后面的异常回滚
+        多个定时任务同时运行时用 SKIP LOCKED 跳过别人正在处理的任务
+        """
+        self.env.cr.execute("""
+            SELECT id FROM delivery_jd_shipment_job
+             WHERE state = 'pending' AND next_attempt_date <= (now() at time zone 'UTC')
+             ORDER BY next_attempt_date, id
+             LIMIT %s
+               FOR UPDATE SKIP LOCKED
+        """, [limit])
+        jobs = self.browse([row[0] for row in self.env.cr.fetchall()])
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        for carrier in jobs.carrier_id:
+            carrier_jobs = jobs.filtered(lambda job: job.carrier_id == carrier)
+            carrier_jobs._process(carrier)
+            if auto_commit:
+                self.env.cr.commit()
+
+    def _process(self, carrier):
+        # 已经有运单号的调拨(比如手动点了发送给承运商)不再重复下单, 已取消的调拨不再下单
+        cancelled = self.filtered(lambda job: job.picking_id.state == 'cancel')
+        cancelled.write({'state': 'cancel'})
+        shipped = (self - cancelled).filtered(lambda job: job.picking_id.carrier_tracking_ref)
+        shipped.write({'state': 'done'})
+        jobs = self - cancelled - shipped
+        if not jobs:
+            return
+        results = carrier.jd_send_shipping_batch(jobs.picking_id)
+        for job in jobs:
+            res = results[job.picking_id.id]
+            if 'error' not in res:
+                try:
+                    with self.env.cr.savepoint():
+                        job.picking_id.with_context(jd_shipping_results={job.picking_id.id: res}).send_to_shipper()
+                except Exception as e:
+                    # 京东已经生成运单, 只是回写失败, 不能再重试下单
+                    _logger.exception("回写京东运单 %s 失败", res['tracking_number'])
+                    job.write({'state': 'failed', 'attempt_count': job.attempt_count + 1,
+                               'last_error': _("已生成运单 %s, 回写失败: %s", res['tracking_number'], e)})
+                    continue
+                job.write({'state': 'done', 'attempt_count': job.attempt_count + 1, 'last_error': False})
+            elif res.get('transient') and job.attempt_count + 1 < JOB_MAX_ATTEMPTS:
+                delay = min(JOB_BACKOFF_BASE * 2 ** job.attempt_count, JOB_BACKOFF_MAX)
+                job.write({
+                    'attempt_count': job.attempt_count + 1,
+                    'next_attempt_date': fields.Datetime.add(fields.Datetime.now(), seconds=delay),
+                    'last_error': res['error'],
+                })
+            else:
+                job.write({'state': 'failed', 'attempt_count': job.attempt_count + 1, 'last_error': res['error']})
+                job.picking_id.message_post(body=_("京东物流下单失败, 请检查后在下单任务中重试: %s", res['error']))
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+EVENT_BATCH_LIMIT = 10000
+EVENT_RETENTION_DAYS = 30
+# 推送内容里各字段可能使用的名字, 按顺序取第一个有值的
+WAYBILL_KEYS = ('waybillCode', 'waybillNo', 'deliveryId')
+STATE_KEYS = ('state', 'stateCode', 'category', 'opeTitleCode')
+STATE_NAME_KEYS = ('stateName', 'operationTitle', 'opeTitle', 'operationRemark', 'opeRemark')
+OPERATE_TIME_KEYS = ('operationTime', 'operateTime', 'opeTime')
+
+
+def _first(item, keys):
+    for key in keys:
+        value = item.get(key)
+        if value not in (None, ''):
+            return value
+    return None
+
+
+def _parse_operate_time(value):
+    # 京东推送的时间是东八区时间, 字符串或毫秒时间戳
+    try:
+        if isinstance(value, (int, float)):
+            return datetime.utcfromtimestamp(value / 1000.0)
+        return datetime.strptime(value[:19], "%Y-%m-%d %H:%M:%S") - timedelta(hours=8)
+    except (TypeError, ValueError):
+        return None
+
+
+class JDTrackEvent(models.Model):
+    _name = 'delivery.jd.track.event'
+    _description = '京东物流轨迹推送'
+    _order = 'id desc'
+    _rec_name = 'waybill_code'
+    _log_access = False
+
+    waybill_code = fields.Char(string="运单号", required=True, index=True)
+    track_state = fields.Char(string="状态编码")
+    track_state_name = fields.Char(string="状态")
+    operate_time = fields.Datetime(string="操作时间")
+    payload = fields.Text(string="推送内容")
+    # 运单号 + 操作时间 + 状态编码, 京东重复推送或者被重放的同一条轨迹只保留一条
+    event_key = fields.Char(string="去重键", readonly=True)
+    receive_date = fields.Datetime(string="接收时间")
+    state = fields.Selection(selection=[
+        ('new', '待处理'),
+        ('done', '已处理'),
+        ('ignored', '已被新轨迹覆盖'),
+    ], string="处理状态", default='new', required=True, index=True)
+
+    _sql_constraints = [
+        ('event_key_uniq', 'unique(event_key)', '同一条京东轨迹只能记录一次'),
+    ]
+
+    @api.model
+    def ingest(self, items):
+        """
+        一次请求里的所有推送用一条 INSERT 写入, 已经记录过的轨迹直接跳过
+        :param items: 推送内容解析后的 dict 列表
+        :return: 写入的条数
+        """
+        rows = {}
+        for item in items:
+            waybill_code = isinstance(item, dict) and _first(item, WAYBILL_KEYS)
+            if not waybill_code:
+                continue
+            track_state, track_state_name = _first(item, STATE_KEYS), _first(item, STATE_NAME_KEYS)
+            operate_time = _first(item, OPERATE_TIME_KEYS)
+            event_key = "%s|%s|%s" % (waybill_code, operate_time or '', track_state or track_state_name or '')
+            rows[event_key] = (str(waybill_code), track_state if track_state is None else str(track_state),
+                               track_state_name if track_state_name is None else str(track_state_name),
+                               _parse_operate_time(operate_time), json.dumps(item, ensure_ascii=False), event_key)
+        if not rows:
+            return 0
+        query = """
+            INSERT INTO delivery_jd_track_event
+                   (waybill_code, track_state, track_state_name, operate_time, payload, event_key, receive_date, state)
+            VALUES {values}
+            ON CONFLICT (event_key) DO NOTHING
+        """.format(values=", ".join(["(%s, %s, %s, %s, %s, %s, (now() at time zone 'UTC'), 'new')"] * len(rows)))
+        self.env.cr.execute(query, [param for row in rows.values() for param in row])
+        return self.env.cr.rowcount
+
+    @api.model
+    def _cron_apply_jd_track_events(self, limit=EVENT_BATCH_LIMIT):
+        """
+        同一运单只取最新的一条推送, 一条 UPDATE 更新所有调拨, 比调拨上已有的轨迹旧的推送直接忽略
+        """
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        while True:
+            self.env.cr.execute("""
+                SELECT id, waybill_code, track_state, track_state_name, coalesce(operate_time, receive_date)
+                  FROM delivery_jd_track_event
+                 WHERE state = 'new'
+                 ORDER BY id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+            """, [limit])
+            events = self.env.cr.fetchall()
+            if not events:
+                return
+            latest = {}
+            for event in events:
+                current = latest.get(event[1])
+                if current is None or (event[4], event[0]) >= (current[4], current[0]):
+                    latest[event[1]] = event
+            self._apply_latest_events(latest)
+            self.env.cr.execute("""
+                UPDATE delivery_jd_track_event SET state = CASE WHEN id IN %s THEN 'done' ELSE 'ignored' END
+                 WHERE id IN %s
+            """, [tuple(event[0] for event in latest.values()), tuple(event[0] for event in events)])
+            if auto_commit:
+                self.env.cr.commit()
+            if len(events) < limit:
+                return
+
+    @api.model
+    def _apply_latest_events(self, latest):
+        """
+        :param latest: {运单号: (id, 运单号, 状态编码, 状态, 操作时间)}
+        """
+        Picking = self.env['stock.picking']
+        Picking.flush_model(['carrier_tracking_ref', 'jd_track_date'])
+        self.env.cr.execute("""
+            SELECT id, carrier_tracking_ref, jd_track_date FROM stock_picking
+             WHERE carrier_tracking_ref IN %s
+        """, [tuple(latest)])
+        rows = []
+        for picking_id, waybill_code, track_date in self.env.cr.fetchall():
+            _event_id, _waybill_code, track_state, track_state_name, operate_time = latest[waybill_code]
+            if track_date and operate_time and operate_time < track_date:
+                continue
+            rows.append((picking_id, track_state, track_state_name, operate_time))
+        if not rows:
+            return
+        query = """
+            UPDATE stock_picking p
+               SET jd_track_state = v.track_state, jd_track_state_name = v.track_state_name,
+                   jd_track_date = v.operate_time
+              FROM (VALUES {values}) AS v(id, track_state, track_state_name, operate_time)
+             WHERE p.id = v.id
+        """.format(values=", ".join(["(%s, %s, %s, %s::timestamp)"] * len(rows)))
+        self.env.cr.execute(query, [param for row in rows for param in row])
+        Picking.invalidate_model(['jd_track_state', 'jd_track_state_name', 'jd_track_date'])
+        _logger.info("京东物流轨迹推送更新了 %s 张调拨", len(rows))
+
+    @api.model
+    def _cron_gc_jd_track_events(self):
+        self.env.cr.execute("""
+            DELETE FROM delivery_jd_track_event
+             WHERE state != 'new' AND receive_date < (now() at time zone 'UTC') - interval '1 day' * %s
+        """, [EVENT_RETENTION_DAYS])
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+from odoo import fields, models
+from odoo.addons.delivery_jd_hooks.api import jd_executor
+from .jd_quote_cache import DEFAULT_TTL
+
+
+class ResConfigSettings(models.TransientModel):
+    _inherit = 'res.config.settings'
+
+    jd_max_workers = fields.Integer(string="并发请求数", config_parameter="delivery_jd.max_workers",
+                                    default=jd_executor.DEFAULT_MAX_WORKERS,
+                                    help="批量询价, 预检, 下单, 取消, 获取面单和查询运费时同时请求京东的数量")
+    jd_precheck_before_create = fields.Boolean(string="下单前预检", config_parameter="delivery_jd.precheck_before_create",
+                                               help="没有有效预检结果的调拨先调用预检接口, 未通过的不再下单")
+    jd_quote_cache_ttl = fields.Integer(string="报价缓存秒数", config_parameter="delivery_jd.quote_cache_ttl",
+                                        default=DEFAULT_TTL, help="同样的寄收地址和货物在这段时间内不再重复询价, 为 0 时不缓存")
+    jd_log_sample_rate = fields.Float(string="调试日志采样比例", config_parameter="delivery_jd.log_sample_rate",
+                                      default=1.0, help="物流开启调试日志时按这个比例记录请求, 1 为全部记录")
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, fields, models
+
+
+class SaleOrder(models.Model):
+    _inherit = 'sale.order'
+
+    jd_actual_fee = fields.Float(string="京东实际运费", compute='_compute_jd_actual_fee', store=True)
+
+    @api.depends('picking_ids.jd_actual_fee', 'picking_ids.jd_fee_state')
+    def _compute_jd_actual_fee(self):
+        # 按订单分组汇总一次, 批量对账时不逐张订单读取调拨
+        data = self.env['stock.picking']._read_group(
+            [('sale_id', 'in', self._origin.ids), ('jd_fee_state', '=', 'done')],
+            ['sale_id', 'jd_actual_fee:sum'], ['sale_id'])
+        fees = {row['sale_id'][0]: row['jd_actual_fee'] for row in data}
+        for order in self:
+            order.jd_actual_fee = fees.get(order._origin.id, 0.0)
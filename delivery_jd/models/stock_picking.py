@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools import float_compare
+from odoo.addons.delivery_jd_hooks.tools.jd_dispatch import call_in_batches
+from .jd_label import LABEL_CACHE_DAYS, merge_pdf_files
+from .jd_product_rule import JD_PRODUCT_CODES
+
+_logger = logging.getLogger(__name__)
+
+FEE_BATCH_LIMIT = 5000
+LABEL_COPY_CHUNK = 1024 * 1024
+PRECHECK_BATCH_LIMIT = 2000
+# 下单后京东一般要到妥投后才出实际运费, 先等一天再查, 查不到时按间隔加倍重查
+FEE_FIRST_DELAY = 24 * 3600
+FEE_RETRY_DELAY = 6 * 3600
+FEE_RETRY_MAX_DELAY = 7 * 24 * 3600
+FEE_MAX_ATTEMPTS = 10
+# 实际运费接口返回里按顺序取第一个有值的金额字段, 标准运费不是实际运费, 只返回标准运费时继续等待
+ACTUAL_FEE_KEYS = ('totalFreightActual', 'totalFreightDiscount')
+
+
+class StockPicking(models.Model):
+    _inherit = 'stock.picking'
+
+    jd_order_code = fields.Char(string="京东订单号", readonly=True, copy=False,
+                                help="下单时使用的京东订单号, 拆单发货时为 订单号-调拨ID")
+    jd_order_origin = fields.Selection(selection=[('1', '快递B2C'), ('4', '快运B2C')], string="京东下单来源",
+                                       readonly=True, copy=False)
+    jd_product_code = fields.Selection(selection=JD_PRODUCT_CODES, string="京东产品", readonly=True, copy=False,
+                                       help="下单时按产品选择规则选定的京东产品")
+    jd_exact_price = fields.Float(string="京东下单运费", readonly=True, copy=False,
+                                  help="下单接口返回的预估运费")
+    jd_actual_fee = fields.Float(string="京东实际运费", readonly=True, copy=False)
+    jd_fee_variance = fields.Float(string="运费差额", compute='_compute_jd_fee_variance', store=True,
+                                   help="实际运费减去下单运费")
+    jd_fee_state = fields.Selection(selection=[
+        ('pending', '待对账'),
+        ('done', '已对账'),
+        ('failed', '查询失败'),
+    ], string="运费对账状态", readonly=True, copy=False, index=True)
+    jd_fee_attempt_count = fields.Integer(string="运费查询次数", readonly=True, copy=False)
+    jd_fee_next_date = fields.Datetime(string="下次查询运费时间", readonly=True, copy=False, index=True)
+    jd_fee_error = fields.Char(string="运费查询失败原因", readonly=True, copy=False)
+    # 轨迹推送按运单号批量查找调拨
+    carrier_tracking_ref = fields.Char(index='btree_not_null')
+    jd_track_state = fields.Char(string="京东轨迹状态编码", readonly=True, copy=False)
+    jd_track_state_name = fields.Char(string="京东轨迹状态", readonly=True, copy=False)
+    jd_track_date = fields.Datetime(string="京东轨迹时间", readonly=True, copy=False)
+    jd_order_tracking_refs = fields.Char(string="同订单京东运单", compute='_compute_jd_order_tracking_refs',
+                                         help="拆单发货时同一销售订单下所有调拨的京东运单号")
+    jd_precheck_state = fields.Selection(selection=[
+        ('passed', '预检通过'),
+        ('failed', '预检未通过'),
+    ], string="京东预检", readonly=True, copy=False, index=True)
+    jd_precheck_message = fields.Char(string="预检失败原因", readonly=True, copy=False)
+    jd_precheck_date = fields.Datetime(string="预检时间", readonly=True, copy=False)
+    jd_precheck_key = fields.Char(string="预检数据摘要", readonly=True, copy=False,
+                                  help="下单数据变化后摘要不同, 需要重新预检")
+
+    @api.depends('jd_fee_state', 'jd_actual_fee', 'jd_exact_price')
+    def _compute_jd_fee_variance(self):
+        for picking in self:
+            picking.jd_fee_variance = picking.jd_actual_fee - picking.jd_exact_price \
+                if picking.jd_fee_state == 'done' else 0.0
+
+    @api.depends('sale_id.picking_ids.carrier_tracking_ref')
+    def _compute_jd_order_tracking_refs(self):
+        for picking in self:
+            siblings = picking.sale_id.picking_ids.filtered(
+                lambda p: p.carrier_tracking_ref and p.carrier_id.delivery_type == 'jd')
+            # 只有一张调拨时与运单号字段重复, 不再显示
+            picking.jd_order_tracking_refs = ", ".join(siblings.mapped('carrier_tracking_ref')) \
+                if len(siblings) > 1 else False
+
+    def _jd_fee_pending_vals(self, exact_price):
+        return {
+            'jd_exact_price': exact_price,
+            'jd_actual_fee': 0.0,
+            'jd_fee_state': 'pending',
+            'jd_fee_attempt_count': 0,
+            'jd_fee_next_date': fields.Datetime.add(fields.Datetime.now(), seconds=FEE_FIRST_DELAY),
+            'jd_fee_error': False,
+        }
+
+    def action_jd_reconcile_fee(self):
+        self.filtered(lambda p: p.carrier_id.delivery_type == 'jd' and p.carrier_tracking_ref).write({
+            'jd_fee_state': 'pending',
+            'jd_fee_attempt_count': 0,
+            'jd_fee_next_date': fields.Datetime.now(),
+            'jd_fee_error': False,
+        })
+
+    def _jd_pickings_to_ship(self, delivery_type):
+        # 与 delivery 模块 _send_confirmation_email 里自动下单的条件保持一致
+        return self.filtered(lambda p: p.carrier_id.delivery_type == delivery_type
+                                       and p.carrier_id.integration_level == 'rate_and_ship'
+                                       and p.picking_type_code != 'incoming'
+                                       and not p.carrier_tracking_ref
+                                       and p.picking_type_id.print_label)
+
+    def _send_confirmation_email(self):
+        to_ship = self._jd_pickings_to_ship('jd')
+        # 排队下单的调拨只记录任务, 由定时任务批量下单
+        queued = to_ship.filtered(lambda p: p.carrier_id.jd_shipping_mode == 'queued')
+        if queued:
+            self.env['delivery.jd.shipment.job'].sudo().enqueue(queued)
+            self = self.with_context(jd_shipping_queued=queued.ids)
+            to_ship -= queued
+        if len(to_ship) < 2:
+            return super(StockPicking, self)._send_confirmation_email()
+        # 批量验证时先按物流分组批量下单, 再交给原有流程逐条回写运单号和运费
+        results, errors = {}, {}
+        for carrier in to_ship.carrier_id:
+            batch = carrier.jd_send_shipping_batch(to_ship.filtered(lambda p: p.carrier_id == carrier))
+            for picking_id, res in batch.items():
+                if 'error' in res:
+                    errors[picking_id] = res
+                else:
+                    results[picking_id] = res
+        return super(StockPicking, self.with_context(jd_shipping_results=results, jd_shipping_errors=errors)
+                     )._send_confirmation_email()
+
+    def send_to_shipper(self):
+        if self.id in (self.env.context.get('jd_shipping_queued') or []):
+            self.message_post(body=_("已加入京东物流下单队列"))
+            return
+        # 批量下单中失败的调拨不再单独请求, 转为下单任务, 可以重试的错误由定时任务自动重试
+        error = (self.env.context.get('jd_shipping_errors') or {}).get(self.id)
+        if error:
+            self.env['delivery.jd.shipment.job'].sudo().enqueue_failed(self, error)
+            self.message_post(body=_("京东物流下单失败, 已转为下单任务: %s", error['error']))
+            return
+        return super().send_to_shipper()
+
+    def action_jd_cancel_shipment_batch(self):
+        """
+        批量取消京东运单, 按物流分组批量请求, 失败的运单保留运单号并在调拨上记录原因
+        :return: 取消结果的通知
+        """
+        pickings = self.filtered(lambda p: p.carrier_id.delivery_type == 'jd' and p.carrier_tracking_ref)
+        cancelled, failed = self.browse(), self.browse()
+        for carrier in pickings.carrier_id:
+            carrier_pickings = pickings.filtered(lambda p: p.carrier_id == carrier)
+            carrier_cancelled, carrier_failed = carrier_pickings._jd_apply_cancel_results(
+                carrier.jd_cancel_shipment_batch(carrier_pickings))
+            cancelled |= carrier_cancelled
+            failed |= carrier_failed
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("取消京东运单"),
+                'message': _("已取消 %s 个运单, 失败 %s 个, 跳过 %s 个没有京东运单的调拨",
+                             len(cancelled), len(failed), len(self - pickings)),
+                'type': 'warning' if failed else 'success',
+                'sticky': bool(failed),
+            },
+        }
+
+    def _jd_apply_cancel_results(self, results):
+        """
+        取消成功的调拨清空运单号, 失败的保留运单号并在调拨上记录原因
+        :param results: jd_cancel_shipment_batch 的结果
+        :return: (已取消的调拨, 取消失败的调拨)
+        """
+        cancelled, failed = self.browse(), self.browse()
+        for picking in self:
+            if results[picking.id]['success']:
+                picking.message_post(body=_("Shipment %s cancelled", picking.carrier_tracking_ref))
+                cancelled |= picking
+            else:
+                picking.message_post(body=_("京东运单 %s 取消失败: %s",
+                                            picking.carrier_tracking_ref, results[picking.id]['msg']))
+                failed |= picking
+        cancelled.write({'carrier_tracking_ref': False})
+        return cancelled, failed
+
+    def cancel_shipment(self):
+        # 京东运单由 jd_cancel_shipment 逐张清空运单号, 部分失败时已取消的运单不会被回滚, 失败的也不会被清空
+        jd_pickings = self.filtered(lambda p: p.carrier_id.delivery_type == 'jd')
+        for carrier in jd_pickings.carrier_id:
+            carrier.jd_cancel_shipment(jd_pickings.filtered(lambda p: p.carrier_id == carrier))
+        return super(StockPicking, self - jd_pickings).cancel_shipment()
+
+    def _jd_label_attachment_target(self):
+        # 同一个波次的调拨把面单挂在波次上, 没有安装波次模块时 batch_id 字段不存在
+        # 跨波次或者没有波次时挂在第一张调拨上, 附件总有所属记录, 不会变成没人能访问的孤立附件
+        batch = self.batch_id if 'batch_id' in self._fields else None
+        if batch and len(batch) == 1:
+            return {'res_model': batch._name, 'res_id': batch.id}
+        return {'res_model': self._name, 'res_id': self[:1].id}
+
+    @api.model
+    def _jd_create_file_attachment(self, vals, output):
+        """
+        把合并结果直接复制进 filestore 再建附件, 附件存在数据库里时只能读入内存
+        :param output: 已写好内容的二进制文件对象
+        """
+        attachment_model = self.env['ir.attachment']
+        output.seek(0)
+        if attachment_model._storage() != 'file':
+            return attachment_model.create(dict(vals, raw=output.read()))
+        sha = hashlib.sha1()
+        for chunk in iter(lambda: output.read(LABEL_COPY_CHUNK), b''):
+            sha.update(chunk)
+        checksum = sha.hexdigest()
+        fname = '%s/%s' % (checksum[:2], checksum)
+        full_path = attachment_model._full_path(fname)
+        if not os.path.exists(full_path):
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            output.seek(0)
+            with open(full_path, 'wb') as f:
+                shutil.copyfileobj(output, f, LABEL_COPY_CHUNK)
+        # 与 _file_write 一样登记文件, 事务回滚后由附件垃圾回收删除
+        attachment_model._mark_for_gc(fname)
+        return attachment_model.create(dict(vals, store_fname=fname, checksum=checksum, file_size=output.tell()))
+
+    def action_jd_print_labels(self):
+        """
+        批量获取选中调拨的京东面单, 按调拨顺序合并成一个 PDF 下载
+        获取失败的调拨在单据上记录原因, 其余照常合并
+        """
+        pickings = self.filtered(lambda p: p.carrier_id.delivery_type == 'jd' and p.carrier_tracking_ref)
+        if not pickings:
+            raise UserError(_("选中的调拨没有京东运单"))
+        results = {}
+        for carrier in pickings.carrier_id:
+            results.update(carrier.jd_fetch_labels(pickings.filtered(lambda p: p.carrier_id == carrier)))
+        errors = []
+        for picking in pickings:
+            path, error = results[picking.id]
+            if not path:
+                picking.message_post(body=_("京东面单 %s 获取失败: %s", picking.carrier_tracking_ref, error))
+                errors.append("%s: %s" % (picking.carrier_tracking_ref, error))
+        paths = [results[picking.id][0] for picking in pickings if results[picking.id][0]]
+        if not paths:
+            raise UserError("\n".join(errors))
+        with tempfile.TemporaryFile() as output:
+            merge_pdf_files(paths, output)
+            attachment = self._jd_create_file_attachment(dict(pickings._jd_label_attachment_target(), **{
+                'name': _("京东面单-%s.pdf", fields.Datetime.context_timestamp(self, fields.Datetime.now()).strftime(
+                    '%Y%m%d%H%M%S')),
+                'mimetype': 'application/pdf',
+            }), output)
+        if errors:
+            _logger.warning("京东面单获取失败 %s 张: %s", len(errors), "; ".join(errors))
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/web/content/%s?download=true' % attachment.id,
+            'target': 'new',
+        }
+
+    @api.model
+    def _cron_gc_jd_labels(self):
+        removed = self.env['delivery.carrier'].jd_label_cache().gc(LABEL_CACHE_DAYS)
+        _logger.info("清理京东面单缓存 %s 个文件", removed)
+
+    @api.model
+    def _jd_write_precheck_results(self, rows):
+        """
+        一条 UPDATE 写入所有调拨的预检结果
+        :param rows: [(picking.id, 'passed'/'failed', 失败原因, 请求数据摘要)]
+        """
+        query = """
+            UPDATE stock_picking p
+               SET jd_precheck_state = v.state, jd_precheck_message = v.message, jd_precheck_key = v.key,
+                   jd_precheck_date = (now() at time zone 'UTC')
+              FROM (VALUES {values}) AS v(id, state, message, key)
+             WHERE p.id = v.id
+        """.format(values=", ".join(["(%s, %s, %s::varchar, %s::varchar)"] * len(rows)))
+        self.env.cr.execute(query, [param for row in rows for param in row])
+        self.invalidate_model(['jd_precheck_state', 'jd_precheck_message', 'jd_precheck_key', 'jd_precheck_date'])
+
+    def _jd_pickings_to_precheck(self):
+        return self.filtered(lambda p: p.carrier_id.delivery_type == 'jd'
+                                       and p.picking_type_code == 'outgoing'
+                                       and not p.carrier_tracking_ref
+                                       and p.state not in ('draft', 'done', 'cancel'))
+
+    def action_jd_precheck(self):
+        """
+        手动预检选中的调拨, 忽略已有的预检结果
+        :return: 预检结果的通知
+        """
+        pickings = self._jd_pickings_to_precheck()
+        passed, failed, unknown = 0, 0, 0
+        for carrier in pickings.carrier_id:
+            results = carrier.jd_precheck_pickings(pickings.filtered(lambda p: p.carrier_id == carrier), force=True)
+            for state, _msg in results.values():
+                if state is None:
+                    unknown += 1
+                elif state:
+                    passed += 1
+                else:
+                    failed += 1
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("京东预检"),
+                'message': _("预检通过 %s 张, 未通过 %s 张, 京东接口不可用 %s 张, 跳过 %s 张不需要预检的调拨",
+                             passed, failed, unknown, len(self - pickings)),
+                'type': 'warning' if failed or unknown else 'success',
+                'sticky': bool(failed),
+            },
+        }
+
+    @api.model
+    def _cron_jd_precheck_pickings(self, limit=PRECHECK_BATCH_LIMIT):
+        """
+        发货前预检已就绪的京东出库调拨, 有效期内并且下单数据没有变化的不会重复请求
+        按物流分组, 每组处理完立即提交
+        """
+        pickings = self.search([
+            ('state', '=', 'assigned'),
+            ('picking_type_code', '=', 'outgoing'),
+            ('carrier_id.delivery_type', '=', 'jd'),
+            ('carrier_tracking_ref', '=', False),
+        ], order='scheduled_date, id', limit=limit)
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        failed = 0
+        for carrier in pickings.carrier_id:
+            results = carrier.jd_precheck_pickings(pickings.filtered(lambda p: p.carrier_id == carrier))
+            failed += sum(1 for state, _msg in results.values() if state is False)
+            if auto_commit:
+                self.env.cr.commit()
+        _logger.info("京东预检: 检查 %s 张调拨, %s 张未通过", len(pickings), failed)
+
+    @api.model
+    def _cron_reconcile_jd_actual_fees(self, limit=FEE_BATCH_LIMIT):
+        """
+        只查询待对账并且到了查询时间的调拨, 已对账的调拨不会再进入查询
+        按物流分组, 每组按批量大小拆分后并发查询, 每组处理完立即提交
+        """
+        self.env['stock.picking'].flush_model(['jd_fee_state', 'jd_fee_next_date'])
+        self.env.cr.execute("""
+            SELECT id FROM stock_picking
+             WHERE jd_fee_state = 'pending' AND jd_fee_next_date <= (now() at time zone 'UTC')
+             ORDER BY jd_fee_next_date, id
+             LIMIT %s
+        """, [limit])
+        pickings = self.browse([row[0] for row in self.env.cr.fetchall()])
+        auto_commit = not getattr(threading.current_thread(), 'testing', False)
+        for carrier in pickings.carrier_id:
+            carrier_pickings = pickings.filtered(lambda p: p.carrier_id == carrier)
+            if carrier.delivery_type != 'jd':
+                carrier_pickings.write({'jd_fee_state': False, 'jd_fee_next_date': False})
+                continue
+            carrier_pickings._jd_reconcile_actual_fees(carrier)
+            if auto_commit:
+                self.env.cr.commit()
+
+    def _jd_reconcile_actual_fees(self, carrier):
+        carrier = carrier.sudo()
+        api = carrier.jd_new_api()
+        precision = self.env['decimal.precision'].precision_get('Product Price')
+        done, variances = 0, 0
+        for picking, _val, item in call_in_batches(api, 'orders_actualfee_query', self, lambda picking: {
+            "waybillCode": picking.carrier_tracking_ref,
+            "orderCode": picking.jd_order_code or picking.origin,
+            "orderOrigin": picking.jd_order_origin or carrier.jd_order_origin,
+            "customerCode": carrier.jd_customer_code,
+            "businessUnitCode": carrier.jd_business_unit_code,
+        }, lambda val: val['waybillCode'], api.ORDERS_BATCH_SIZE, carrier._jd_config()['max_workers']):
+            fee = next((item['data'][key] for key in ACTUAL_FEE_KEYS if item['data'].get(key) is not None), None)
+            if not item['success'] or fee is None:
+                # 还没出账和接口失败都稍后重查
+                picking._jd_fee_retry(item['msg'] or _("京东尚未返回实际运费"))
+                continue
+            picking.write({'jd_actual_fee': fee, 'jd_fee_state': 'done', 'jd_fee_next_date': False,
+                           'jd_fee_attempt_count': picking.jd_fee_attempt_count + 1, 'jd_fee_error': False})
+            done += 1
+            if float_compare(fee, picking.jd_exact_price, precision_digits=precision):
+                variances += 1
+        _logger.info("京东运费对账 %s: 查询 %s 条, 完成 %s 条, 其中 %s 条与下单运费不一致",
+                     carrier.name, len(self), done, variances)
+
+    def _jd_fee_retry(self, error):
+        self.ensure_one()
+        attempt_count = self.jd_fee_attempt_count + 1
+        if attempt_count >= FEE_MAX_ATTEMPTS:
+            self.write({'jd_fee_state': 'failed', 'jd_fee_attempt_count': attempt_count,
+                        'jd_fee_next_date': False, 'jd_fee_error': error})
+            return
+        delay = min(FEE_RETRY_DELAY * 2 ** self.jd_fee_attempt_count, FEE_RETRY_MAX_DELAY)
+        self.write({
+            'jd_fee_attempt_count': attempt_count,
+            'jd_fee_next_date': fields.Datetime.add(fields.Datetime.now(), seconds=delay),
+            'jd_fee_error': error,
+        })
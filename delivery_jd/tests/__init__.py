@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+
+from . import test_jd_shipping_batch
+from . import test_jd_shipment_job
+from . import test_jd_cancel
+from . import test_jd_quote
+from . import test_jd_product_rule
+from . import test_jd_precheck
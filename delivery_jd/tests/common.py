@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import json
+from unittest.mock import patch
+
+import requests
+
+from odoo.tests.common import TransactionCase
+from odoo.addons.delivery_jd_hooks.api.jd_api import JDApi
+
+
+def jd_response(payload, status=200):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(payload).encode('UTF-8')
+    return response
+
+
+def jd_result(result):
+    """
+    :param result: 成功时为返回的 data, 业务失败时为失败原因
+    """
+    if isinstance(result, str):
+        return {'success': False, 'code': 2000, 'msg': 'failed', 'subMsg': result}
+    return {'success': True, 'code': 0, 'msg': 'ok', 'data': result}
+
+
+class JDCommon(TransactionCase):
+    """
+    京东接口按 JDApi 的方法打补丁, 请求在线程里发出时也能拦截, 不访问网络
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # 物流的密钥和产品表缓存在进程内, 测试回滚后需要清掉
+        cls.addClassCleanup(cls.registry.clear_caches)
+        icp = cls.env['ir.config_parameter'].sudo()
+        icp.set_param('delivery_jd.jd_app_key', 'test-app-key')
+        icp.set_param('delivery_jd.jd_app_secret', 'test-app-secret')
+        cls.carrier = cls.env.ref('delivery_jd.jd_b2c_edm0001_delivery_carrier')
+        cls.carrier.write({
+            'jd_access_token': 'test-access-token',
+            'jd_customer_code': '010K000000',
+            'integration_level': 'rate_and_ship',
+        })
+        cny = cls.env.ref('base.CNY')
+        cny.active = True
+        cls.pricelist = cls.env['product.pricelist'].create({'name': 'JD CNY', 'currency_id': cny.id})
+        cls.warehouse = cls.env['stock.warehouse'].search([('company_id', '=', cls.env.company.id)], limit=1)
+        cls.warehouse.out_type_id.print_label = True
+        cls.customer_location = cls.env.ref('stock.stock_location_customers')
+        cls.product = cls.env['product.product'].create({'name': 'JD Test Product', 'type': 'consu', 'weight': 2.0})
+        cls.customer = cls.env['res.partner'].create({
+            'name': 'JD Test Customer',
+            'street': '科创十一街18号',
+            'city': '北京市',
+            'mobile': '13800000000',
+        })
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(self.registry.clear_caches)
+        # 报价缓存, 熔断状态和接口指标使用单独的游标写入, 测试里与测试事务共用
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+
+    @classmethod
+    def _create_order(cls, product=None):
+        return cls.env['sale.order'].create({
+            'partner_id': cls.customer.id,
+            'pricelist_id': cls.pricelist.id,
+            'warehouse_id': cls.warehouse.id,
+            'order_line': [(0, 0, {'product_id': (product or cls.product).id, 'product_uom_qty': 1.0})],
+        })
+
+    @classmethod
+    def _create_picking(cls, order=None, **vals):
+        order = order or cls._create_order()
+        product = order.order_line.product_id
+        return cls.env['stock.picking'].create(dict({
+            'partner_id': order.partner_shipping_id.id,
+            'picking_type_id': cls.warehouse.out_type_id.id,
+            'location_id': cls.warehouse.lot_stock_id.id,
+            'location_dest_id': cls.customer_location.id,
+            'origin': order.name,
+            'carrier_id': cls.carrier.id,
+            'move_ids': [(0, 0, {
+                'name': product.name,
+                'product_id': product.id,
+                'product_uom_qty': 1.0,
+                'product_uom': product.uom_id.id,
+                'location_id': cls.warehouse.lot_stock_id.id,
+                'location_dest_id': cls.customer_location.id,
+            })],
+        }, **vals))
+
+    def jd_patch(self, method, handler):
+        """
+        :param handler: 请求里的一条数据 -> jd_result 的参数, 也可以抛出 requests 的异常模拟网络故障
+        :return: 可以用作 with 的补丁, 得到的 mock 记录了每次请求
+        """
+        def request(api, data):
+            return jd_response(jd_result(handler(data[0] if isinstance(data, list) else data)))
+
+        return patch.object(JDApi, method, autospec=True, side_effect=request)
+
+    @staticmethod
+    def jd_requests(mock):
+        return [call.args[1][0] for call in mock.call_args_list]
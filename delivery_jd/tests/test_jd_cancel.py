@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from odoo.exceptions import ValidationError
+from odoo.tests import tagged
+from .common import JDCommon
+
+
+@tagged('post_install', '-at_install')
+class TestJDCancel(JDCommon):
+
+    def setUp(self):
+        super().setUp()
+        self.picking_1 = self._create_picking(carrier_tracking_ref='JD0001')
+        self.picking_2 = self._create_picking(carrier_tracking_ref='JD0002')
+
+    def test_partial_failure_keeps_failed_waybill(self):
+        def cancel(vals):
+            if vals['waybillCode'] == 'JD0002':
+                return "运单已揽收, 不能取消"
+            return {'waybillCode': vals['waybillCode']}
+
+        with self.jd_patch('orders_cancel', cancel) as orders_cancel:
+            (self.picking_1 | self.picking_2).cancel_shipment()
+        self.assertEqual({vals['waybillCode'] for vals in self.jd_requests(orders_cancel)}, {'JD0001', 'JD0002'})
+        self.assertFalse(self.picking_1.carrier_tracking_ref)
+        self.assertEqual(self.picking_2.carrier_tracking_ref, 'JD0002')
+
+    def test_all_failed_raises(self):
+        with self.jd_patch('orders_cancel', lambda vals: "运单已揽收, 不能取消"), \
+                self.assertRaisesRegex(ValidationError, "运单已揽收"):
+            (self.picking_1 | self.picking_2).cancel_shipment()
+        self.assertEqual(self.picking_1.carrier_tracking_ref, 'JD0001')
+        self.assertEqual(self.picking_2.carrier_tracking_ref, 'JD0002')
+
+    def test_batch_action_does_not_raise(self):
+        with self.jd_patch('orders_cancel', lambda vals: "运单已揽收, 不能取消"):
+            action = (self.picking_1 | self.picking_2).action_jd_cancel_shipment_batch()
+        self.assertEqual(action['params']['type'], 'warning')
+        self.assertEqual(self.picking_1.carrier_tracking_ref, 'JD0001')
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from odoo.exceptions import ValidationError
+from odoo.tests import tagged
+from .common import JDCommon
+
+
+@tagged('post_install', '-at_install')
+class TestJDPrecheck(JDCommon):
+
+    def setUp(self):
+        super().setUp()
+        self.env['ir.config_parameter'].sudo().set_param('delivery_jd.precheck_before_create', 'True')
+
+    def _create(self, vals):
+        return {'orderId': vals['orderId'], 'waybillCode': 'JD0001'}
+
+    def test_precheck_result_reused(self):
+        prechecked, unchecked = self._create_picking(), self._create_picking()
+        with self.jd_patch('ecap_v1_orders_precheck', lambda data: {}) as precheck:
+            results = self.carrier.jd_precheck_pickings(prechecked)
+        self.assertEqual(results[prechecked.id], (True, False))
+        self.assertEqual(precheck.call_count, 1)
+        self.assertEqual(prechecked.jd_precheck_state, 'passed')
+        self.assertTrue(prechecked.jd_precheck_key)
+
+        with self.jd_patch('ecap_v1_orders_precheck', lambda data: {}) as precheck, \
+                self.jd_patch('orders_create', self._create):
+            prechecked.send_to_shipper()
+            self.assertEqual(precheck.call_count, 0)
+            unchecked.send_to_shipper()
+            self.assertEqual(precheck.call_count, 1)
+
+    def test_changed_data_prechecked_again(self):
+        picking = self._create_picking()
+        with self.jd_patch('ecap_v1_orders_precheck', lambda data: {}):
+            self.carrier.jd_precheck_pickings(picking)
+        self.carrier.jd_customer_code = '010K000001'
+        with self.jd_patch('ecap_v1_orders_precheck', lambda data: {}) as precheck:
+            self.carrier.jd_precheck_pickings(picking)
+        self.assertEqual(precheck.call_count, 1)
+
+    def test_failed_precheck_blocks_create(self):
+        picking = self._create_picking()
+        with self.jd_patch('ecap_v1_orders_precheck', lambda data: "收件地址超区"):
+            self.carrier.jd_precheck_pickings(picking)
+        self.assertEqual(picking.jd_precheck_state, 'failed')
+        with self.jd_patch('orders_create', self._create) as orders_create, \
+                self.assertRaisesRegex(ValidationError, "收件地址超区"):
+            picking.send_to_shipper()
+        orders_create.assert_not_called()
+
+    def test_local_check_not_reused_on_send(self):
+        weightless = self.env['product.product'].create({'name': 'JD Weightless Product', 'type': 'consu'})
+        picking = self._create_picking(self._create_order(weightless))
+        with self.jd_patch('ecap_v1_orders_precheck', lambda data: {}) as precheck:
+            passed, _msg = self.carrier.jd_precheck_pickings(picking)[picking.id]
+        self.assertFalse(passed)
+        precheck.assert_not_called()
+        self.assertEqual(picking.jd_precheck_state, 'failed')
+        self.assertFalse(picking.jd_precheck_key)
+
+        # 本地检查只在发货前预检时执行, 下单时由京东预检判断
+        with self.jd_patch('ecap_v1_orders_precheck', lambda data: {}) as precheck, \
+                self.jd_patch('orders_create', self._create):
+            picking.send_to_shipper()
+        self.assertEqual(precheck.call_count, 1)
+        self.assertEqual(picking.carrier_tracking_ref, 'JD0001')
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tests import tagged
+from .common import JDCommon
+
+PRICES = {'ed-m-0001': 9.0, 'ed-m-0002': 15.0}
+
+
+@tagged('post_install', '-at_install')
+class TestJDProductRule(JDCommon):
+
+    def setUp(self):
+        super().setUp()
+        self.carrier.write({'jd_product_rule_ids': [
+            (0, 0, {'product_code': 'ed-m-0001', 'speed': 10}),
+            (0, 0, {'product_code': 'ed-m-0002', 'speed': 5}),
+        ]})
+
+    def _precheck(self, data):
+        return {'totalFreightStandard': PRICES[data['productsReq']['productCode']]}
+
+    def test_rate_cheapest(self):
+        with self.jd_patch('ecap_v1_orders_precheck', self._precheck) as precheck:
+            res = self.carrier.jd_rate_shipment(self._create_order())
+        self.assertEqual(precheck.call_count, 2)
+        self.assertEqual(res['price'], 9.0)
+
+    def test_rate_fastest(self):
+        self.carrier.jd_product_strategy = 'fastest'
+        with self.jd_patch('ecap_v1_orders_precheck', self._precheck):
+            res = self.carrier.jd_rate_shipment(self._create_order())
+        self.assertEqual(res['price'], 15.0)
+
+    def test_ship_cheapest(self):
+        picking = self._create_picking()
+        with self.jd_patch('ecap_v1_orders_precheck', self._precheck) as precheck, \
+                self.jd_patch('orders_create', lambda vals: {'orderId': vals['orderId'], 'waybillCode': 'JD0001'}) \
+                as orders_create:
+            picking.send_to_shipper()
+        # 下单前的预检直接使用刚询过价的报价, 每个候选产品只请求一次
+        self.assertEqual(precheck.call_count, 2)
+        vals, = self.jd_requests(orders_create)
+        self.assertEqual(vals['productsReq']['productCode'], 'ed-m-0001')
+        self.assertEqual(picking.jd_product_code, 'ed-m-0001')
+
+    def test_heavy_parcel_goes_freight(self):
+        self.carrier.write({'jd_product_rule_ids': [(5, 0, 0)], 'jd_business_unit_code': 'EBU0000000'})
+        heavy = self.env['product.product'].create({'name': 'JD Heavy Product', 'type': 'consu', 'weight': 45.0})
+        picking = self._create_picking(self._create_order(heavy))
+        with self.jd_patch('orders_create', lambda vals: {'orderId': vals['orderId'], 'waybillCode': 'JD0002'}) \
+                as orders_create:
+            picking.send_to_shipper()
+        vals, = self.jd_requests(orders_create)
+        self.assertEqual(vals['orderOrigin'], '4')
+        self.assertEqual(vals['productsReq']['productCode'], 'fr-m-0004')
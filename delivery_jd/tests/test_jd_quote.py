@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from unittest.mock import patch
+
+from odoo.tests import tagged
+from odoo.addons.delivery_jd_hooks.api.jd_breaker import CircuitOpenError, JDCircuitBreaker
+from .common import JDCommon
+
+
+@tagged('post_install', '-at_install')
+class TestJDQuote(JDCommon):
+
+    def _open_circuit(self):
+        return patch.object(JDCircuitBreaker, 'before', side_effect=CircuitOpenError("circuit open"))
+
+    def test_quote_is_cached(self):
+        order = self._create_order()
+        with self.jd_patch('ecap_v1_orders_precheck', lambda data: {'totalFreightStandard': 18.0}) as precheck:
+            self.assertEqual(self.carrier.jd_rate_shipment(order)['price'], 18.0)
+            self.assertEqual(self.carrier.jd_rate_shipment(order)['price'], 18.0)
+        self.assertEqual(precheck.call_count, 1)
+
+    def test_circuit_open_uses_stale_quote(self):
+        order = self._create_order()
+        with self.jd_patch('ecap_v1_orders_precheck', lambda data: {'totalFreightStandard': 18.0}):
+            self.carrier.jd_rate_shipment(order)
+        # 报价已经过期, 但还在降级保留时间内
+        self.env.cr.execute("""
+            UPDATE delivery_jd_quote_cache SET expire_date = (now() at time zone 'UTC') - interval '1 hour'
+        """)
+        with self._open_circuit():
+            res = self.carrier.jd_rate_shipment(order)
+        self.assertTrue(res['success'])
+        self.assertEqual(res['price'], 18.0)
+        self.assertTrue(res['warning_message'])
+
+    def test_circuit_open_without_quote(self):
+        with self._open_circuit():
+            res = self.carrier.jd_rate_shipment(self._create_order())
+        self.assertFalse(res['success'])
+        self.assertTrue(res['error_message'])
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import requests
+
+from odoo import fields
+from odoo.tests import tagged
+from .common import JDCommon
+
+
+@tagged('post_install', '-at_install')
+class TestJDShipmentJob(JDCommon):
+
+    def _make_due(self, jobs):
+        # 定时任务按数据库事务开始的时间取到期的任务
+        jobs.write({'next_attempt_date': fields.Datetime.subtract(fields.Datetime.now(), hours=1)})
+        jobs.env.flush_all()
+
+    def _run_cron(self):
+        self.env['delivery.jd.shipment.job']._cron_process_jd_shipment_jobs()
+
+    def test_transient_failure_retries(self):
+        picking = self._create_picking()
+        job = self.env['delivery.jd.shipment.job'].enqueue(picking)
+        self._make_due(job)
+
+        def unreachable(vals):
+            raise requests.ConnectionError("connection reset")
+
+        with self.jd_patch('orders_create', unreachable):
+            self._run_cron()
+        self.assertEqual(job.state, 'pending')
+        self.assertEqual(job.attempt_count, 1)
+        self.assertTrue(job.last_error)
+        self.assertGreater(job.next_attempt_date, fields.Datetime.now())
+
+        self._make_due(job)
+        with self.jd_patch('orders_create', lambda vals: {'orderId': vals['orderId'], 'waybillCode': 'JD0002'}):
+            self._run_cron()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(job.attempt_count, 2)
+        self.assertEqual(picking.carrier_tracking_ref, 'JD0002')
+
+    def test_failed_job_manual_retry(self):
+        picking = self._create_picking()
+        job = self.env['delivery.jd.shipment.job'].enqueue(picking)
+        self._make_due(job)
+        with self.jd_patch('orders_create', lambda vals: "收件地址超区"):
+            self._run_cron()
+        self.assertEqual(job.state, 'failed')
+
+        job.action_retry()
+        self.assertEqual(job.state, 'pending')
+        self.assertEqual(job.attempt_count, 0)
+        self._make_due(job)
+        with self.jd_patch('orders_create', lambda vals: {'orderId': vals['orderId'], 'waybillCode': 'JD0003'}):
+            self._run_cron()
+        self.assertEqual(job.state, 'done')
+        self.assertEqual(picking.carrier_tracking_ref, 'JD0003')
+
+    def test_cancel(self):
+        pending = self.env['delivery.jd.shipment.job'].enqueue(self._create_picking())
+        done = self.env['delivery.jd.shipment.job'].enqueue(self._create_picking())
+        done.state = 'done'
+        (pending | done).action_cancel()
+        self.assertEqual(pending.state, 'cancel')
+        self.assertEqual(done.state, 'done')
+
+        self._make_due(pending)
+        with self.jd_patch('orders_create', lambda vals: {'orderId': vals['orderId'], 'waybillCode': 'JD0004'}) \
+                as orders_create:
+            self._run_cron()
+        orders_create.assert_not_called()
+
+    def test_cancelled_picking_skipped(self):
+        picking = self._create_picking()
+        job = self.env['delivery.jd.shipment.job'].enqueue(picking)
+        picking.action_cancel()
+        self._make_due(job)
+        with self.jd_patch('orders_create', lambda vals: {'orderId': vals['orderId'], 'waybillCode': 'JD0005'}) \
+                as orders_create:
+            self._run_cron()
+        orders_create.assert_not_called()
+        self.assertEqual(job.state, 'cancel')
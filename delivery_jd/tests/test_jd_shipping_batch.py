@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+import requests
+
+from odoo.tests import tagged
+from .common import JDCommon
+
+
+@tagged('post_install', '-at_install')
+class TestJDShippingBatch(JDCommon):
+
+    def test_partial_failure_creates_jobs(self):
+        ok, rejected, unreachable = self._create_picking(), self._create_picking(), self._create_picking()
+
+        def create(vals):
+            if vals['orderId'] == rejected.origin:
+                return "收件地址超区"
+            if vals['orderId'] == unreachable.origin:
+                raise requests.ConnectionError("connection reset")
+            return {'orderId': vals['orderId'], 'waybillCode': 'JD0001', 'freightPre': 12.0}
+
+        with self.jd_patch('orders_create', create) as orders_create:
+            (ok | rejected | unreachable)._send_confirmation_email()
+        # 批量下单中失败的调拨不再单独请求
+        self.assertEqual(orders_create.call_count, 3)
+        self.assertEqual(ok.carrier_tracking_ref, 'JD0001')
+        self.assertEqual(ok.jd_exact_price, 12.0)
+        self.assertEqual(ok.jd_fee_state, 'pending')
+
+        jobs = self.env['delivery.jd.shipment.job'].search([('picking_id', 'in', (ok | rejected | unreachable).ids)])
+        self.assertEqual(jobs.picking_id, rejected | unreachable)
+        rejected_job = jobs.filtered(lambda job: job.picking_id == rejected)
+        self.assertEqual(rejected_job.state, 'failed')
+        self.assertIn("收件地址超区", rejected_job.last_error)
+        # 网络异常可以重试, 由定时任务稍后重新下单
+        unreachable_job = jobs.filtered(lambda job: job.picking_id == unreachable)
+        self.assertEqual(unreachable_job.state, 'pending')
+        self.assertEqual(unreachable_job.attempt_count, 1)
+        self.assertFalse(rejected.carrier_tracking_ref)
+        self.assertFalse(unreachable.carrier_tracking_ref)
@@ -1 +1,3 @@
+from . import api
 from . import models
+from . import tools
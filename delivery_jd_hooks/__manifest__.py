@@ -8,7 +8,11 @@
     "website": "https://www.sooscake.site",
     "depends": ["stock"],
     "data": [
+        "security/ir.model.access.csv",
+        "data/ir_cron_data.xml",
         "views/res_config_settings_views.xml",
+        "views/jd_metric_views.xml",
+        "views/jd_circuit_views.xml",
     ],
     "installable": True,
     'application': False,
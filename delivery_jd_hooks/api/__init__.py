@@ -0,0 +1,7 @@
+from . import jd_breaker
+from . import jd_cache
+from . import jd_metrics
+from . import jd_session
+from . import jd_signer
+from . import jd_api
+from . import jd_executor
@@ -0,0 +1,310 @@
+import base64
+import copy
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from .jd_breaker import CircuitOpenError
+from .jd_metrics import METRICS, get_metrics
+from .jd_session import get_session
+from .jd_signer import HEADERS, get_signer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_logger = logging.getLogger(__name__)
+
+
+def dumps(data):
+    """
+    紧凑的请求体, 签名和发送使用同一份 bytes, 安装了 orjson 时优先使用
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode("UTF-8")
+
+
+def response_error_code(response):
+    """
+    :return: 失败原因, 成功时返回 None; 返回内容里没有 false 时不解析 json
+    """
+    if response.status_code != 200:
+        return "HTTP %s" % response.status_code
+    content = response.content
+    if b'false' not in content:
+        return None
+    try:
+        result = orjson.loads(content) if orjson is not None else json.loads(content)
+    except ValueError:
+        return "invalid json"
+    if isinstance(result, dict) and result.get('success') is False:
+        return str(result.get('subMsg') or result.get('msg') or result.get('code') or 'failed')[:100]
+    return None
+
+
+class JDRequestRecord:
+    """
+    一次请求的结构化记录, 请求体和返回内容只在真正写日志时才格式化
+    """
+    __slots__ = ('path', 'method', 'status', 'duration', 'request_size', 'response_size', 'data', 'response')
+
+    def __init__(self, path, method, data, payload, response, duration):
+        self.path = path
+        self.method = method
+        self.status = response.status_code
+        self.duration = duration
+        self.request_size = len(payload)
+        self.response_size = len(response.content)
+        self.data = data
+        self.response = response
+
+    @property
+    def request_body(self):
+        return json.dumps(self.data, indent=4, ensure_ascii=False)
+
+    @property
+    def response_text(self):
+        return self.response.text
+
+    def summary(self):
+        return "%s %s %s %.1fms %sB/%sB" % (
+            self.method, self.path, self.status, self.duration * 1000, self.request_size, self.response_size)
+
+    def __str__(self):
+        return "%s\n%s\n%s" % (self.summary(), self.request_body, self.response_text)
+
+
+class JDApi:
+    # 单次请求携带的最大订单数, 下单接口每次只处理一条, 请求体里的列表是接口的参数列表而不是订单列表
+    # 并发由 jd_executor.fan_out 提供, 只有确认接口支持批量后才能通过系统参数调大
+    ORDERS_BATCH_SIZE = 1
+
+    def __init__(self,
+                 app_key,
+                 app_secret,
+                 access_token,
+                 debug_logger,
+                 prod_environment=False,
+                 domain="ECAP",
+                 algorithm="md5-salt",
+                 session=None,
+                 base_uri=None,
+                 debug_logging=True,
+                 log_sample_rate=1.0,
+                 metrics_sink=None,
+                 metrics_interval=300,
+                 breaker=None,
+                 ):
+        self.app_key = app_key
+        self.app_secret = app_secret
+        self.access_token = access_token
+        self.domain = domain
+        self.algorithm = algorithm
+        self.debug_logger = debug_logger
+        self.debug_logging = debug_logging
+        self.log_sample_rate = log_sample_rate
+        self.metrics_sink = metrics_sink
+        self.metrics_interval = metrics_interval
+        self.metrics = METRICS
+        self.breaker = breaker
+        self.session = session or get_session()
+        self.signer = get_signer(app_key, app_secret, access_token, algorithm=algorithm, domain=domain)
+        if base_uri:
+            self.base_uri = base_uri
+        elif prod_environment:
+            self.base_uri = 'https://api.jdl.com'
+        else:
+            self.base_uri = 'https://uat-api.jdl.com'
+
+    def with_debug_logger(self, debug_logger):
+        api = copy.copy(self)
+        api.debug_logger = debug_logger
+        return api
+
+    def bind(self, debug_logger, debug_logging=True, log_sample_rate=1.0, metrics_sink=None, metrics_interval=300,
+             metrics_source=None):
+        """
+        共享的客户端按调用方设置日志和指标, 返回的浅拷贝仍然共用会话, 签名器和熔断器
+        :param metrics_source: 指标按来源分开汇总, 为空时使用进程默认的汇总
+        """
+        api = copy.copy(self)
+        api.debug_logger = debug_logger
+        api.debug_logging = debug_logging
+        api.log_sample_rate = log_sample_rate
+        api.metrics_sink = metrics_sink
+        api.metrics_interval = metrics_interval
+        api.metrics = get_metrics(metrics_source)
+        return api
+
+    @property
+    def headers(self):
+        return HEADERS
+
+    @staticmethod
+    def sign(algorithm: str, data: bytes, secret: bytes) -> str:
+        if algorithm == "md5-salt":
+            h = hashlib.md5()
+            h.update(data)
+            return h.digest().hex()
+        elif algorithm == "HMacMD5":
+            return base64.b64encode(hmac.new(secret, data, hashlib.md5).digest()).decode("UTF-8")
+        elif algorithm == "HMacSHA1":
+            return base64.b64encode(hmac.new(secret, data, hashlib.sha1).digest()).decode("UTF-8")
+        elif algorithm == "HMacSHA256":
+            return base64.b64encode(hmac.new(secret, data, hashlib.sha256).digest()).decode("UTF-8")
+        elif algorithm == "HMacSHA512":
+            return base64.b64encode(hmac.new(secret, data, hashlib.sha512).digest()).decode("UTF-8")
+        raise NotImplementedError("Algorithm " + algorithm + " not supported yet")
+
+    @classmethod
+    def sign_request(cls, app_key, app_secret, access_token, method, body, timestamp, algorithm="md5-salt", v="2.0"):
+        """
+        按京东文档拼接签名内容后用 sign 计算, 用于校验京东推送过来的请求, 调用京东接口时使用 JDSigner
+        :param body: 原始请求体 bytes
+        """
+        secret = app_secret.encode("UTF-8")
+        content = b"".join([
+            secret,
+            b"access_token", access_token.encode("UTF-8"),
+            b"app_key", app_key.encode("UTF-8"),
+            b"method", method.encode("UTF-8"),
+            b"param_json", body,
+            b"timestamp", timestamp.encode("UTF-8"),
+            b"v", v.encode("UTF-8"),
+            secret,
+        ])
+        return cls.sign(algorithm, content, secret)
+
+    def compute_params(self, body, path):
+        if isinstance(body, str):
+            body = body.encode("UTF-8")
+        return self.signer.params(path, body)
+
+    def _request(self, path, data, method='POST', idempotent=False):
+        uri = self.base_uri + path
+        payload = dumps(data)
+        if self.breaker is not None:
+            try:
+                self.breaker.before(uri)
+            except CircuitOpenError:
+                self._record_metrics(path, 0.0, 0, 0, "circuit open")
+                raise
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, uri, idempotent=idempotent,
+                                            params=self.compute_params(payload, path), data=payload, headers=self.headers)
+        except Exception as e:
+            self._record_metrics(path, time.perf_counter() - started, len(payload), 0, e.__class__.__name__)
+            if self.breaker is not None:
+                self.breaker.record(uri, False)
+            raise
+        duration = time.perf_counter() - started
+        self._record_metrics(path, duration, len(payload), len(response.content), response_error_code(response))
+        if self.breaker is not None:
+            # 业务失败说明京东接口是通的, 只有 5xx 计入熔断
+            self.breaker.record(uri, response.status_code < 500)
+        record = None
+        if self.debug_logging and (self.log_sample_rate >= 1 or random.random() < self.log_sample_rate):
+            # debug_logger 收到的是 JDRequestRecord, 由它决定什么时候格式化
+            record = JDRequestRecord(path, method, data, payload, response, duration)
+            self.debug_logger(record, path)
+        if _logger.isEnabledFor(logging.DEBUG):
+            record = record or JDRequestRecord(path, method, data, payload, response, duration)
+            _logger.debug("%s", record.summary())
+        return response
+
+    def _record_metrics(self, path, duration, bytes_out, bytes_in, error_code):
+        self.metrics.record(path, duration, bytes_out, bytes_in, error_code)
+        if self.metrics_sink:
+            snapshot = self.metrics.drain_if_due(self.metrics_interval)
+            if snapshot:
+                self.metrics_sink(snapshot)
+
+    @staticmethod
+    def split_batch_result(result, keys):
+        """
+        把批量接口的返回拆分成与请求顺序一致的逐条结果
+        :param result: 接口返回的 json
+        :param keys: 请求里每条数据的 orderId / waybillCode, 返回的列表顺序不一致时用来对应
+        :return: [{'success': bool, 'msg': str, 'data': dict}, ...]
+        :raise ValueError: 返回的是单条结果但请求了多条, 无法确定每条数据的处理结果
+        """
+        msg = result.get('subMsg') or result.get('msg') or '失败'
+        data = result.get('data')
+        if not isinstance(data, list):
+            if len(keys) > 1:
+                raise ValueError("京东返回单条结果, 无法对应请求里的 %s 条数据, 接口可能不支持批量" % len(keys))
+            if not result.get('success'):
+                return [{'success': False, 'msg': msg, 'data': {}} for _key in keys]
+            data = [data or {}]
+        if len(data) != len(keys):
+            by_key = {}
+            for item in data:
+                by_key.setdefault(item.get('orderId') or item.get('waybillCode'), item)
+            data = [by_key.get(key) for key in keys]
+        res = []
+        for item in data:
+            if not item:
+                res.append({'success': False, 'msg': msg, 'data': {}})
+            elif item.get('success', True) is False:
+                res.append({'success': False, 'msg': item.get('subMsg') or item.get('msg') or msg, 'data': item})
+            else:
+                res.append({'success': True, 'msg': False, 'data': item})
+        return res
+
+    def orders_create(self, data):
+        path = "/ecap/v1/orders/create"
+        return self._request(path, data)
+
+    def orders_cancel(self, data):
+        path = "/ecap/v1/orders/cancel"
+        return self._request(path, data)
+
+    def orders_actualfee_query(self, data):
+        path = "/ecap/v1/orders/actualfee/query"
+        return self._request(path, data, idempotent=True)
+
+    def ecap_v1_orders_precheck(self, data):
+        path = "/ecap/v1/orders/precheck"
+        return self._request(path, data, idempotent=True)
+
+    def orders_print(self, data):
+        # 按运单号获取面单, 返回 PDF 的 base64 内容或者下载地址
+        path = "/ecap/v1/orders/print"
+        return self._request(path, data, idempotent=True)
+
+    def download(self, url):
+        # 面单下载地址由京东返回, 不需要签名
+        return self.session.request('GET', url, idempotent=True)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(app_key, app_secret, access_token, prod_environment=False, base_uri=None, session=None, breaker=None,
+               domain="ECAP", algorithm="md5-salt"):
+    """
+    按密钥和接口地址返回进程内共享的客户端, 使用前需要先 bind
+    """
+    key = (os.getpid(), app_key, app_secret, access_token, bool(prod_environment), base_uri or None,
+           id(session), id(breaker), domain, algorithm)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = JDApi(app_key, app_secret, access_token, None,
+                                               prod_environment=prod_environment, base_uri=base_uri, session=session,
+                                               breaker=breaker, domain=domain, algorithm=algorithm)
+    return client
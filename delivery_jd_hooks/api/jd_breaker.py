@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+import time
+
+import requests
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_FAILURE_THRESHOLD = 5  # 连续失败多少次后熔断
+DEFAULT_COOL_DOWN = 30  # 熔断多少秒后放行一个试探请求
+DEFAULT_STATE_TTL = 2.0  # 进程内缓存共享状态的秒数
+
+
+class CircuitOpenError(requests.RequestException):
+    """
+    熔断期间不发出请求直接失败, 调用方按网络异常处理
+    """
+
+
+class MemoryCircuitStore:
+    """
+    只在当前进程内保存熔断状态, 没有提供共享存储时使用
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def load(self):
+        """
+        :return: {endpoint: (连续失败次数, 熔断到期的时间戳或 0)}, 只包含有失败记录的接口
+        """
+        with self._lock:
+            return {endpoint: tuple(state) for endpoint, state in self._states.items() if state[0]}
+
+    def record_failure(self, endpoint, threshold, cool_down):
+        """
+        :return: 熔断到期的时间戳, 没有熔断时返回 0
+        """
+        now = time.time()
+        with self._lock:
+            state = self._states.setdefault(endpoint, [0, 0])
+            state[0] += 1
+            if state[0] >= threshold and state[1] <= now:
+                state[1] = now + cool_down
+            return state[1]
+
+    def record_success(self, endpoint):
+        with self._lock:
+            self._states.pop(endpoint, None)
+
+    def acquire_probe(self, endpoint, cool_down):
+        """
+        冷却结束后只有一个调用方能拿到试探的机会, 同时把熔断时间往后推, 其他调用方继续直接失败
+        """
+        now = time.time()
+        with self._lock:
+            state = self._states.get(endpoint)
+            if not state or state[1] > now:
+                return False
+            state[1] = now + cool_down
+            return True
+
+
+class JDCircuitBreaker:
+    """
+    按接口地址熔断: 连续失败(连接错误, 超时, 5xx)达到阈值后在冷却时间内直接失败
+    冷却结束后半开, 只放行一个试探请求, 成功则恢复, 失败则继续熔断
+    状态保存在 store 里, 多个进程共用同一个 store 时熔断状态也会共享
+    """
+
+    def __init__(self, store=None, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cool_down=DEFAULT_COOL_DOWN,
+                 state_ttl=DEFAULT_STATE_TTL):
+        self.store = store or MemoryCircuitStore()
+        self.failure_threshold = failure_threshold
+        self.cool_down = cool_down
+        self.state_ttl = state_ttl
+        self._states = {}
+        self._loaded = 0.0
+        self._lock = threading.Lock()
+
+    def _call_store(self, method, *args, default=None):
+        # 共享存储不可用时不影响正常请求
+        try:
+            return getattr(self.store, method)(*args)
+        except Exception:
+            _logger.warning("京东接口熔断状态读写失败", exc_info=True)
+            return default
+
+    def states(self):
+        now = time.time()
+        if now - self._loaded >= self.state_ttl:
+            with self._lock:
+                if now - self._loaded >= self.state_ttl:
+                    states = self._call_store('load')
+                    if states is not None:
+                        self._states = states
+                    self._loaded = now
+        return self._states
+
+    def before(self, endpoint):
+        """
+        :raise CircuitOpenError: 熔断中, 不应该发出请求
+        """
+        state = self.states().get(endpoint)
+        if not state or not state[1]:
+            return
+        if time.time() < state[1] or not self._call_store('acquire_probe', endpoint, self.cool_down, default=True):
+            raise CircuitOpenError("京东接口熔断中, 暂停请求 %s" % endpoint)
+
+    def record(self, endpoint, success):
+        state = self._states.get(endpoint)
+        if success:
+            if state:
+                self._call_store('record_success', endpoint)
+                with self._lock:
+                    self._states = {key: value for key, value in self._states.items() if key != endpoint}
+            return
+        open_until = self._call_store('record_failure', endpoint, self.failure_threshold, self.cool_down, default=0)
+        with self._lock:
+            states = dict(self._states)
+            states[endpoint] = ((state[0] if state else 0) + 1, open_until or 0)
+            self._states = states
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(key, store_factory=None, **options):
+    """
+    按 key 和配置返回当前进程共享的熔断器
+    :param store_factory: 第一次创建时调用, 返回共享的状态存储
+    """
+    cache_key = (os.getpid(), key, tuple(sorted(options.items())))
+    breaker = _breakers.get(cache_key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(cache_key)
+            if breaker is None:
+                breaker = _breakers[cache_key] = JDCircuitBreaker(
+                    store=store_factory() if store_factory else None, **options)
+    return breaker
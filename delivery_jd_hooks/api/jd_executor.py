@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def _call(api, method, data):
+    try:
+        response = getattr(api, method)(data)
+        # 5xx 即使返回了 json 也是京东服务端的临时故障, 按请求异常处理, 调用方可以稍后重试
+        if response.status_code >= 500:
+            raise requests.HTTPError("HTTP %s" % response.status_code, response=response)
+        return response.json(), None
+    except Exception as e:
+        return None, e
+
+
+def fan_out(jobs, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    并发执行多个接口请求, 请求数据必须在主线程里准备好
+    :param jobs: [(api, 方法名, 请求数据), ...]
+    :return: 与 jobs 顺序一致的 [(返回的 json, 异常), ...]
+    """
+    if not jobs:
+        return []
+    if len(jobs) == 1 or max_workers <= 1:
+        return [_call(*job) for job in jobs]
+    records = []
+    buffered = {}
+    for api, _method, _data in jobs:
+        if id(api) not in buffered:
+            buffered[id(api)] = (api, api.with_debug_logger(
+                lambda *args, logger=api.debug_logger: records.append((logger, args))))
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as executor:
+        futures = [executor.submit(_call, buffered[id(api)][1], method, data) for api, method, data in jobs]
+        results = [future.result() for future in futures]
+    for logger, args in records:
+        logger(*args)
+    return results
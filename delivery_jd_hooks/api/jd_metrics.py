@@ -0,0 +1,100 @@
+import bisect
+import threading
+import time
+
+# 1ms 到 1 分钟左右的指数分桶, 相邻两个桶相差 25%
+LATENCY_BUCKETS = tuple(0.001 * 1.25 ** i for i in range(50))
+
+
+class PathStats:
+    __slots__ = ('count', 'error_count', 'bytes_out', 'bytes_in', 'total_time', 'max_time', 'buckets', 'error_codes')
+
+    def __init__(self):
+        self.count = 0
+        self.error_count = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.error_codes = {}
+
+    def percentile(self, pct):
+        """
+        返回所在分桶的上限, 超出最大分桶时返回实际的最大耗时
+        """
+        if not self.count:
+            return 0.0
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for index, hits in enumerate(self.buckets):
+            seen += hits
+            if seen >= rank and hits:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.max_time
+        return self.max_time
+
+
+class JDMetrics:
+    """
+    每个进程在内存中按接口路径汇总调用次数, 耗时分布, 流量和失败原因, 定期取出写入数据库
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.started = time.time()
+
+    def record(self, path, duration, bytes_out=0, bytes_in=0, error_code=None):
+        with self._lock:
+            stats = self._stats.get(path)
+            if stats is None:
+                stats = self._stats[path] = PathStats()
+            stats.count += 1
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            stats.total_time += duration
+            stats.max_time = max(stats.max_time, duration)
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, duration)] += 1
+            if error_code:
+                stats.error_count += 1
+                stats.error_codes[error_code] = stats.error_codes.get(error_code, 0) + 1
+
+    def drain(self):
+        """
+        :return: (开始时间, 结束时间, {path: PathStats}), 同时清空已汇总的数据
+        """
+        with self._lock:
+            stats, started = self._stats, self.started
+            self._stats, self.started = {}, time.time()
+        return started, self.started, stats
+
+    def drain_if_due(self, interval):
+        if not self._stats or time.time() - self.started < interval:
+            return None
+        return self.drain()
+
+
+METRICS = JDMetrics()
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def get_metrics(source=None):
+    """
+    两种物流共用同一个客户端, 按 (数据库, 来源模块) 分开汇总, 写入数据库时才能区分
+    """
+    if not source:
+        return METRICS
+    metrics = _sources.get(source)
+    if metrics is None:
+        with _sources_lock:
+            metrics = _sources.setdefault(source, JDMetrics())
+    return metrics
+
+
+def source_metrics():
+    """
+    :return: [(来源, JDMetrics), ...], 不包括进程默认的汇总
+    """
+    with _sources_lock:
+        return list(_sources.items())
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_CONNECTIONS = 4  # 缓存的主机连接池数量
+DEFAULT_POOL_MAXSIZE = 16  # 每个主机保持的长连接数量
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 15.0
+DEFAULT_MAX_RETRIES = 2
+DEFAULT_BACKOFF_FACTOR = 0.3
+RETRY_STATUS = frozenset([502, 503, 504])
+
+
+class JDSession:
+    """
+    每个进程共享的长连接会话, 避免每次请求都重新进行 TCP/TLS 握手
+    只有幂等接口(预检, 查询)会在连接错误或网关错误时退避重试
+    """
+
+    def __init__(self,
+                 pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR,
+                 ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, idempotent=False, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        retries = self.max_retries if idempotent else 0
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS or attempt >= retries:
+                    return response
+                response.close()
+            time.sleep(self.backoff_factor * (2 ** attempt))
+            attempt += 1
+
+    def close(self):
+        self.session.close()
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(**options):
+    """
+    按配置返回当前进程共享的会话, odoo 多 worker 模式下 fork 之后会重新创建, 不会共用父进程的 socket
+    """
+    key = (os.getpid(), tuple(sorted(options.items())))
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = _sessions[key] = JDSession(**options)
+    return session
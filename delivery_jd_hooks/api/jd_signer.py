@@ -0,0 +1,92 @@
+import base64
+import hashlib
+import hmac
+import time
+from functools import lru_cache
+
+HMAC_DIGESTS = {
+    "HMacMD5": hashlib.md5,
+    "HMacSHA1": hashlib.sha1,
+    "HMacSHA256": hashlib.sha256,
+    "HMacSHA512": hashlib.sha512,
+}
+
+# 时区在进程内不会变化, 请求头只需要计算一次
+HEADERS = {
+    "lop-tz": str(int(-time.timezone / 3600)),  # lop-tz代表时区，为接口调用当地的时区；删去后默认为东八区
+    "User-Agent": "lop-http/python3",  # 用于开放平台识别客户调用API方式，客户无需修改
+    "content-type": "application/json;charset=utf-8",
+}
+
+
+class JDSigner:
+    """
+    签名内容为 secret + access_token + app_key + method + param_json + timestamp + v + secret
+    固定的前缀提前编码并写入摘要对象, 每次签名只需要 copy 后追加路径, 请求体和时间戳
+    """
+    __slots__ = ('algorithm', 'base_params', 'suffix', '_digest', '_hmac', '_paths', '_timestamp')
+
+    def __init__(self, app_key, app_secret, access_token, algorithm="md5-salt", domain="ECAP"):
+        secret = app_secret.encode("UTF-8")
+        prefix = b"".join([
+            secret,
+            b"access_token", access_token.encode("UTF-8"),
+            b"app_key", app_key.encode("UTF-8"),
+            b"method",
+        ])
+        self.algorithm = algorithm
+        self.suffix = b"v2.0" + secret
+        if algorithm == "md5-salt":
+            self._digest = hashlib.md5(prefix)
+            self._hmac = False
+        elif algorithm in HMAC_DIGESTS:
+            self._digest = hmac.new(secret, prefix, HMAC_DIGESTS[algorithm])
+            self._hmac = True
+        else:
+            raise NotImplementedError("Algorithm " + algorithm + " not supported yet")
+        self.base_params = {
+            "LOP-DN": domain,
+            "app_key": app_key,
+            "access_token": access_token,
+            "v": "2.0",
+            "algorithm": algorithm,
+        }
+        self._paths = {}
+        self._timestamp = (None, None)
+
+    def timestamp(self):
+        # 同一秒内的请求复用格式化好的时间戳
+        now = int(time.time())
+        cached = self._timestamp
+        if cached[0] != now:
+            cached = self._timestamp = (now, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)))
+        return cached[1]
+
+    def sign(self, path, body, timestamp):
+        """
+        :param body: 已经编码的请求体 bytes
+        """
+        path_bytes = self._paths.get(path)
+        if path_bytes is None:
+            path_bytes = self._paths[path] = path.encode("UTF-8") + b"param_json"
+        h = self._digest.copy()
+        h.update(path_bytes)
+        h.update(body)
+        h.update(b"timestamp")
+        h.update(timestamp.encode("UTF-8"))
+        h.update(self.suffix)
+        if self._hmac:
+            return base64.b64encode(h.digest()).decode("UTF-8")
+        return h.hexdigest()
+
+    def params(self, path, body):
+        timestamp = self.timestamp()
+        params = dict(self.base_params)
+        params["timestamp"] = timestamp
+        params["sign"] = self.sign(path, body, timestamp)
+        return params
+
+
+@lru_cache(maxsize=64)
+def get_signer(app_key, app_secret, access_token, algorithm="md5-salt", domain="ECAP"):
+    return JDSigner(app_key, app_secret, access_token, algorithm=algorithm, domain=domain)
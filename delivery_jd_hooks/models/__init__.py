@@ -1,3 +1,5 @@
 # -*- coding: utf-8 -*-
 
 from . import res_config_settings
+from . import jd_metric
+from . import jd_circuit
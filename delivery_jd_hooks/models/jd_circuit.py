@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from odoo import fields, models, registry
+
+
+class DatabaseCircuitStore:
+    """
+    京东接口熔断状态保存在数据库里, 所有 worker 共享
+    每次读写使用单独的游标并立即提交, 不受业务事务回滚影响
+    """
+
+    def __init__(self, dbname, source):
+        self.dbname = dbname
+        self.source = source
+
+    def _execute(self, query, params):
+        with registry(self.dbname).cursor() as cr:
+            cr.execute(query, params)
+            return cr.fetchall() if cr.description else []
+
+    def load(self):
+        rows = self._execute("""
+            SELECT endpoint, failure_count, coalesce(extract(epoch FROM open_until), 0)
+              FROM delivery_jd_circuit
+             WHERE source = %s AND failure_count > 0
+        """, [self.source])
+        return {endpoint: (failure_count, float(open_until)) for endpoint, failure_count, open_until in rows}
+
+    def record_failure(self, endpoint, threshold, cool_down):
+        rows = self._execute("""
+            INSERT INTO delivery_jd_circuit AS c (source, endpoint, failure_count, last_failure_date)
+            VALUES (%s, %s, 1, (now() at time zone 'UTC'))
+            ON CONFLICT (source, endpoint) DO UPDATE
+               SET failure_count = c.failure_count + 1,
+                   last_failure_date = EXCLUDED.last_failure_date,
+                   open_until = CASE
+                       WHEN c.failure_count + 1 >= %s
+                        AND (c.open_until IS NULL OR c.open_until <= (now() at time zone 'UTC'))
+                       THEN (now() at time zone 'UTC') + interval '1 second' * %s
+                       ELSE c.open_until END
+            RETURNING coalesce(extract(epoch FROM open_until), 0)
+        """, [self.source, endpoint, threshold, cool_down])
+        return float(rows[0][0]) if rows else 0
+
+    def record_success(self, endpoint):
+        self._execute("""
+            UPDATE delivery_jd_circuit SET failure_count = 0, open_until = NULL
+             WHERE source = %s AND endpoint = %s AND failure_count > 0
+        """, [self.source, endpoint])
+
+    def acquire_probe(self, endpoint, cool_down):
+        rows = self._execute("""
+            UPDATE delivery_jd_circuit SET open_until = (now() at time zone 'UTC') + interval '1 second' * %s
+             WHERE source = %s AND endpoint = %s AND open_until <= (now() at time zone 'UTC')
+            RETURNING id
+        """, [cool_down, self.source, endpoint])
+        return bool(rows)
+
+
+class JDCircuit(models.Model):
+    _name = 'delivery.jd.circuit'
+    _description = '京东物流接口熔断状态'
+    _order = 'source, endpoint'
+    _rec_name = 'endpoint'
+    _log_access = False
+
+    source = fields.Char(string="来源模块", required=True)
+    endpoint = fields.Char(string="接口地址", required=True)
+    failure_count = fields.Integer(string="连续失败次数")
+    open_until = fields.Datetime(string="熔断到期时间")
+    last_failure_date = fields.Datetime(string="最后失败时间")
+
+    _sql_constraints = [
+        ('source_endpoint_uniq', 'unique(source, endpoint)', '同一个接口只能有一条熔断状态'),
+    ]
+
+    def action_reset(self):
+        self.write({'failure_count': 0, 'open_until': False})
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import atexit
+import logging
+import os
+from datetime import datetime
+
+from odoo import api, fields, models, registry, SUPERUSER_ID
+from odoo.addons.delivery_jd_hooks.api.jd_metrics import source_metrics
+
+_logger = logging.getLogger(__name__)
+
+METRICS_RETENTION_DAYS = 30
+
+
+def store_snapshot(dbname, source, snapshot):
+    """
+    把进程内汇总的接口指标写入数据库, 使用单独的游标, 可以在线程里调用, 写入失败只记录日志
+    :param snapshot: JDMetrics.drain() 的返回值
+    """
+    started, ended, stats = snapshot
+    if not stats:
+        return
+    rows = [{
+        'source': source,
+        'path': path,
+        'pid': os.getpid(),
+        'period_start': fields.Datetime.to_string(datetime.utcfromtimestamp(started)),
+        'period_end': fields.Datetime.to_string(datetime.utcfromtimestamp(ended)),
+        'call_count': item.count,
+        'error_count': item.error_count,
+        'avg_ms': item.total_time / item.count * 1000 if item.count else 0.0,
+        'p50_ms': item.percentile(50) * 1000,
+        'p95_ms': item.percentile(95) * 1000,
+        'p99_ms': item.percentile(99) * 1000,
+        'max_ms': item.max_time * 1000,
+        'bytes_out': item.bytes_out,
+        'bytes_in': item.bytes_in,
+        'error_codes': "\n".join("%s: %s" % (code, count) for code, count in
+                                 sorted(item.error_codes.items(), key=lambda code_count: -code_count[1])),
+    } for path, item in stats.items()]
+    try:
+        with registry(dbname).cursor() as cr:
+            api.Environment(cr, SUPERUSER_ID, {})['delivery.jd.metric'].create(rows)
+    except Exception:
+        _logger.warning("写入京东物流接口指标失败", exc_info=True)
+
+
+def flush_metrics(dbname=None):
+    """
+    不等下一次请求, 立即写入进程内还没有写入的接口指标
+    :param dbname: 只写入这个数据库的指标, 为空时写入全部
+    """
+    for (db, source), metrics in source_metrics():
+        if not dbname or db == dbname:
+            store_snapshot(db, source, metrics.drain())
+
+
+# 进程退出时写入最后一段时间的指标
+atexit.register(flush_metrics)
+
+
+class JDMetric(models.Model):
+    _name = 'delivery.jd.metric'
+    _description = '京东物流接口指标'
+    _order = 'period_end desc, id desc'
+    _rec_name = 'path'
+
+    source = fields.Char(string="来源模块")
+    path = fields.Char(string="接口", required=True, index=True)
+    pid = fields.Integer(string="进程")
+    period_start = fields.Datetime(string="开始时间")
+    period_end = fields.Datetime(string="结束时间", index=True)
+    call_count = fields.Integer(string="调用次数")
+    error_count = fields.Integer(string="失败次数")
+    avg_ms = fields.Float(string="平均耗时(ms)", group_operator='avg')
+    p50_ms = fields.Float(string="P50(ms)", group_operator='max')
+    p95_ms = fields.Float(string="P95(ms)", group_operator='max')
+    p99_ms = fields.Float(string="P99(ms)", group_operator='max')
+    max_ms = fields.Float(string="最大耗时(ms)", group_operator='max')
+    bytes_out = fields.Integer(string="发送字节")
+    bytes_in = fields.Integer(string="接收字节")
+    error_codes = fields.Text(string="失败原因")
+
+    @api.model
+    def _cron_flush_jd_metrics(self):
+        flush_metrics(self.env.cr.dbname)
+
+    @api.model
+    def _cron_gc_jd_metrics(self):
+        self.search([('period_end', '<', fields.Datetime.subtract(
+            fields.Datetime.now(), days=METRICS_RETENTION_DAYS))]).unlink()
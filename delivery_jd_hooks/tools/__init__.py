@@ -0,0 +1,8 @@
+# 两种京东物流共用的组装下单数据的辅助函数, 不定义模型
+# 用到的 sale.order 和 stock.picking.sale_id 由调用方依赖的 delivery(sale_stock) 提供, delivery_jd_hooks 本身只依赖 stock
+from . import jd_sale_order
+from . import jd_sender
+from . import jd_package
+from . import jd_dispatch
+from . import jd_client
+from . import jd_config
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+import functools
+
+from odoo.addons.delivery_jd_hooks.api import jd_breaker, jd_session
+from odoo.addons.delivery_jd_hooks.api.jd_api import get_client
+from ..models.jd_circuit import DatabaseCircuitStore
+from ..models.jd_metric import store_snapshot
+
+# 两种物流共用同一份熔断状态, 京东接口故障时一起熔断
+CIRCUIT_SOURCE = 'jd'
+
+
+def new_jd_client(env, source, app_key, app_secret, access_token, debug_logger, prod_environment=False,
+                  base_uri=None, session_options=(), debug_logging=True, log_sample_rate=1.0, metrics_interval=300,
+                  circuit_options=()):
+    """
+    京东物流和基于规则的京东物流都从这里取客户端
+    :param source: 调用方模块名, 写入接口指标时区分来源
+    :param session_options: JDSession 的参数, ((名称, 值), ...)
+    :param circuit_options: JDCircuitBreaker 的参数, ((名称, 值), ...)
+    """
+    dbname = env.cr.dbname
+    breaker = jd_breaker.get_breaker(
+        (dbname, CIRCUIT_SOURCE), functools.partial(DatabaseCircuitStore, dbname, CIRCUIT_SOURCE),
+        **dict(circuit_options))
+    client = get_client(app_key, app_secret, access_token, prod_environment=prod_environment, base_uri=base_uri,
+                        session=jd_session.get_session(**dict(session_options)), breaker=breaker)
+    return client.bind(debug_logger, debug_logging=debug_logging, log_sample_rate=log_sample_rate,
+                       metrics_sink=functools.partial(store_snapshot, dbname, source),
+                       metrics_interval=metrics_interval, metrics_source=(dbname, source))
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo.tools import str2bool
+
+_logger = logging.getLogger(__name__)
+
+
+def get_param(icp_get, key, default):
+    """
+    按默认值的类型读取系统参数, 没有设置或者无法解析时使用默认值, 不会因为填错一个参数影响发货
+    :param icp_get: ir.config_parameter 的 get_param
+    """
+    value = icp_get(key)
+    if value in (None, False, ''):
+        return default
+    try:
+        return str2bool(value) if isinstance(default, bool) else type(default)(value)
+    except (TypeError, ValueError):
+        _logger.warning("系统参数 %s 的值 %r 无效, 使用默认值 %r", key, value, default)
+        return default
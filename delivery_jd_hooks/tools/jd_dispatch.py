@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+from odoo.tools import split_every
+
+from ..api import jd_executor
+
+# 快递B2C 单个包裹的重量上限, 超过时只能走快运
+JD_EXPRESS_MAX_WEIGHT = 30.0
+EXPRESS_ORDER_ORIGIN = '1'
+FREIGHT_ORDER_ORIGIN = '4'
+# 快运默认使用的产品
+FREIGHT_PRODUCT_CODE = 'fr-m-0004'
+
+# min_weight / max_weight 为整票重量(kg), max_weight 为 0 时不限; speed 越小时效越快
+JDProduct = namedtuple('JDProduct', ['order_origin', 'product_code', 'min_weight', 'max_weight', 'speed'])
+
+
+def eligible_products(products, weight, parcel_weight=None):
+    """
+    按整票重量和最重的包裹找出适用的产品
+    :param products: 编译好的产品表, 按优先顺序排列
+    :param parcel_weight: 最重的一个包裹的重量, 为空时按整票计算
+    :return: 适用的产品列表, 保持产品表的顺序
+    """
+    if parcel_weight is None:
+        parcel_weight = weight
+    return [product for product in products
+            if weight >= product.min_weight
+            and (not product.max_weight or weight <= product.max_weight)
+            and (product.order_origin != EXPRESS_ORDER_ORIGIN or parcel_weight <= JD_EXPRESS_MAX_WEIGHT)]
+
+
+def fastest_product(products):
+    # 时效相同时取产品表里靠前的
+    return min(products, key=lambda product: product.speed)
+
+
+def choose_product(products, prices, strategy):
+    """
+    :param prices: {product: 运费}, 没有报价的产品不参与选择
+    :param strategy: cheapest 运费最低 / fastest 时效最快
+    :return: (product, 运费), 所有产品都没有报价时为 (None, None)
+    """
+    quoted = [product for product in products if prices.get(product) is not None]
+    if not quoted:
+        return None, None
+    if strategy == 'fastest':
+        best = min(quoted, key=lambda product: (product.speed, prices[product]))
+    else:
+        best = min(quoted, key=lambda product: (prices[product], product.speed))
+    return best, prices[best]
+
+
+def apply_product(vals, product):
+    """
+    :return: 替换了下单来源和产品编码的下单/预检数据, 不修改传入的 dict
+    """
+    return dict(vals, orderOrigin=product.order_origin,
+                productsReq=dict(vals.get('productsReq') or {}, productCode=product.product_code))
+
+
+def call_in_batches(api, method, records, build, key, batch_size, max_workers):
+    """
+    按批量大小分组并发调用接口, 返回逐条结果
+    :param records: 调拨, 或者调用方自己的 (调拨, 下单数据) 元组
+    :param build: record -> 请求里的一条数据
+    :param key: 请求数据 -> split_batch_result 用来对应结果的 orderId / waybillCode
+    :return: [(record, 请求数据, {'success', 'msg', 'data', 'transient'})], 保持 records 的顺序
+    """
+    chunks = [[(record, build(record)) for record in chunk] for chunk in split_every(batch_size, records)]
+    jobs = [(api, method, [vals for _record, vals in chunk]) for chunk in chunks]
+    res = []
+    for chunk, (result, exc) in zip(chunks, jd_executor.fan_out(jobs, max_workers)):
+        if exc is not None:
+            # 熔断, 网络异常, 京东返回 5xx 或者返回的不是 json, 整组都可以稍后重试
+            items = [{'success': False, 'msg': str(exc) or exc.__class__.__name__, 'data': {}, 'transient': True}
+                     for _item in chunk]
+        else:
+            try:
+                items = [dict(item, transient=False)
+                         for item in api.split_batch_result(result, [key(vals) for _record, vals in chunk])]
+            except ValueError as e:
+                # 无法确定每条数据的结果, 自动重试可能重复处理, 交给人工核对
+                items = [{'success': False, 'msg': str(e), 'data': {}, 'transient': False} for _item in chunk]
+        res += [(record, vals, item) for (record, vals), item in zip(chunk, items)]
+    return res
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from odoo.tools import float_round
+
+
+def _package_type_volume(package_type, length_uom, cm_uom):
+    # 包裹类型的长宽高使用系统长度单位(默认毫米), 换算成立方厘米
+    if not package_type or not (package_type.packaging_length and package_type.width and package_type.height):
+        return 0.0
+    length, width, height = (length_uom._compute_quantity(value, cm_uom, round=False) for value in (
+        package_type.packaging_length, package_type.width, package_type.height))
+    return length * width * height
+
+
+def pickings_package_cargoes(pickings, default_package_type=None):
+    """
+    按调拨里的包裹生成京东下单的 cargoes, 没有装箱的明细合并成一个散件包裹
+    还没有填写完成数量的调拨按预留数量计算
+    :param default_package_type: 包裹没有设置包裹类型时使用
+    :return: {picking.id: [{'name', 'quantity', 'weight', 'volume'}]}, 没有明细的调拨对应空列表
+    """
+    env = pickings.env
+    length_uom = env['product.template']._get_length_uom_id_from_ir_config_parameter()
+    cm_uom = env.ref('uom.product_uom_cm')
+    move_lines = pickings.move_line_ids.filtered(lambda ml: ml.product_id.type != 'service')
+    move_lines.read(['picking_id', 'result_package_id', 'product_id', 'product_uom_id', 'qty_done', 'reserved_uom_qty'])
+    qty_field = {picking.id: 'reserved_uom_qty' for picking in pickings}
+    qty_field.update({ml.picking_id.id: 'qty_done' for ml in move_lines if ml.qty_done})
+    move_lines = move_lines.filtered(lambda ml: ml[qty_field[ml.picking_id.id]])
+    move_lines.product_id.read(['weight', 'volume', 'uom_id'])
+    move_lines.result_package_id.read(['name', 'package_type_id', 'shipping_weight'])
+
+    # {picking.id: {package 或 None: [重量kg, 体积cm3]}}
+    contents = {picking.id: {} for picking in pickings}
+    for ml in move_lines:
+        qty = ml.product_uom_id._compute_quantity(ml[qty_field[ml.picking_id.id]], ml.product_id.uom_id, round=False)
+        totals = contents[ml.picking_id.id].setdefault(ml.result_package_id or None, [0.0, 0.0])
+        totals[0] += (ml.product_id.weight or 0.0) * qty
+        totals[1] += (ml.product_id.volume or 0.0) * qty * 10 ** 6
+
+    type_volumes = {}
+    res = {}
+    for picking in pickings:
+        cargoes = []
+        loose_name = default_package_type.name if default_package_type else picking.name
+        for package, (weight, volume) in contents[picking.id].items():
+            package_type = (package and package.package_type_id) or default_package_type
+            if package_type not in type_volumes:
+                type_volumes[package_type] = _package_type_volume(package_type, length_uom, cm_uom)
+            if package:
+                weight = package.shipping_weight or weight + (package_type.base_weight if package_type else 0.0)
+                volume = type_volumes[package_type] or volume
+            cargoes.append({
+                'name': package.name if package else loose_name,
+                'quantity': 1,
+                'weight': float_round(weight, precision_digits=2, rounding_method='UP'),
+                'volume': float_round(volume, precision_digits=2, rounding_method='UP'),
+            })
+        res[picking.id] = cargoes
+    return res
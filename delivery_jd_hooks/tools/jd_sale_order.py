@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+ADDRESS_FIELDS = ['name', 'mobile', 'phone', 'street', 'street2', 'city', 'zip', 'state_id', 'country_id']
+
+
+def pickings_sale_orders(pickings):
+    """
+    一次性找出调拨对应的销售订单, 优先使用 sale_id, 没有时按 origin 查询
+    :return: {picking.id: sale.order}, 找不到订单的调拨对应空记录
+    """
+    SaleOrder = pickings.env['sale.order']
+    res = {}
+    missing = pickings.browse()
+    for picking in pickings:
+        if picking.sale_id:
+            res[picking.id] = picking.sale_id
+        else:
+            missing |= picking
+    origins = {picking.origin for picking in missing if picking.origin}
+    if origins:
+        by_name = {}
+        # 同名订单保持原来 search(limit=1) 的取法, 按默认排序取第一条
+        for order in SaleOrder.search([('name', 'in', list(origins))]):
+            by_name.setdefault(order.name, order)
+        for picking in missing:
+            res[picking.id] = by_name.get(picking.origin, SaleOrder)
+    else:
+        res.update(dict.fromkeys(missing.ids, SaleOrder))
+    orders = SaleOrder.union(*res.values())
+    if orders:
+        orders.company_id.read(['name', 'mobile', 'phone', 'partner_id'])
+        partners = orders.partner_shipping_id | orders.partner_id | orders.company_id.partner_id
+        partners.read(ADDRESS_FIELDS)
+        (partners.state_id | partners.country_id).read(['name', 'code'])
+        orders.order_line.read(['product_id', 'product_uom_qty'])
+        orders.order_line.product_id.read(['name', 'type'])
+    return {picking_id: order.with_prefetch(orders.ids) for picking_id, order in res.items()}
+
+
+def shipping_order_id(picking, order, split):
+    """
+    京东按订单号去重, 拆单发货时加上调拨ID
+    :param split: 是否开启多仓拆单发货
+    :return: 下单时使用的京东订单号
+    """
+    if split and order and len(order.picking_ids.filtered(
+            lambda p: p.picking_type_code == 'outgoing' and p.state != 'cancel')) > 1:
+        return "%s-%s" % (order.name, picking.id)
+    return picking.origin
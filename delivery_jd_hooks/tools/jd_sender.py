@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from .jd_sale_order import ADDRESS_FIELDS
+
+
+def order_sender_partner(order):
+    """
+    报价时还没有调拨, 按订单的发货仓库取寄件地址, 仓库没有设置地址时使用公司地址
+    """
+    return order.warehouse_id.partner_id or order.company_id.partner_id
+
+
+def pickings_sender_partners(pickings, orders):
+    """
+    按调拨所属仓库确定寄件地址, 没有时使用订单或调拨公司的地址
+    :param orders: pickings_sale_orders 的返回值
+    :return: {picking.id: res.partner}
+    """
+    warehouses = pickings.picking_type_id.warehouse_id
+    warehouses.read(['partner_id'])
+    partners = warehouses.partner_id
+    if partners:
+        partners.read(ADDRESS_FIELDS)
+        (partners.state_id | partners.country_id).read(['name', 'code'])
+    res = {}
+    for picking in pickings:
+        order = orders.get(picking.id)
+        res[picking.id] = picking.picking_type_id.warehouse_id.partner_id \
+            or (order.company_id.partner_id if order else picking.company_id.partner_id)
+    return res
+
+
+def sender_contact(partner, company):
+    """
+    寄件人名称统一使用公司名称, 电话优先使用仓库地址上的
+    :return: 京东下单接口的 senderContact
+    """
+    return {
+        "name": company.name,
+        "mobile": partner.mobile or company.mobile,
+        "phone": partner.phone or company.phone,
+        "fullAddress": partner._display_address()
+    }
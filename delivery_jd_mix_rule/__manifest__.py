@@ -11,7 +11,10 @@
         "security/security.xml",
         "security/ir.model.access.csv",
         "data/delivery_data.xml",
+        "data/ir_cron_data.xml",
         "views/delivery_view.xml",
+        "views/stock_picking_views.xml",
+        "views/res_config_settings_views.xml",
     ],
     "installable": True,
     'application': True,
@@ -3,3 +3,7 @@
 from . import delivery_carrier_inherit
 from . import stock_package_type_inherit
 from . import choose_delivery_carrier_inherit
+from . import stock_picking
+from . import sale_order
+from . import jd_region
+from . import res_config_settings
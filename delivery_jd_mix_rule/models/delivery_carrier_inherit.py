@@ -1,8 +1,30 @@
 # -*- coding: utf-8 -*-
 
+import re
+
 from odoo import api, fields, models, registry, SUPERUSER_ID, _, tools
 from odoo.exceptions import ValidationError, UserError
-from odoo.addons.delivery_jd_mix_rule.api.jd_api import JDApi
+from odoo.addons.delivery_jd_hooks.api import jd_cache, jd_executor, jd_session
+from odoo.addons.delivery_jd_hooks.tools.jd_client import new_jd_client
+from odoo.addons.delivery_jd_hooks.tools.jd_config import get_param
+from odoo.addons.delivery_jd_hooks.tools.jd_dispatch import JD_EXPRESS_MAX_WEIGHT, EXPRESS_ORDER_ORIGIN, \
+    FREIGHT_ORDER_ORIGIN, FREIGHT_PRODUCT_CODE, JDProduct, apply_product, call_in_batches, eligible_products, \
+    fastest_product
+from odoo.addons.delivery_jd_hooks.tools.jd_package import pickings_package_cargoes
+from odoo.addons.delivery_jd_hooks.tools.jd_sale_order import pickings_sale_orders, shipping_order_id
+from odoo.addons.delivery_jd_hooks.tools.jd_sender import order_sender_partner, pickings_sender_partners, \
+    sender_contact
+
+SERVICEABILITY_TTL = 24 * 3600
+SERVICEABILITY_NEGATIVE_TTL = 600
+# 產品沒有維護重量體積時沿用原來的申報值
+DEFAULT_CARGO_WEIGHT = 1
+DEFAULT_CARGO_VOLUME = 10
+_serviceability_cache = jd_cache.TTLCache(maxsize=20000)
+
+
+def normalize_address(address):
+    return re.sub(r'\s+', ' ', address or '').strip()
 
 
 # 默認使用 快遞B2C-京東標快 （包裹重量小於30kg）
@@ -17,51 +39,164 @@ class DeliveryCarrier(models.Model):
     # ==========================================================================================
 
     @api.model
-    def jd_mix_rule_config_params(self):
+    @tools.ormcache()
+    def _jd_mix_rule_config(self):
+        """
+        進程內緩存的系統參數, 可調的在 庫存-配置-設置 裡修改
+        """
         icp_get = self.env['ir.config_parameter'].sudo().get_param
-        res = [
-            icp_get('delivery_jd_mix_rule.jd_mix_rule_app_key'),
-            icp_get('delivery_jd_mix_rule.jd_mix_rule_app_secret'),
-            icp_get('delivery_jd_mix_rule.jd_mix_rule_access_token'),
-            icp_get('delivery_jd_mix_rule.jd_mix_rule_customer_code'),
-        ]
+        # 默認 快遞B2C-京東標快, 填寫了事業部編碼時超過 30kg 的貨物走快運
+        products = [JDProduct(EXPRESS_ORDER_ORIGIN, icp_get('delivery_jd_mix_rule.product_code') or 'ed-m-0001',
+                              0.0, 0.0, 0)]
+        business_unit_code = icp_get('delivery_jd_mix_rule.business_unit_code') or False
+        if business_unit_code:
+            products.append(JDProduct(FREIGHT_ORDER_ORIGIN,
+                                      icp_get('delivery_jd_mix_rule.freight_product_code') or FREIGHT_PRODUCT_CODE,
+                                      JD_EXPRESS_MAX_WEIGHT, 0.0, 1))
+        return tools.frozendict({
+            'params': (
+                icp_get('delivery_jd_mix_rule.jd_mix_rule_app_key'),
+                icp_get('delivery_jd_mix_rule.jd_mix_rule_app_secret'),
+                icp_get('delivery_jd_mix_rule.jd_mix_rule_access_token'),
+                icp_get('delivery_jd_mix_rule.jd_mix_rule_customer_code'),
+            ),
+            # 指向本地模擬接口(benchmarks/jd_mock_server.py)時使用, 為空時按正式/測試環境選擇
+            'base_uri': icp_get('delivery_jd_mix_rule.api_base_uri') or False,
+            'log_sample_rate': get_param(icp_get, 'delivery_jd_mix_rule.log_sample_rate', 1.0),
+            'max_workers': max(1, get_param(icp_get, 'delivery_jd_mix_rule.max_workers',
+                                            jd_executor.DEFAULT_MAX_WORKERS)),
+            'business_unit_code': business_unit_code,
+            'products': tuple(products),
+            'split_shipment': get_param(icp_get, 'delivery_jd_mix_rule.split_shipment', False),
+        })
+
+    @api.model
+    def jd_mix_rule_config_params(self):
+        res = list(self._jd_mix_rule_config()['params'])
         if not all(res):
             raise ValidationError(_("請在配置裡填寫必要信息"))
         return res
 
+    def jd_mix_rule_log_request(self, record, func):
+        """
+        :param record: JDRequestRecord, 只有開啟調試日誌並被採樣到的請求才會格式化寫入
+        """
+        self.log_xml(str(record), func)
+
     def jd_mix_rule_new_api(self):
         params = self.jd_mix_rule_config_params()
-        return JDApi(
-            *params[:3], self.log_xml, prod_environment=self.prod_environment,
+        config = self._jd_mix_rule_config()
+        return new_jd_client(
+            self.env, 'delivery_jd_mix_rule', *params[:3], self.jd_mix_rule_log_request,
+            prod_environment=self.prod_environment, base_uri=config['base_uri'],
+            session_options=(('pool_maxsize', max(config['max_workers'], jd_session.DEFAULT_POOL_MAXSIZE)),),
+            debug_logging=self.debug_logging, log_sample_rate=config['log_sample_rate'],
         ), params[-1]
 
     @api.model
-    @tools.ormcache('order.id')
-    def _jd_mix_rule_rate_shipment(self, order):
-        if not order:
-            return False
+    def _jd_mix_rule_precheck_vals(self, sender_address, receiver_address, customer_code):
+        # 可達性只和地址有關, 使用默認產品預檢
+        return [apply_product({
+            "senderContact": {
+                "fullAddress": sender_address
+            },
+            "receiverContact": {
+                "fullAddress": receiver_address
+            },
+            "customerCode": customer_code,
+        }, self._jd_mix_rule_config()['products'][0])]
+
+    @api.model
+    def _jd_mix_rule_dispatch(self, vals):
+        """
+        按貨物重量選擇京東產品, 單個包裹超過快遞上限並且配置了快運時走快運
+        :return: 替換了下單來源和產品編碼的下單數據
+        """
+        config = self._jd_mix_rule_config()
+        weights = [cargo.get('weight') or 0.0 for cargo in vals['cargoes']]
+        products = eligible_products(config['products'], sum(weights), max(weights, default=0.0))
+        # 沒有適用的產品時沿用默認產品, 由京東返回失敗原因
+        product = fastest_product(products) if products else config['products'][0]
+        vals = apply_product(vals, product)
+        if product.order_origin == FREIGHT_ORDER_ORIGIN:
+            vals['businessUnitCode'] = config['business_unit_code']
+        return vals
+
+    @api.model
+    def _jd_mix_rule_check_addresses(self, addresses):
+        """
+        :param addresses: [(寄件地址, 收件地址), ...]
+        :return: 與 addresses 順序一致的 [True/False, 請求異常時為 None]
+        """
+        if not addresses:
+            return []
         api, customer_code = self.jd_mix_rule_new_api()
-        try:
-            pre_check_result = api.ecap_v1_orders_precheck([{
-                "senderContact": {
-                    "fullAddress": order.company_id.partner_id._display_address()
-                },
-                "receiverContact": {
-                    "fullAddress": order.partner_shipping_id._display_address()
-                },
-                "orderOrigin": "1",
-                "customerCode": customer_code,
-                "productsReq": {
-                    "productCode": "ed-m-0001",
-                }
-            }]).json()
-            return pre_check_result.get('success')
-        except Exception as e:
-            return False
+        jobs = [(api, 'ecap_v1_orders_precheck', self._jd_mix_rule_precheck_vals(sender, receiver, customer_code))
+                for sender, receiver in addresses]
+        return [None if exc else bool(pre_check_result and pre_check_result.get('success'))
+                for pre_check_result, exc in jd_executor.fan_out(jobs, self._jd_mix_rule_config()['max_workers'])]
 
-    def jd_mix_rule_rate_shipment(self, order):
-        # 先驗證是否支持京東物流
-        success = self._jd_mix_rule_rate_shipment(order)
+    @api.model
+    def _jd_mix_rule_check_serviceable(self, orders):
+        """
+        先查區域索引, 其餘按 寄件地址 + 收件地址 緩存是否支持京東物流
+        :return: {order.id: True/False, 京東接口不可用或熔斷中時為 None}
+        """
+        orders = orders.filtered('partner_shipping_id')
+        if not orders:
+            return {}
+        api, customer_code = self.jd_mix_rule_new_api()
+        regions = self.env['delivery.jd.region'].sudo()
+        region_index = regions.get_index()
+        res, keys, to_check = {}, {}, {}
+        for order in orders:
+            sender_partner = order_sender_partner(order)
+            region_key = regions.region_key(sender_partner, order.partner_shipping_id)
+            if region_key and region_index.get(region_key):
+                res[order.id] = True
+                continue
+            sender = normalize_address(sender_partner._display_address())
+            receiver = normalize_address(order.partner_shipping_id._display_address())
+            key = keys[order.id] = (self.env.cr.dbname, api.base_uri, customer_code, sender, receiver)
+            cached = _serviceability_cache.get(key)
+            if cached is not jd_cache.MISSING:
+                res[order.id] = cached
+            elif key not in to_check:
+                to_check[key] = region_key
+        checked, region_results = {}, {}
+        for key, serviceable in zip(to_check, self._jd_mix_rule_check_addresses([key[-2:] for key in to_check])):
+            checked[key] = serviceable
+            if serviceable is None:
+                continue
+            _serviceability_cache.set(key, serviceable,
+                                      SERVICEABILITY_TTL if serviceable else SERVICEABILITY_NEGATIVE_TTL)
+            region_key = to_check[key]
+            if region_key and (serviceable or region_key not in region_results):
+                region_results[region_key] = (serviceable, *key[-2:])
+        regions.record_results(region_results)
+        for order in orders:
+            if order.id not in res:
+                res[order.id] = checked[keys[order.id]]
+        return res
+
+    @api.model
+    def jd_mix_rule_invalidate_serviceability(self, partners=None, negative_only=False):
+        """
+        :param partners: 只清除這些收件地址的緩存, 為空時清除全部
+        """
+        addresses = partners and {normalize_address(p._display_address()) for p in partners}
+        return _serviceability_cache.pop_matching(
+            lambda key, value: (not negative_only or not value) and (not partners or key[-1] in addresses))
+
+    def _jd_mix_rule_rate_shipment(self, order):
+        return self._jd_mix_rule_check_serviceable(order).get(order.id, False)
+
+    def _jd_mix_rule_rate_shipment_result(self, order, success):
+        if success is None:
+            return {'success': False,
+                    'price': 0.0,
+                    'error_message': "京東物流暫時無法連接, 請稍後再試",
+                    'warning_message': False}
         if not success:
             return {'success': False,
                     'price': 0.0,
@@ -69,66 +204,150 @@ class DeliveryCarrier(models.Model):
                     'warning_message': False}
         return self.base_on_rule_rate_shipment(order)
 
-    def jd_mix_rule_send_shipping(self, pickings):
-        bor_result = self.base_on_rule_send_shipping(pickings)
-        api, customer_code = self.jd_mix_rule_new_api()
-        for index, picking in enumerate(pickings):
-            order = self.env['sale.order'].search([('name', '=', picking.origin)], limit=1)
-            partner = order.partner_shipping_id or order.partner_id
-            data = [{
-                "orderId": picking.origin,
-                "senderContact": {
-                    "name": order.company_id.name,
-                    "mobile": order.company_id.mobile,
-                    "phone": order.company_id.phone,
-                    "fullAddress": order.company_id.partner_id._display_address()
-                },
-                "receiverContact": {
-                    "name": partner.name,
-                    "mobile": partner.mobile,
-                    "phone": partner.phone,
-                    "fullAddress": partner._display_address()
-                },
-                "orderOrigin": "1",
-                "customerCode": customer_code,
-                "productsReq": {
-                    "productCode": "ed-m-0001",
-                },
-                "settleType": "3",
-                "cargoes": [
-                    {
-                        "name": order.order_line[0].product_id.name,
-                        "quantity": 1,
-                        "weight": 1,
-                        "volume": 10,
-                    }
-                ],
-                "CommonChannelInfo": {
-                    "channelCode": "0030001"
+    def jd_mix_rule_rate_shipment(self, order):
+        # 先驗證是否支持京東物流
+        return self._jd_mix_rule_rate_shipment_result(order, self._jd_mix_rule_rate_shipment(order))
+
+    def jd_mix_rule_rate_shipment_multi(self, orders):
+        """
+        對多個訂單同時驗證地址, 同一個訂單的結果由所有物流共用
+        :return: {(carrier.id, order.id): {'success', 'price', 'error_message', 'warning_message'}}
+        """
+        supported = self._jd_mix_rule_check_serviceable(orders)
+        return {
+            (carrier.id, order.id): carrier._jd_mix_rule_rate_shipment_result(order, supported.get(order.id, False))
+            for carrier in self for order in orders
+        }
+
+    @api.model
+    def jd_mix_rule_pickings_cargoes(self, pickings):
+        """
+        按裝箱的包裹申報重量和體積, 沒有裝箱的部分合併為一個包裹
+        :return: {picking.id: [cargo]}
+        """
+        default_package_type = self.env.ref('delivery_jd_mix_rule.jd_mix_rule_b2c_parcel', raise_if_not_found=False)
+        res = pickings_package_cargoes(pickings, default_package_type)
+        for cargoes in res.values():
+            for cargo in cargoes:
+                cargo['weight'] = cargo['weight'] or DEFAULT_CARGO_WEIGHT
+                cargo['volume'] = cargo['volume'] or DEFAULT_CARGO_VOLUME
+        return res
+
+    def _jd_mix_rule_prepare_shipping_vals(self, picking, customer_code, order=None, cargoes=None, sender=None):
+        """
+        :param sender: 寄件地址, 為空時按調撥所在倉庫確定
+        """
+        if order is None:
+            order = pickings_sale_orders(picking)[picking.id]
+        if cargoes is None:
+            cargoes = self.jd_mix_rule_pickings_cargoes(picking)[picking.id]
+        if sender is None:
+            sender = pickings_sender_partners(picking, {picking.id: order})[picking.id]
+        partner = order.partner_shipping_id or order.partner_id
+        return self._jd_mix_rule_dispatch({
+            "orderId": shipping_order_id(picking, order, self._jd_mix_rule_config()['split_shipment']),
+            "senderContact": sender_contact(sender, order.company_id),
+            "receiverContact": {
+                "name": partner.name,
+                "mobile": partner.mobile,
+                "phone": partner.phone,
+                "fullAddress": partner._display_address()
+            },
+            "customerCode": customer_code,
+            "settleType": "3",
+            "cargoes": cargoes or [
+                {
+                    "name": order.order_line[0].product_id.name,
+                    "quantity": 1,
+                    "weight": DEFAULT_CARGO_WEIGHT,
+                    "volume": DEFAULT_CARGO_VOLUME,
                 }
-            }]
-            result = api.orders_create(data).json()
-            if not result['success']:
-                raise ValidationError(result['msg'])
+            ],
+            "CommonChannelInfo": {
+                "channelCode": "0030001"
+            }
+        })
+
+    def jd_mix_rule_send_shipping_batch(self, pickings):
+        """
+        運費沿用基於規則的計算, 下單接口每次只處理一個訂單(批量大小默認為 1), 各組之間並發請求
+        :return: {picking.id: {'exact_price', 'tracking_number'} 或 {'error': 失敗原因}}
+        """
+        self.ensure_one()
+        api, customer_code = self.jd_mix_rule_new_api()
+        results, prepared = {}, []
+        orders = pickings_sale_orders(pickings)
+        if self._jd_mix_rule_config()['split_shipment']:
+            self.env['sale.order'].union(*orders.values()).picking_ids.read(['picking_type_code', 'state'])
+        cargoes = self.jd_mix_rule_pickings_cargoes(pickings)
+        senders = pickings_sender_partners(pickings, orders)
+        for picking in pickings:
+            try:
+                bor_result = self.base_on_rule_send_shipping(picking)[0]
+                prepared.append((picking, bor_result, self._jd_mix_rule_prepare_shipping_vals(
+                    picking, customer_code, orders[picking.id], cargoes[picking.id], senders[picking.id])))
+            except (ValidationError, UserError) as e:
+                results[picking.id] = {'error': e.args[0]}
+        batches = call_in_batches(api, 'orders_create', prepared, lambda rec: rec[2], lambda val: val['orderId'],
+                                  api.ORDERS_BATCH_SIZE, self._jd_mix_rule_config()['max_workers'])
+        for (picking, bor_result, _val), val, item in batches:
+            if item['success']:
+                results[picking.id] = dict(bor_result, tracking_number=item['data']['waybillCode'],
+                                           order_origin=val['orderOrigin'])
             else:
-                bor_result[index]['tracking_number'] = result['data']['waybillCode']
-        return bor_result
+                results[picking.id] = {'error': item['msg']}
+        return results
 
-    def jd_mix_rule_cancel_shipment(self, pickings):
+    def jd_mix_rule_send_shipping(self, pickings):
+        results = dict(self.env.context.get('jd_mix_rule_shipping_results') or {})
+        missing = pickings.filtered(lambda p: p.id not in results)
+        if missing:
+            results.update(self.jd_mix_rule_send_shipping_batch(missing))
+        res = []
+        for picking in pickings:
+            if 'error' in results[picking.id]:
+                raise ValidationError(results[picking.id]['error'])
+            # 取消運單時需要使用下單時的下單來源
+            picking.jd_mix_rule_order_origin = results[picking.id].get('order_origin')
+            res.append(results[picking.id])
+        return res
+
+    def _jd_mix_rule_cancel_vals(self, picking, customer_code):
+        vals = {
+            "waybillCode": picking.carrier_tracking_ref,
+            "orderOrigin": picking.jd_mix_rule_order_origin or "1",
+            "customerCode": customer_code,
+            "cancelReason": "用户发起取消",
+            "cancelReasonCode": "1",
+            "cancelType": 1
+        }
+        if picking.jd_mix_rule_order_origin == FREIGHT_ORDER_ORIGIN:
+            vals['businessUnitCode'] = self._jd_mix_rule_config()['business_unit_code']
+        return vals
+
+    def jd_mix_rule_cancel_shipment_batch(self, pickings):
+        """
+        運單按批量大小分組, 每組調用一次取消接口, 多組之間並發請求, 某條失敗不影響其他運單
+        :return: {picking.id: {'success': bool, 'msg': 失敗原因}}
+        """
+        self.ensure_one()
         self = self.sudo()
         api, customer_code = self.jd_mix_rule_new_api()
-        for picking in pickings:
-            data = [{
-                "waybillCode": picking.carrier_tracking_ref,
-                "orderOrigin": "1",
-                "customerCode": customer_code,
-                "cancelReason": "用户发起取消",
-                "cancelReasonCode": "1",
-                "cancelType": 1
-            }]
-            result = api.orders_cancel(data).json()
-            if not result['success']:
-                raise ValidationError(result['subMsg'])
+        batches = call_in_batches(api, 'orders_cancel', pickings,
+                                  lambda picking: self._jd_mix_rule_cancel_vals(picking, customer_code),
+                                  lambda val: val['waybillCode'], api.ORDERS_BATCH_SIZE,
+                                  self._jd_mix_rule_config()['max_workers'])
+        return {picking.id: {'success': item['success'], 'msg': item['msg']} for picking, _val, item in batches}
+
+    def jd_mix_rule_cancel_shipment(self, pickings):
+        """
+        取消成功的調撥清空運單號, 失敗的保留運單號並記錄原因, 只有全部失敗時才報錯
+        """
+        results = self.jd_mix_rule_cancel_shipment_batch(pickings)
+        cancelled, failed = pickings._jd_mix_rule_apply_cancel_results(results)
+        if failed and not cancelled:
+            raise ValidationError("\n".join("%s: %s" % (picking.carrier_tracking_ref, results[picking.id]['msg'])
+                                            for picking in failed))
 
     def jd_mix_rule_get_tracking_link(self, picking):
         return 'https://www.jdl.com/orderSearch/?waybillCodes=%s' % picking.carrier_tracking_ref
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import re
+import threading
+import time
+
+from odoo import api, fields, models, registry
+
+_logger = logging.getLogger(__name__)
+
+REGION_INDEX_RELOAD = 300
+REGION_REFRESH_DAYS = 7
+REGION_REFRESH_LIMIT = 200
+DISTRICT_RE = re.compile(r'([^\s\d省市]{1,10}?(?:自治县|区|县|旗|市))')
+
+# {dbname: (加載時間, {region_key: serviceable})}
+_region_index = {}
+_region_index_lock = threading.Lock()
+
+
+class JDRegion(models.Model):
+    _name = 'delivery.jd.region'
+    _description = '京東物流區域可達索引'
+    _rec_name = 'region_key'
+
+    region_key = fields.Char(string="區域", required=True, help="寄件區域 > 收件區域")
+    serviceable = fields.Boolean(string="支持京東物流")
+    sender_address = fields.Char(string="寄件地址")
+    sample_address = fields.Char(string="樣本收件地址", help="後台刷新時用來重新預檢的地址")
+    last_check_date = fields.Datetime(string="最後檢查時間", index=True)
+
+    _sql_constraints = [
+        ('region_key_uniq', 'unique(region_key)', '區域必須唯一'),
+    ]
+
+    @api.model
+    def region_key_from_partner(self, partner):
+        """
+        省/市/區 組成區域, 區縣從街道地址裡解析, 缺少省和市時返回 False
+        """
+        state, city = partner.state_id.name or '', (partner.city or '').strip()
+        if not state and not city:
+            return False
+        street = "".join(filter(None, [partner.street, partner.street2]))
+        for name in (state, city):
+            if name:
+                street = street.replace(name, '')
+        match = DISTRICT_RE.search(street)
+        return "/".join([partner.country_id.code or '', state, city, match and match.group(1) or ''])
+
+    @api.model
+    def region_key(self, sender, receiver):
+        """
+        同一個收件區域從不同倉庫寄出時結果可能不同, 區域包含寄件區域, 任一邊缺少省和市時返回 False
+        """
+        sender_key, receiver_key = self.region_key_from_partner(sender), self.region_key_from_partner(receiver)
+        return sender_key and receiver_key and "%s>%s" % (sender_key, receiver_key)
+
+    @api.model
+    def get_index(self):
+        """
+        進程內的區域索引, 查詢都是 O(1) 的字典查找, 每隔一段時間從數據庫重新加載
+        """
+        dbname = self.env.cr.dbname
+        loaded = _region_index.get(dbname)
+        if loaded and time.time() - loaded[0] < REGION_INDEX_RELOAD:
+            return loaded[1]
+        with _region_index_lock:
+            self.env.cr.execute("SELECT region_key, serviceable FROM delivery_jd_region")
+            index = dict(self.env.cr.fetchall())
+            _region_index[dbname] = (time.time(), index)
+        return index
+
+    @api.model
+    def record_results(self, results):
+        """
+        :param results: {region_key: (serviceable, 寄件地址, 收件地址)}
+        只寫入新的或者結果有變化的區域, 使用單獨的游標, 不佔用業務事務的行鎖
+        """
+        dbname = self.env.cr.dbname
+        changed = {key: value for key, value in results.items() if self.get_index().get(key) != value[0]}
+        if not changed:
+            return
+        # 其他線程可能正在讀取索引, 複製一份修改後再替換
+        with _region_index_lock:
+            loaded = _region_index.get(dbname)
+            if loaded:
+                index = dict(loaded[1])
+                index.update((key, value[0]) for key, value in changed.items())
+                _region_index[dbname] = (loaded[0], index)
+        query = """
+            INSERT INTO delivery_jd_region (region_key, serviceable, sender_address, sample_address, last_check_date,
+                                            create_uid, create_date, write_uid, write_date)
+            VALUES {values}
+            ON CONFLICT (region_key) DO UPDATE SET serviceable = EXCLUDED.serviceable,
+                                                   sender_address = EXCLUDED.sender_address,
+                                                   sample_address = EXCLUDED.sample_address,
+                                                   last_check_date = EXCLUDED.last_check_date,
+                                                   write_uid = EXCLUDED.write_uid,
+                                                   write_date = EXCLUDED.write_date
+        """.format(values=", ".join([
+            "(%s, %s, %s, %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'))"
+        ] * len(changed)))
+        params = [param for key, (serviceable, sender, receiver) in sorted(changed.items())
+                  for param in (key, serviceable, sender, receiver, self.env.uid, self.env.uid)]
+        try:
+            with registry(dbname).cursor() as cr:
+                cr.execute(query, params)
+        except Exception:
+            _logger.warning("寫入京東物流區域索引失敗", exc_info=True)
+
+    @api.model
+    def _cron_refresh_jd_regions(self):
+        """
+        用樣本地址重新預檢長時間沒有檢查過的區域
+        """
+        regions = self.search([
+            ('last_check_date', '<', fields.Datetime.subtract(fields.Datetime.now(), days=REGION_REFRESH_DAYS)),
+            ('sample_address', '!=', False),
+        ], order='last_check_date', limit=REGION_REFRESH_LIMIT)
+        carrier = self.env['delivery.carrier'].search([('delivery_type', '=', 'jd_mix_rule')], limit=1)
+        if not regions or not carrier:
+            return
+        checked = carrier._jd_mix_rule_check_addresses(
+            [(region.sender_address, region.sample_address) for region in regions])
+        for region, serviceable in zip(regions, checked):
+            if serviceable is not None:
+                region.write({'serviceable': serviceable, 'last_check_date': fields.Datetime.now()})
+        _region_index.pop(self.env.cr.dbname, None)
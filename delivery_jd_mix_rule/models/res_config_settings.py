@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+
+from odoo import fields, models
+from odoo.addons.delivery_jd_hooks.api import jd_executor
+from odoo.addons.delivery_jd_hooks.tools.jd_dispatch import FREIGHT_PRODUCT_CODE
+
+
+class ResConfigSettings(models.TransientModel):
+    _inherit = 'res.config.settings'
+
+    jd_mix_rule_product_code = fields.Char(string="快遞產品編碼", config_parameter="delivery_jd_mix_rule.product_code",
+                                           default='ed-m-0001', help="默認 京東標快")
+    jd_mix_rule_business_unit_code = fields.Char(string="事業部編碼",
+                                                 config_parameter="delivery_jd_mix_rule.business_unit_code",
+                                                 help="填寫後超過 30kg 的貨物走快運")
+    jd_mix_rule_freight_product_code = fields.Char(string="快運產品編碼",
+                                                   config_parameter="delivery_jd_mix_rule.freight_product_code",
+                                                   default=FREIGHT_PRODUCT_CODE)
+    jd_mix_rule_split_shipment = fields.Boolean(string="多倉拆單發貨",
+                                                config_parameter="delivery_jd_mix_rule.split_shipment",
+                                                help="同一訂單分多張調撥從不同倉庫發貨時, 京東訂單號使用 訂單號-調撥ID 區分")
+    jd_mix_rule_max_workers = fields.Integer(string="並發請求數", config_parameter="delivery_jd_mix_rule.max_workers",
+                                             default=jd_executor.DEFAULT_MAX_WORKERS,
+                                             help="批量檢查可達性, 下單和取消時同時請求京東的數量")
+    jd_mix_rule_log_sample_rate = fields.Float(string="調試日誌採樣比例",
+                                               config_parameter="delivery_jd_mix_rule.log_sample_rate", default=1.0,
+                                               help="物流開啟調試日誌時按這個比例記錄請求, 1 為全部記錄")
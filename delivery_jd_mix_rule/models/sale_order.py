@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+
+from odoo import models
+
+
+class SaleOrder(models.Model):
+    _inherit = 'sale.order'
+
+    def write(self, vals):
+        res = super().write(vals)
+        if vals.get('partner_shipping_id'):
+            # 重新選擇收件地址時, 之前緩存的 "不支持" 結果不再沿用
+            self.env['delivery.carrier'].jd_mix_rule_invalidate_serviceability(
+                self.partner_shipping_id, negative_only=True)
+        return res
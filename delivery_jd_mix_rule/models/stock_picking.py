@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from odoo import fields, models, _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+
+class StockPicking(models.Model):
+    _inherit = 'stock.picking'
+
+    jd_mix_rule_order_origin = fields.Selection(selection=[('1', '快遞B2C'), ('4', '快運B2C')],
+                                                string="京東下單來源", readonly=True, copy=False)
+
+    def _jd_mix_rule_pickings_to_ship(self):
+        # 與 delivery 模塊 _send_confirmation_email 裡自動下單的條件保持一致
+        return self.filtered(lambda p: p.carrier_id.delivery_type == 'jd_mix_rule'
+                                       and p.carrier_id.integration_level == 'rate_and_ship'
+                                       and p.picking_type_code != 'incoming'
+                                       and not p.carrier_tracking_ref
+                                       and p.picking_type_id.print_label)
+
+    def _send_confirmation_email(self):
+        to_ship = self._jd_mix_rule_pickings_to_ship()
+        if len(to_ship) < 2:
+            return super()._send_confirmation_email()
+        # 批量驗證時先按物流分組批量下單, 再交給原有流程逐條回寫運單號和運費
+        results, errors = {}, {}
+        for carrier in to_ship.carrier_id:
+            batch = carrier.jd_mix_rule_send_shipping_batch(to_ship.filtered(lambda p: p.carrier_id == carrier))
+            for picking_id, res in batch.items():
+                if 'error' in res:
+                    errors[picking_id] = res['error']
+                else:
+                    results[picking_id] = res
+        if errors:
+            self.browse(list(results))._jd_mix_rule_cancel_created(results)
+            raise UserError(_("以下調撥京東物流下單失敗, 請處理後重新驗證:\n%s", "\n".join(
+                "%s: %s" % (picking.name, errors[picking.id]) for picking in self.browse(list(errors)))))
+        return super(StockPicking, self.with_context(jd_mix_rule_shipping_results=results)
+                     )._send_confirmation_email()
+
+    def _jd_mix_rule_cancel_created(self, results):
+        """
+        整批驗證失敗會回滾, 先取消這批已經生成的運單, 避免京東留下沒有對應調撥的運單
+        :param results: jd_mix_rule_send_shipping_batch 中下單成功的結果
+        """
+        for picking in self:
+            picking.write({'carrier_tracking_ref': results[picking.id]['tracking_number'],
+                           'jd_mix_rule_order_origin': results[picking.id].get('order_origin')})
+        for carrier in self.carrier_id:
+            carrier_pickings = self.filtered(lambda p: p.carrier_id == carrier)
+            cancel_results = carrier.jd_mix_rule_cancel_shipment_batch(carrier_pickings)
+            for picking in carrier_pickings:
+                if not cancel_results[picking.id]['success']:
+                    _logger.warning("取消京東運單 %s 失敗: %s", picking.carrier_tracking_ref,
+                                    cancel_results[picking.id]['msg'])
+
+    def _jd_mix_rule_apply_cancel_results(self, results):
+        """
+        取消成功的調撥清空運單號, 失敗的保留運單號並在調撥上記錄原因
+        :param results: jd_mix_rule_cancel_shipment_batch 的結果
+        :return: (已取消的調撥, 取消失敗的調撥)
+        """
+        cancelled, failed = self.browse(), self.browse()
+        for picking in self:
+            if results[picking.id]['success']:
+                picking.message_post(body=_("Shipment %s cancelled", picking.carrier_tracking_ref))
+                cancelled |= picking
+            else:
+                picking.message_post(body=_("京東運單 %s 取消失敗: %s",
+                                            picking.carrier_tracking_ref, results[picking.id]['msg']))
+                failed |= picking
+        cancelled.write({'carrier_tracking_ref': False})
+        return cancelled, failed
+
+    def cancel_shipment(self):
+        # 京東運單由 jd_mix_rule_cancel_shipment 逐張清空運單號, 部分失敗時已取消的運單不會被回滾
+        jd_pickings = self.filtered(lambda p: p.carrier_id.delivery_type == 'jd_mix_rule')
+        for carrier in jd_pickings.carrier_id:
+            carrier.jd_mix_rule_cancel_shipment(jd_pickings.filtered(lambda p: p.carrier_id == carrier))
+        return super(StockPicking, self - jd_pickings).cancel_shipment()
+
+    def action_jd_mix_rule_cancel_shipment_batch(self):
+        """
+        批量取消京東運單, 按物流分組批量請求, 失敗的運單保留運單號並在調撥上記錄原因
+        :return: 取消結果的通知
+        """
+        pickings = self.filtered(lambda p: p.carrier_id.delivery_type == 'jd_mix_rule' and p.carrier_tracking_ref)
+        cancelled, failed = self.browse(), self.browse()
+        for carrier in pickings.carrier_id:
+            carrier_pickings = pickings.filtered(lambda p: p.carrier_id == carrier)
+            carrier_cancelled, carrier_failed = carrier_pickings._jd_mix_rule_apply_cancel_results(
+                carrier.jd_mix_rule_cancel_shipment_batch(carrier_pickings))
+            cancelled |= carrier_cancelled
+            failed |= carrier_failed
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _("取消京東運單"),
+                'message': _("已取消 %s 個運單, 失敗 %s 個, 跳過 %s 個沒有京東運單的調撥",
+                             len(cancelled), len(failed), len(self - pickings)),
+                'type': 'warning' if failed else 'success',
+                'sticky': bool(failed),
+            },
+        }
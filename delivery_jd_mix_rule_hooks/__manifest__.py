@@ -6,7 +6,7 @@
     "version": "16.0.0.0.1",
     "category": "Project",
     "website": "https://www.sooscake.site",
-    "depends": ["stock"],
+    "depends": ["stock", "delivery_jd_hooks"],
     "data": [
         "views/res_config_settings_views.xml",
     ],